@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+
+class SeenAuctionCache:
+    """auction_id -> digest of the auction content for every auction of the last parsed snapshot."""
+
+    def __init__(self, path: Path, max_size: int = 2_000_000):
+        self.path = path
+        self.max_size = max_size
+        self.entries = {} #insertion ordered, oldest first
+        self.pending = None #digests of a snapshot parsed but not committed yet, the base of the next diff
+        self.load()
+
+    @staticmethod
+    def auction_key(auction) -> str:
+        return auction.get('auction_id') or auction.get('uuid')
+
+    @staticmethod
+    def digest(auction) -> int:
+        h = hashlib.blake2b(digest_size=8)
+        h.update(auction.get('item_bytes', '').encode())
+        h.update(str(auction.get('price') or auction.get('starting_bid')).encode())
+        return int.from_bytes(h.digest(), 'big')
+
+    def diff(self, auctions) -> tuple[list, dict]:
+        """Return (new or changed auctions, digests of the whole snapshot to commit once it is parsed)."""
+        base = self.entries if self.pending is None else self.pending
+        fresh = []
+        current = {}
+        for auction in auctions:
+            key = self.auction_key(auction)
+            digest = self.digest(auction)
+            current[key] = digest
+            if base.get(key) != digest:
+                fresh.append(auction)
+        return fresh, current
+
+    def stage(self, current: dict, failed: set | None = None):
+        #snapshot parsed, the next diff may start before its commit (pipeline producer runs ahead of the loader)
+        if failed:
+            for key in failed:
+                current.pop(key, None) #decode again next time, e.g. after a parser fix
+        self.pending = current
+
+    def discard_pending(self, current: dict | None = None):
+        #staged snapshot that will never be committed (failed write, pipeline stopped); None = whatever is staged
+        if current is None or self.pending is current:
+            self.pending = None
+
+    def commit(self, current: dict, failed: set | None = None):
+        #auctions missing from the snapshot are evicted by replacing entries with the snapshot itself
+        if failed:
+            for key in failed:
+                current.pop(key, None)
+        if self.pending is current:
+            self.pending = None
+        if len(current) > self.max_size:
+            keys = list(current)[len(current) - self.max_size:]
+            current = {key: current[key] for key in keys}
+        self.entries = current
+        self.save()
+
+    def load(self):
+        if not self.path.exists():
+            return
+        with self.path.open('r', encoding='utf-8') as f:
+            self.entries = dict(json.load(f))
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        with tmp.open('w', encoding='utf-8') as f:
+            json.dump(list(self.entries.items()), f, separators=(',', ':'))
+        os.replace(tmp, self.path) #never leave a half written cache behind
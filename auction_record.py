@@ -0,0 +1,103 @@
+from collections.abc import Mapping
+from constants import key_extra
+
+"""
+Compact parsed auction.
+Parser.filter_single_auction used to return a ~60 key dict per auction with most values None.
+AuctionRecord keeps the always present fields in __slots__, stores pet_info / fishing_parts as tuples
+and keeps only the key_extra attributes that are actually set.
+It is a Mapping with the exact key set of the old dict, so `.get()` / `[]` / `dict(record)` work as before
+and `to_dict()` gives the old JSON shape.
+"""
+
+NESTED_KEYS = ('necromancer_souls', 'hook', 'line', 'sinker', 'gems') #parsed into their own fields
+PASSTHROUGH_KEYS = tuple(key for key in key_extra if key not in NESTED_KEYS)
+PET_INFO_KEYS = ('level', 'tier', 'candy_used', 'held_item', 'pet_skin')
+FISHING_PART_KEYS = ('hook', 'line', 'sinker')
+
+_FIELDS = ('auction_id', 'price', 'name', 'item_id', 'pet_info', 'gems', 'fishing_parts', 'necromancer_souls')
+_KEY_ORDER = _FIELDS + PASSTHROUGH_KEYS + ('snapshot_ts',)
+_PASSTHROUGH_SET = frozenset(PASSTHROUGH_KEYS)
+
+
+class AuctionRecord(Mapping):
+    __slots__ = ('auction_id', 'price', 'name', 'item_id', '_pet_info', 'gems', '_fishing_parts', 'necromancer_souls',
+                 'extra', 'snapshot_ts')
+
+    def __init__(self, auction_id, price, name=None, item_id=None, pet_info=None, gems=None, fishing_parts=None,
+                 necromancer_souls=None, extra=None, snapshot_ts=None):
+        self.auction_id = auction_id
+        self.price = price
+        self.name = name
+        self.item_id = item_id
+        self.pet_info = pet_info
+        self.gems = gems
+        self.fishing_parts = fishing_parts
+        self.necromancer_souls = necromancer_souls
+        self.extra = extra or None #only key_extra attributes that are set
+        self.snapshot_ts = snapshot_ts
+
+    @property
+    def pet_info(self) -> dict:
+        values = self._pet_info or (None,) * len(PET_INFO_KEYS)
+        return dict(zip(PET_INFO_KEYS, values))
+
+    @pet_info.setter
+    def pet_info(self, value: dict | None):
+        values = tuple((value or {}).get(key) for key in PET_INFO_KEYS)
+        self._pet_info = values if any(v is not None for v in values) else None
+
+    @property
+    def fishing_parts(self) -> dict:
+        values = self._fishing_parts or (None,) * len(FISHING_PART_KEYS)
+        return dict(zip(FISHING_PART_KEYS, values))
+
+    @fishing_parts.setter
+    def fishing_parts(self, value: dict | None):
+        values = tuple((value or {}).get(key) for key in FISHING_PART_KEYS)
+        self._fishing_parts = values if any(v is not None for v in values) else None
+
+    def __getitem__(self, key):
+        if key in _PASSTHROUGH_SET:
+            return self.extra.get(key) if self.extra else None
+        if key in _FIELDS or key == 'snapshot_ts':
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in _PASSTHROUGH_SET:
+            if value is not None:
+                self.extra = self.extra or {}
+                self.extra[key] = value
+            elif self.extra:
+                self.extra.pop(key, None)
+        elif key in _FIELDS or key == 'snapshot_ts':
+            setattr(self, key, value)
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        return iter(_KEY_ORDER)
+
+    def __len__(self):
+        return len(_KEY_ORDER)
+
+    def __repr__(self):
+        return f"AuctionRecord({self.auction_id!r}, price={self.price!r}, item_id={self.item_id!r})"
+
+    def __getstate__(self):
+        return (self.auction_id, self.price, self.name, self.item_id, self._pet_info, self.gems, self._fishing_parts,
+                self.necromancer_souls, self.extra, self.snapshot_ts)
+
+    def __setstate__(self, state):
+        (self.auction_id, self.price, self.name, self.item_id, self._pet_info, self.gems, self._fishing_parts,
+         self.necromancer_souls, self.extra, self.snapshot_ts) = state
+
+    def to_dict(self) -> dict:
+        return {key: self[key] for key in _KEY_ORDER}
+
+    @classmethod
+    def from_dict(cls, data: Mapping) -> 'AuctionRecord':
+        extra = {key: data[key] for key in PASSTHROUGH_KEYS if data.get(key) is not None}
+        return cls(data.get('auction_id'), data.get('price'), data.get('name'), data.get('item_id'), data.get('pet_info'),
+                   data.get('gems'), data.get('fishing_parts'), data.get('necromancer_souls'), extra, data.get('snapshot_ts'))
@@ -0,0 +1,387 @@
+import argparse
+import base64
+import datetime
+import gzip
+import json
+import platform
+import random
+import resource
+import struct
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+import fast_nbt
+import utils
+from constants import key_extra
+from data_loader import DataLoader, BULK_QUERIES
+from database_setup import db_setup, connect
+from logger_config import setup_logger
+from parser import Parser
+
+"""
+Offline benchmark of the collect -> parse -> load -> dataframe pipeline.
+A synthetic snapshot with realistic item_bytes (gzip + base64 NBT of pets, gemmed / enchanted gear, fishing rods
+with parts, necromancer swords with souls) is generated from a seed, so runs on different machines are comparable.
+Every stage is timed on its own and the parse -> load -> dataframe chain end to end; throughput, peak RSS and the
+database write rate go to a JSON file that can be compared against a stored baseline.
+
+python benchmark.py --auctions 20000 --output bench.json --baseline benchmarks/baseline.json
+"""
+
+LOGGER_CONF = ('benchmark', 'benchmark.log')
+DEFAULT_TOLERANCE = 0.10 #slower than the baseline by more than this -> regression
+
+PETS = ('ENDER_DRAGON', 'GOLDEN_DRAGON', 'BLUE_WHALE', 'TIGER', 'ELEPHANT', 'GRIFFIN', 'BAL', 'SCATHA')
+PET_ITEMS = ('PET_ITEM_TIER_BOOST', 'PET_ITEM_QUICK_CLAW', 'MINOS_RELIC', 'PET_ITEM_LUCKY_CLOVER', None)
+TIERS = ('COMMON', 'UNCOMMON', 'RARE', 'EPIC', 'LEGENDARY', 'MYTHIC')
+GEAR = ('HYPERION', 'TERMINATOR', 'NECRON_CHESTPLATE', 'SHADOW_ASSASSIN_HELMET', 'DIVAN_DRILL', 'ASPECT_OF_THE_END')
+MODIFIERS = ('heroic', 'withered', 'fabled', 'ancient', 'giant', 'necrotic', 'spiritual')
+ENCHANTMENTS = ('sharpness', 'critical', 'ender_slayer', 'giant_killer', 'ultimate_wise', 'protection', 'growth',
+                'power', 'overload', 'ultimate_soul_eater', 'looting', 'scavenger', 'vampirism')
+GEMS = ('RUBY', 'AMETHYST', 'JADE', 'SAPPHIRE', 'AMBER', 'TOPAZ', 'JASPER', 'OPAL')
+GEM_QUALITIES = ('ROUGH', 'FLAWED', 'FINE', 'FLAWLESS', 'PERFECT')
+RUNES = ('BLOOD_2', 'MUSIC', 'ZOMBIE_SLAYER', 'RAINBOW', 'SOULTWIST')
+HOOKS = ('common_hook', 'hotspot_hook', 'phantom_hook', 'treasure_hook')
+LINES = ('speedy_line', 'shredded_line', 'titan_line')
+SINKERS = ('junk_sinker', 'prismarine_sinker', 'sponge_sinker', 'chum_sinker', 'hotspot_sinker')
+SOUL_MOBS = ('MASTER_CRYPT_TANK_ZOMBIE_70', 'ZOMBIE_COMMANDER', 'LOST_ADVENTURER', 'SKELETON_MASTER', 'WITHER_GOURD')
+SCROLLS = ('IMPLOSION_SCROLL', 'SHADOW_WARP_SCROLL', 'WITHER_SHIELD_SCROLL')
+
+TAG_SHORT, TAG_INT, TAG_LONG, TAG_DOUBLE = fast_nbt.TAG_SHORT, fast_nbt.TAG_INT, fast_nbt.TAG_LONG, fast_nbt.TAG_DOUBLE
+TAG_STRING, TAG_LIST, TAG_COMPOUND, TAG_END = fast_nbt.TAG_STRING, fast_nbt.TAG_LIST, fast_nbt.TAG_COMPOUND, fast_nbt.TAG_END
+
+
+def _nbt_name(name: str) -> bytes:
+    raw = name.encode('utf-8')
+    return struct.pack('>H', len(raw)) + raw
+
+
+def _nbt_payload(value) -> tuple[int, bytes]:
+    #python value -> (tag id, payload); ints are TAG_Int (TAG_Long if too large), floats TAG_Double, lists take the type of their first item
+    if isinstance(value, tuple): #(tag id, int) for the odd Short in a real item
+        return value[0], struct.pack('>h', value[1])
+    if isinstance(value, int):
+        if -2**31 <= value < 2**31:
+            return TAG_INT, struct.pack('>i', value)
+        return TAG_LONG, struct.pack('>q', value) #timestamps
+    if isinstance(value, float):
+        return TAG_DOUBLE, struct.pack('>d', value)
+    if isinstance(value, str):
+        return TAG_STRING, _nbt_name(value)
+    if isinstance(value, dict):
+        body = b''.join(bytes([tag_id]) + _nbt_name(key) + payload
+                        for key, (tag_id, payload) in ((key, _nbt_payload(item)) for key, item in value.items()))
+        return TAG_COMPOUND, body + bytes([TAG_END])
+    if isinstance(value, list):
+        items = [_nbt_payload(item) for item in value]
+        item_id = items[0][0] if items else TAG_END
+        return TAG_LIST, bytes([item_id]) + struct.pack('>i', len(items)) + b''.join(payload for _, payload in items)
+    raise TypeError(f"Cannot encode {type(value)} as NBT")
+
+
+def encode_item_bytes(root: dict) -> str:
+    """dict -> base64 of a gzipped, unnamed root compound, the shape of the API item_bytes."""
+    _, payload = _nbt_payload(root)
+    return base64.b64encode(gzip.compress(bytes([TAG_COMPOUND]) + _nbt_name('') + payload)).decode('ascii')
+
+
+def _gems(rng: random.Random) -> dict:
+    gems = {}
+    for slot in range(rng.randint(1, 4)):
+        gem = rng.choice(GEMS)
+        if rng.random() < 0.5:
+            slot_name = f'COMBAT_{slot}'
+            gems[slot_name] = rng.choice(GEM_QUALITIES)
+            gems[f'{slot_name}_gem'] = gem
+        else:
+            gems[f'{gem}_{slot}'] = {'quality': rng.choice(GEM_QUALITIES), 'uuid': str(uuid.UUID(int=rng.getrandbits(128)))}
+    gems['unlocked_slots'] = [slot_name for slot_name in gems if not slot_name.endswith('_gem')]
+    return gems
+
+
+def synthetic_item(rng: random.Random) -> tuple[dict, str, str]:
+    """One auctioned item as (NBT root, item name, tier)."""
+    tier = rng.choice(TIERS)
+    extra = {'uuid': str(uuid.UUID(int=rng.getrandbits(128))), 'timestamp': rng.randint(1_600_000_000_000, 1_760_000_000_000)}
+    kind = rng.random()
+
+    if kind < 0.2: #pet
+        pet = rng.choice(PETS)
+        level = rng.randint(1, 100)
+        pet_info = {'type': pet, 'active': False, 'exp': rng.uniform(0, 25_000_000), 'tier': tier,
+                    'hideInfo': False, 'candyUsed': rng.choice((0, 0, 0, 2, 10))}
+        held_item = rng.choice(PET_ITEMS)
+        if held_item:
+            pet_info['heldItem'] = held_item
+        if rng.random() < 0.1:
+            pet_info['skin'] = f'{pet}_SKIN'
+        extra.update({'id': 'PET', 'petInfo': json.dumps(pet_info)})
+        name = f'§7[Lvl {level}] §6{pet.replace("_", " ").title()}'
+    elif kind < 0.35: #fishing rod with parts
+        extra.update({'id': 'ROD_OF_THE_SEA', 'modifier': rng.choice(MODIFIERS),
+                      'enchantments': {enchant: rng.randint(1, 7) for enchant in rng.sample(('looting', 'luck_of_the_sea', 'lure', 'angler'), 3)},
+                      'hook': {'part': rng.choice(HOOKS), 'donated_museum': 0},
+                      'line': {'part': rng.choice(LINES), 'donated_museum': 0},
+                      'sinker': {'part': rng.choice(SINKERS), 'donated_museum': 0}})
+        name = '§6Rod of the Sea'
+    elif kind < 0.45: #necromancer sword with souls
+        souls = []
+        for _ in range(rng.randint(1, 5)):
+            dungeon = rng.random() < 0.6
+            soul = {'mob_id': rng.choice(SOUL_MOBS), 'dropped_mode_id': 'dungeon' if dungeon else 'slayer'}
+            if dungeon:
+                soul['dropped_instance_id'] = rng.choice(('F7', 'M5', 'M6', 'M7'))
+            souls.append(soul)
+        extra.update({'id': 'SUMMONING_RING', 'necromancer_souls': souls, 'modifier': rng.choice(MODIFIERS),
+                      'enchantments': {'vampirism': rng.randint(1, 6)}})
+        name = '§5Summoning Ring'
+    else: #enchanted, gemmed and reforged gear
+        item_id = rng.choice(GEAR)
+        extra.update({'id': item_id, 'modifier': rng.choice(MODIFIERS),
+                      'enchantments': {enchant: rng.randint(1, 10) for enchant in rng.sample(ENCHANTMENTS, rng.randint(2, 8))},
+                      'gems': _gems(rng), 'rarity_upgrades': rng.choice((0, 1)), 'hot_potato_count': rng.randint(0, 15),
+                      'dungeon_item_level': rng.randint(0, 5)})
+        if rng.random() < 0.3:
+            extra['runes'] = {rng.choice(RUNES): rng.randint(1, 3)}
+        if item_id == 'HYPERION':
+            extra['ability_scroll'] = rng.sample(SCROLLS, rng.randint(1, 3))
+        if rng.random() < 0.1:
+            extra['boosters'] = ['sweep']
+        name = f'§6{extra["modifier"].title()} {item_id.replace("_", " ").title()}'
+
+    display = {'Name': name, 'Lore': [f'§7Line {line} of the item lore' for line in range(rng.randint(5, 25))]}
+    tag = {'Unbreakable': 1, 'HideFlags': 254, 'display': display, 'ExtraAttributes': extra}
+    if extra['id'] == 'PET' or rng.random() < 0.2: #skull texture, the bulk the selective decoder skips
+        texture = base64.b64encode(rng.randbytes(240)).decode('ascii')
+        tag['SkullOwner'] = {'Id': str(uuid.UUID(int=rng.getrandbits(128))), 'Properties': {'textures': [{'Value': texture}]}}
+    root = {'i': [{'id': (TAG_SHORT, 397), 'Count': 1, 'tag': tag, 'Damage': (TAG_SHORT, 3)}]}
+    return root, name, tier
+
+
+def synthetic_snapshot(auctions: int, seed: int = 0, last_updated: int = 1_760_000_000_000) -> dict:
+    """API shaped snapshot: every auction gets a unique uuid, about 90% are BIN."""
+    rng = random.Random(seed)
+    records = []
+    for _ in range(auctions):
+        root, name, tier = synthetic_item(rng)
+        price = rng.randint(10_000, 2_000_000_000)
+        records.append({
+            'uuid': uuid.UUID(int=rng.getrandbits(128)).hex, 'auctioneer': uuid.UUID(int=rng.getrandbits(128)).hex,
+            'start': last_updated - rng.randint(0, 86_400_000), 'end': last_updated + rng.randint(0, 86_400_000),
+            'item_name': Parser.decode_name(name)[1], 'tier': tier, 'starting_bid': price, 'bin': rng.random() < 0.9,
+            'claimed': False, 'bids': [], 'highest_bid_amount': 0, 'item_bytes': encode_item_bytes(root),
+        })
+    return {'success': True, 'page': 0, 'totalPages': 1, 'totalAuctions': auctions, 'lastUpdated': last_updated,
+            'auctions': records}
+
+
+class Stage:
+    """Wall time, throughput and peak RSS of one timed block."""
+
+    def __init__(self, name: str, items: int):
+        self.name = name
+        self.items = items
+        self.seconds = None
+        self.extra = {}
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.seconds = time.perf_counter() - self._start
+
+    def result(self) -> dict:
+        #ru_maxrss is in KiB on Linux, the peak of the process so far (children: largest finished worker)
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        return {
+            'seconds': round(self.seconds, 4),
+            'items': self.items,
+            'items_per_s': round(self.items / self.seconds, 1) if self.seconds else None,
+            'peak_rss_mb': round(usage / 1024, 1),
+            'peak_child_rss_mb': round(children / 1024, 1),
+            **self.extra,
+        }
+
+
+def _best_of(repeat: int, func) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_decode(auctions: list, repeat: int) -> dict:
+    """utils.nbt_base64_to_dict (nbtlib) against fast_nbt, full tree and ITEM_SPEC, plus a parity check."""
+    payloads = [auction['item_bytes'] for auction in auctions]
+    results = {}
+    for name, decode in (('nbtlib', utils.nbt_base64_to_dict),
+                         ('fast_nbt_full', fast_nbt.b64_to_dict),
+                         ('fast_nbt_item_spec', lambda b64: fast_nbt.b64_to_dict(b64, fast_nbt.ITEM_SPEC))):
+        stage = Stage(f'decode_{name}', len(payloads))
+        stage.seconds = _best_of(repeat, lambda: [decode(b64) for b64 in payloads])
+        results[stage.name] = stage.result()
+
+    mismatches = sum(fast_nbt.b64_to_dict(b64) != fast_nbt._normalize(utils.nbt_base64_to_dict(b64)) for b64 in payloads)
+    results['decode_fast_nbt_full']['parity_mismatches'] = mismatches
+    return results
+
+
+def bench_extract(auctions: list, repeat: int) -> dict:
+    """Parser.filter_single_auction per decoder, i.e. decoding plus attribute extraction."""
+    bin_auctions = [auction for auction in auctions if auction.get('bin')]
+    results = {}
+    for use_fast_nbt in (False, True):
+        parser = Parser(LOGGER_CONF, None, None, use_fast_nbt=use_fast_nbt)
+        stage = Stage(f"extract_{'fast_nbt' if use_fast_nbt else 'nbtlib'}", len(bin_auctions))
+        stage.seconds = _best_of(repeat, lambda: [parser.filter_single_auction(auction, key_extra) for auction in bin_auctions])
+        results[stage.name] = stage.result()
+    return results
+
+
+def _table_counts(db_path: Path) -> dict:
+    with connect(db_path, 'read') as conn:
+        return {table: conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0] for table in BULK_QUERIES}
+
+
+def bench_pipeline(snapshot: dict, work_dir: Path, processes: int, dataframe: bool) -> dict:
+    """Raw snapshot file -> Parser.parse -> DataLoader.load_from_dir -> dataframe_setup.process_batch, each timed."""
+    raw_dir, parsed_dir = work_dir / 'raw', work_dir / 'parsed'
+    raw_archive, parsed_archive = work_dir / 'raw_archive', work_dir / 'parsed_archive'
+    db_path = work_dir / 'benchmark.db'
+    raw_dir.mkdir()
+    raw_file = utils.export_to_jsonl_gz(snapshot, raw_dir, 'snapshot')
+    auctions = len(snapshot['auctions'])
+    results = {}
+
+    with Parser(LOGGER_CONF, parsed_dir, raw_archive, processes=processes) as parser:
+        with Stage('parse', auctions) as stage:
+            parser.parse(raw_file)
+    results['parse'] = stage.result()
+
+    db_setup(db_path)
+    loader = DataLoader(LOGGER_CONF, parsed_dir, db_path, parsed_archive)
+    parsed = sum(1 for _ in utils.read_records(utils.iter_data_files(parsed_dir)[0])[1])
+    with Stage('load', parsed) as stage:
+        loader.load_from_dir()
+    counts = _table_counts(db_path)
+    rows = sum(counts.values())
+    stage.extra = {'rows_written': rows, 'rows_per_s': round(rows / stage.seconds, 1), 'rows_per_table': counts}
+    results['load'] = stage.result()
+
+    if dataframe:
+        results.update(bench_dataframe(utils.iter_data_files(parsed_archive), work_dir, processes, parsed))
+
+    stages = [results[name] for name in ('parse', 'load', 'dataframe') if name in results]
+    total = sum(stage['seconds'] for stage in stages)
+    results['end_to_end'] = {'seconds': round(total, 4), 'items': auctions, 'items_per_s': round(auctions / total, 1),
+                             'stages': [name for name in ('parse', 'load', 'dataframe') if name in results],
+                             'peak_rss_mb': max(stage['peak_rss_mb'] for stage in stages),
+                             'peak_child_rss_mb': max(stage['peak_child_rss_mb'] for stage in stages)}
+    return results
+
+
+def bench_dataframe(files: list, work_dir: Path, processes: int, items: int) -> dict:
+    try:
+        import dataframe_setup
+    except ImportError as e: #auction_filter is not part of the public tree
+        print(f"Skipping dataframe stage: {e}")
+        return {}
+    from multiprocessing import Pool, Manager
+    import logging.handlers
+
+    dataframe_setup.output_db = str(work_dir / 'dataframe.db')
+    registry = dataframe_setup.SchemaRegistry()
+    logger = setup_logger(*dataframe_setup.LOGGER_CONF)
+    with Manager() as manager:
+        queue = manager.Queue()
+        listener = logging.handlers.QueueListener(queue, *logger.handlers)
+        listener.start()
+        try:
+            with Pool(processes, initializer=dataframe_setup.init_worker, initargs=(queue, dataframe_setup.LOGGER_CONF)) as pool:
+                with Stage('dataframe', items) as stage:
+                    dataframe_setup.process_batch(files, pool, True, registry, logger)
+        finally:
+            listener.stop()
+    return {'dataframe': stage.result()}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Stages whose throughput dropped by more than tolerance against the baseline."""
+    regressions = []
+    for name, stage in results['stages'].items():
+        base_stage = baseline.get('stages', {}).get(name, {})
+        before, now = base_stage.get('items_per_s'), stage.get('items_per_s')
+        if not before or not now or base_stage.get('stages') != stage.get('stages'):
+            continue #end_to_end is only comparable over the same stages
+        change = now / before - 1
+        marker = 'REGRESSION' if change < -tolerance else ''
+        print(f"{name:<26} {before:>12,.1f} -> {now:>12,.1f} items/s ({change:+.1%}) {marker}")
+        if marker:
+            regressions.append(name)
+    return regressions
+
+
+def run(auctions: int, seed: int, repeat: int, processes: int, dataframe: bool) -> dict:
+    snapshot = synthetic_snapshot(auctions, seed)
+    stages = {}
+    stages.update(bench_decode(snapshot['auctions'], repeat))
+    stages.update(bench_extract(snapshot['auctions'], repeat))
+    with tempfile.TemporaryDirectory(prefix='auction_benchmark_') as work_dir:
+        stages.update(bench_pipeline(snapshot, Path(work_dir), processes, dataframe))
+
+    return {
+        'meta': {
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'auctions': auctions,
+            'seed': seed,
+            'repeat': repeat,
+            'processes': processes,
+        },
+        'stages': stages,
+    }
+
+
+def main(argv=None) -> int:
+    arg_parser = argparse.ArgumentParser(description="Offline benchmark of the auction pipeline.")
+    arg_parser.add_argument('--auctions', type=int, default=10_000)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--repeat', type=int, default=3, help="runs per micro benchmark, best one is kept")
+    arg_parser.add_argument('--processes', type=int, default=1)
+    arg_parser.add_argument('--no-dataframe', action='store_true', help="skip the dataframe_setup stage")
+    arg_parser.add_argument('--output', type=Path, default=Path('benchmark_results.json'))
+    arg_parser.add_argument('--baseline', type=Path, help="results of an earlier run to compare against")
+    arg_parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = arg_parser.parse_args(argv)
+
+    results = run(args.auctions, args.seed, args.repeat, args.processes, not args.no_dataframe)
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with args.output.open('w', encoding='utf-8') as f:
+        json.dump(results, f, indent=4)
+
+    for name, stage in results['stages'].items():
+        print(f"{name:<26} {stage['seconds']:>9.3f} s {stage['items_per_s'] or 0:>12,.1f} items/s "
+              f"peak RSS {stage['peak_rss_mb']:.0f} MB")
+    print(f"Results saved to {args.output}")
+
+    if args.baseline is not None:
+        with args.baseline.open('r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('auctions') != args.auctions:
+            print(f"Baseline was run with {baseline['meta'].get('auctions')} auctions, throughput is still comparable.")
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
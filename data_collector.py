@@ -1,47 +1,223 @@
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 from logger_config import setup_logger
 from pathlib import Path
-from utils import export_to_json
+from utils import export_to_json, export_to_jsonl_gz
+import metrics
+
+FETCH_SECONDS = metrics.histogram('auction_fetch_seconds', 'Latency of one API page request')
+FETCH_BYTES = metrics.counter('auction_fetch_bytes_total', 'Response bytes downloaded from the API')
+FETCH_RESPONSES = metrics.counter('auction_fetch_responses_total', 'API responses by status code')
+FETCH_ERRORS = metrics.counter('auction_fetch_errors_total', 'Failed page requests, retried or not')
 
 class DataCollector:
-    def __init__(self, api_url:str, output_dir_path: Path, output_filename: str, last_update_file: Path, logger_conf:tuple):
+    def __init__(self, api_url:str, output_dir_path: Path, output_filename: str, last_update_file: Path, logger_conf:tuple,
+                 *, all_pages: bool = False, max_workers: int = 8, retries: int = 3, backoff: float = 0.5, timeout: float = 10,
+                 refresh_interval: float = 60, poll_margin: float = 2, storage_format: str = 'json', listeners: list | None = None,
+                 delta_store=None):
         self.api_url = api_url
         self.output_dir_path = output_dir_path
         self.output_filename = output_filename #only string name, without suffix
         self.last_update_file = last_update_file
         self.logger = setup_logger(*logger_conf) #* needed to unpack tuple
 
-    def fetch_data(self):
+        self.all_pages = all_pages
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.refresh_interval = refresh_interval #seconds between API cache refreshes
+        self.poll_margin = poll_margin
+        self.storage_format = storage_format #'json' (indented, legacy) or 'jsonl.gz' (streamed, compressed)
+
+        self._validators = {} #ETag / Last-Modified of the page 0 of the last stored snapshot
+        self._fetched_validators = {} #same for the last fetched page 0, committed once its snapshot is stored
+        self._last_seen_ts = None #lastUpdated (ms) of the last seen page 0
+        self.listeners = list(listeners or []) #callable(data, complete) run on every new snapshot before it is exported
+        self.last_fetch_complete = False #every page of the last snapshot belongs to it
+        self.delta_store = delta_store #snapshot_delta.DeltaStore, stores keyframes + deltas instead of full snapshots
+
+        if self.listeners:
+            self._warn_partial_listeners()
+        if delta_store is not None and not all_pages:
+            #page 0 alone is never a complete snapshot: no removals, no keyframes after the first one
+            raise ValueError("A delta_store needs all_pages=True")
+
+        #one keep-alive session shared by all page workers, pool sized so no worker waits for a connection
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _fetch_page(self, page: int, conditional: bool = False) -> dict | None:
+        #returns None when the server answers 304 Not Modified to a conditional request
+        headers = {}
+        if conditional:
+            if 'ETag' in self._validators:
+                headers['If-None-Match'] = self._validators['ETag']
+            if 'Last-Modified' in self._validators:
+                headers['If-Modified-Since'] = self._validators['Last-Modified']
+
+        for attempt in range(self.retries + 1):
+            try:
+                with FETCH_SECONDS.time():
+                    response = self.session.get(self.api_url, params={'page': page}, headers=headers, timeout=self.timeout)
+                FETCH_RESPONSES.inc(status=response.status_code)
+                FETCH_BYTES.inc(len(response.content))
+                if response.status_code == 304:
+                    return None
+                response.raise_for_status()
+                if page == 0:
+                    self._fetched_validators = {k: response.headers[k] for k in ('ETag', 'Last-Modified') if k in response.headers}
+                return response.json()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                FETCH_ERRORS.inc()
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                self.logger.warning(f"Page {page} failed (attempt {attempt + 1}/{self.retries + 1}): {e}. Retrying in {delay}s")
+                time.sleep(delay)
+
+    def probe(self) -> tuple[bool, dict | None]:
+        """Fetch page 0 only (conditionally) and tell whether lastUpdated moved."""
         try:
-            response = requests.get(self.api_url)
-            response.raise_for_status()
-            self.logger.info(f"Successfully fetched data. Status code: {response.status_code}")
-            return response.json()
+            first = self._fetch_page(0, conditional=True)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self.logger.error(f"Error while probing first page: {e}")
+            return False, None
 
-        except requests.exceptions.RequestException as e:
-            self.logger.error(f"Error while fetching data: {e}")
+        if first is None:
+            self.logger.info("First page not modified (304).")
+            return False, None
+
+        timestamp = first.get('lastUpdated')
+        if timestamp is not None:
+            self._last_seen_ts = timestamp
+        stored = None
+        if self.last_update_file.exists():
+            try:
+                stored = int(self.last_update_file.read_text())
+            except ValueError:
+                pass
+        return stored != timestamp, first
+
+    def fetch_all_pages(self, first: dict | None = None):
+        """
+        All pages of one snapshot. A page with an older lastUpdated (stale cache) is fetched again, a newer one means
+        the API refreshed mid-fetch and the whole fetch restarts against the new snapshot; after `retries` restarts
+        without a consistent set of pages nothing is returned.
+        """
+        self.last_fetch_complete = False
+        for restart in range(self.retries + 1):
+            if first is None:
+                try:
+                    first = self._fetch_page(0)
+                except (requests.exceptions.RequestException, ValueError) as e:
+                    self.logger.error(f"Error while fetching first page: {e}")
+                    return None
+            if not first.get('success'):
+                return first
+
+            total_pages = first.get('totalPages', 1)
+            timestamp = first.get('lastUpdated')
+            try:
+                pages = self._fetch_consistent_pages(range(1, total_pages), timestamp)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                self.logger.error(f"Error while fetching pages: {e}")
+                return None
+            if pages is not None:
+                break
+            self.logger.warning(f"API refreshed during the fetch of {timestamp}, restarting ({restart + 1}/{self.retries + 1}).")
+            first = None
+        else:
+            self.logger.error(f"No consistent snapshot after {self.retries + 1} attempts.")
             return None
 
+        auctions = list(first.get('auctions', []))
+        for page in pages:
+            auctions.extend(page.get('auctions', []))
+        self.last_fetch_complete = True
+        self.logger.info(f"Successfully fetched {total_pages} pages, {len(auctions)} auctions (lastUpdated {timestamp}).")
+
+        merged = {key: value for key, value in first.items() if key not in ('auctions', 'page')}
+        merged['totalAuctions'] = len(auctions)
+        merged['auctions'] = auctions
+        return merged
+
+    def _fetch_consistent_pages(self, page_numbers, timestamp) -> list | None:
+        #pages in order, all with lastUpdated == timestamp; None if one of them already belongs to a newer snapshot
+        pages = dict.fromkeys(page_numbers)
+        pending = list(pages)
+        for attempt in range(self.retries + 1):
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                fetched = list(executor.map(self._fetch_page, pending)) #map keeps page order
+            stale = []
+            for page_no, page in zip(pending, fetched):
+                page_ts = page.get('lastUpdated')
+                if page_ts == timestamp:
+                    pages[page_no] = page
+                elif timestamp is not None and page_ts is not None and page_ts > timestamp:
+                    return None
+                else:
+                    stale.append(page_no)
+            if not stale:
+                return list(pages.values())
+            self.logger.warning(f"Pages {stale} have lastUpdated != {timestamp}, fetching them again "
+                                f"({attempt + 1}/{self.retries + 1}).")
+            pending = stale
+        return None
+
     def last_update(self, data: dict) -> bool:
+        """lastUpdated of data differs from the last stored snapshot. Nothing is written, see _commit."""
         try:
-            timestamp = data.get('lastUpdated')
             if not self.last_update_file.exists():
-                self.last_update_file.write_text(str(timestamp))
                 return True
-            else:
-                time = int(self.last_update_file.read_text())
-                if time != timestamp:
-                    self.last_update_file.write_text(str(timestamp))
-                    return True
-                else:
-                    return False
+            return int(self.last_update_file.read_text()) != data.get('lastUpdated')
         except Exception as e:
             self.logger.error(f"Error while checking last update: {e}")
             return False
 
+    def _commit(self, data: dict):
+        #only after the snapshot is stored, a failed fetch / export is downloaded again on the next poll instead of 304
+        self.last_update_file.write_text(str(data.get('lastUpdated')))
+        self._validators = self._fetched_validators
+
+    def _warn_partial_listeners(self):
+        if not self.all_pages:
+            self.logger.warning("Listeners on a collector without all_pages only see page 0 and never a complete snapshot: "
+                                "nothing is reported as removed (sold / cancelled) to them.")
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+        self._warn_partial_listeners()
+
+    def _complete(self, data: dict) -> bool:
+        return self.last_fetch_complete if self.all_pages else data.get('totalPages', 1) == 1
+
+    def _notify(self, data: dict):
+        complete = self._complete(data)
+        for listener in self.listeners:
+            try:
+                listener(data, complete)
+            except Exception as e: #a failing consumer must not stop the collection
+                self.logger.error(f"Listener {listener!r} failed: {type(e).__name__}: {e}")
+
+    @metrics.STAGE_SECONDS.timed(stage='collect')
     def fetch_new(self):
         self.logger.info("Starting data collection run.")
-        data = self.fetch_data()
+        changed, first = self.probe()
+
+        if not changed:
+            #304, unchanged lastUpdated or failed probe (already logged) - nothing else is downloaded
+            self.logger.info("No new data found. Skipping download.")
+            self.logger.info("--- Data collection run finished ---")
+            return None
+        if self.all_pages and first.get('success'):
+            data = self.fetch_all_pages(first)
+        else:
+            data = first
 
         if not data:
             self.logger.error("No data found")
@@ -49,13 +225,27 @@ class DataCollector:
         if self.last_update(data):
             self.logger.info("New data found.")
             if data.get("success"):
-                return export_to_json(
-                    data,
-                    file_dir_path=self.output_dir_path,
-                    file_name=self.output_filename,
-                    create_folder=True,
-                    time_stamp=True
-                )
+                self._notify(data)
+                try:
+                    if self.delta_store is not None:
+                        #None: this lastUpdated is already in the store
+                        path = self.delta_store.add(data, self._complete(data))
+                    else:
+                        exporter = export_to_jsonl_gz if self.storage_format == 'jsonl.gz' else export_to_json
+                        path = exporter(
+                            data,
+                            file_dir_path=self.output_dir_path,
+                            file_name=self.output_filename,
+                            create_folder=True,
+                            time_stamp=True
+                        )
+                        if path is None:
+                            raise OSError(f"export to {self.output_dir_path} failed")
+                except (OSError, ValueError) as e:
+                    self.logger.error(f"Snapshot {data.get('lastUpdated')} not stored, retrying on the next poll: {e}")
+                    return None
+                self._commit(data)
+                return path
             else:
                 cause = data.get('cause', 'No cause provided')
                 self.logger.warning(f"API call was not successful. {cause}")
@@ -64,3 +254,22 @@ class DataCollector:
 
         self.logger.info("--- Data collection run finished ---")
 
+    def next_poll_delay(self) -> float:
+        #API refreshes every refresh_interval seconds, so poll right after the next expected refresh
+        if self._last_seen_ts is None:
+            return self.refresh_interval
+        next_refresh = self._last_seen_ts / 1000 + self.refresh_interval + self.poll_margin
+        delay = next_refresh - time.time()
+        if delay <= 0:
+            #refresh is overdue, retry soon without hammering the API
+            return self.poll_margin
+        return delay
+
+    def run_forever(self, max_runs: int | None = None):
+        runs = 0
+        while max_runs is None or runs < max_runs:
+            self.fetch_new()
+            runs += 1
+            delay = self.next_poll_delay()
+            self.logger.info(f"Next poll in {delay:.1f}s")
+            time.sleep(delay)
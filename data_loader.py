@@ -1,17 +1,113 @@
 from pathlib import Path
-import json
 import sqlite3
-from logger_config import setup_logger
+import logging
+import logging.handlers
+import threading
+from logging.handlers import QueueHandler
+from multiprocessing import Pool, Manager
+from queue import Queue, Full
+from logger_config import setup_logger, RateLimitFilter
 import re
-from utils import archive
+from utils import archive, bounded_imap, iter_data_files, read_records
+from database_setup import migrate, connect, db_layout, StringDict, ENCODED_COLUMNS
+from schema_registry import SchemaRegistry
+from price_history import PriceHistory
+import metrics
+import profiling
+
+AUCTIONS_TABLE_QUERY = """INSERT INTO auctions (
+            auction_id, price, bin, name, rarity_upgrades, hot_potato_count, modifier, dungeon_item_level, upgrade_level,
+            item_id, dye_item, item_tier, hecatomb_s_runs, eman_kills, baseStatBoostPercentage, stats_book, power_ability_scroll,
+            divan_powder_coating, thunder_charge, tuned_transmission, ethermerge, farming_for_dummies_count, 
+            drill_part_upgrade_module, talisman_enrichment, polarvoid, mined_crops,
+            bookworm_books, drill_part_fuel_tank, boss_tier, blood_god_kills, winning_bid, collected_coins, 
+            wet_book_count, pelts_earned, gilded_gifted_coins, additional_coins, skin, mana_disintegrator_count,
+            jalapeno_count, art_of_war_count, magma_cube_absorber, spider_kills, chimera_found, logs_cut, absorb_logs_chopped, 
+            wood_singularity_count, artOfPeaceApplied, zombie_kills, drill_part_engine, pandora_rarity, blaze_consumer, handles_found,
+            snapshot_ts
+            )
+                                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);"""  # auctions table query
+
+#column names are recovered from the query text once, not on every insert
+AUCTION_COLUMNS = tuple(col.strip() for col in re.search(r'\((.*?)\)', AUCTIONS_TABLE_QUERY, re.DOTALL).group(1).split(','))
+
+#one executemany per table; duplicates are ignored by the database instead of raising per row
+BULK_QUERIES = {
+    'auctions': AUCTIONS_TABLE_QUERY.replace("INSERT INTO", "INSERT OR IGNORE INTO", 1),
+    'enchantments': """INSERT INTO enchantments (auction_id, name, level) VALUES (?, ?, ?);""",
+    'gems': """INSERT INTO gems (auction_id, gem_slot, gem_type, QUALITY) VALUES (?, ?, ?, ?);""",
+    'boosters': """INSERT INTO boosters (auction_id, name) VALUES (?, ?);""",
+    'hyp_scrolls': """INSERT INTO hyp_scrolls (auction_id, name) VALUES (?, ?);""",
+    'pet_info': """INSERT OR IGNORE INTO pet_info (auction_id, level, tier, candy_used, held_item, pet_skin) VALUES (?, ?, ?, ?, ?, ?);""",
+    'runes': """INSERT INTO runes (auction_id, name, level) VALUES (?, ?, ?);""",
+    'hooks': """INSERT OR IGNORE INTO hooks (auction_id, name) VALUES (?, ?);""",
+    'lines': """INSERT OR IGNORE INTO lines (auction_id, name) VALUES (?, ?);""",
+    'sinkers': """INSERT OR IGNORE INTO sinkers (auction_id, name) VALUES (?, ?);""",
+    'souls': """INSERT INTO souls (auction_id, name, location, instance) VALUES (?, ?, ?, ?);""",
+}
+SQLITE_MAX_PARAMS = 900
+
+#price history records taken from the auctions rows
+PRICE_POSITIONS = tuple(AUCTION_COLUMNS.index(column) for column in ('auction_id', 'item_id', 'price', 'snapshot_ts'))
+
+#encoded layout: positions of the dictionary encoded columns in the row tuples of BULK_QUERIES
+ENCODED_POSITIONS = {
+    table: tuple(i for i, column in enumerate(col.strip() for col in re.search(r'\((.*?)\)', BULK_QUERIES[table], re.DOTALL).group(1).split(','))
+                 if column in columns)
+    for table, columns in ENCODED_COLUMNS.items()
+}
+
+ROWS_INSERTED = metrics.counter('auction_rows_inserted_total', 'Rows inserted per table')
+COMMIT_SECONDS = metrics.histogram('auction_commit_seconds', 'Time to write and commit one transaction')
+QUEUE_DEPTH = metrics.gauge('auction_queue_depth', 'Items waiting in a bounded queue')
+
+"""
+Concurrent mode (processes > 1): reader processes decode parsed files and build their row tuples (build_rows),
+while one writer thread owns the only SQLite connection and commits many files per transaction.
+Workers are set up like the parser workers - their own DataLoader, logs through a QueueHandler to the parent.
+A file is archived only after the transaction holding its rows is committed.
+"""
+
+worker_loader = None
+
+def init_load_worker(queue, logger_conf, auction_converters):
+    logger_name, _ = logger_conf
+    logger = logging.getLogger(logger_name)
+    logger.setLevel(logging.INFO)
+
+    if not logger.hasHandlers():
+        handler = QueueHandler(queue)
+        logger.addHandler(handler)
+
+    global worker_loader
+    worker_loader = DataLoader(logger_conf, None, None, None, track_prices=False)
+    worker_loader.auction_converters = auction_converters #same casts as the parent's registry
+
+def build_file_rows(file_path):
+    try:
+        _, auctions = read_records(Path(file_path))
+        return file_path, worker_loader.build_rows(auctions, set()), None
+    except Exception as e:
+        return file_path, None, f"{type(e).__name__}: {e}" #bad file stays in the input dir, the rest still loads
 
 
 class DataLoader:
-    def __init__(self, logger_conf:tuple, input_dir_path, db_path, parsed_archive_dir):
-        self.logger = setup_logger(*logger_conf)
+    def __init__(self, logger_conf:tuple, input_dir_path, db_path, parsed_archive_dir, files_per_commit: int = 1,
+                 registry: SchemaRegistry | None = None, processes: int = 1, rows_per_commit: int = 200_000,
+                 track_prices: bool = True):
+        self.logger_conf = logger_conf
+        self.logger = setup_logger(*logger_conf, async_mode=True, rate_limit=RateLimitFilter()) #errors per failing insert
         self.input_dir_path = input_dir_path
         self.db_path = db_path
         self.parsed_archive_dir = parsed_archive_dir
+        self.files_per_commit = files_per_commit #parsed files buffered into one transaction
+        #explicit int/float casts of the auctions columns, taken from the schema registry
+        self.auction_converters = (registry or SchemaRegistry()).row_converters(AUCTION_COLUMNS)
+        self.processes = processes #> 1 -> reader processes + single writer thread (load_from_dir)
+        self.rows_per_commit = rows_per_commit #concurrent mode commits once this many rows are buffered
+        self._writer_error = None
+        self.string_dict = None #StringDict of the current connection when the database uses the encoded layout
+        self.price_history = PriceHistory() if track_prices else None #updated in the same transaction as the rows
         self._reset_counter()
 
     def _reset_counter(self):
@@ -26,33 +122,16 @@ class DataLoader:
     #needs to be executed first, in order to get auction_id
     def _one_to_one_insert(self, auction_data, cur: sqlite3.Cursor):
             self.auction_id = auction_data.get('auction_id')
-            auctions_table_query = """INSERT INTO auctions (
-            auction_id, price, bin, name, rarity_upgrades, hot_potato_count, modifier, dungeon_item_level, upgrade_level,
-            item_id, dye_item, item_tier, hecatomb_s_runs, eman_kills, baseStatBoostPercentage, stats_book, power_ability_scroll,
-            divan_powder_coating, thunder_charge, tuned_transmission, ethermerge, farming_for_dummies_count, 
-            drill_part_upgrade_module, talisman_enrichment, polarvoid, mined_crops,
-            bookworm_books, drill_part_fuel_tank, boss_tier, blood_god_kills, winning_bid, collected_coins, 
-            wet_book_count, pelts_earned, gilded_gifted_coins, additional_coins, skin, mana_disintegrator_count,
-            jalapeno_count, art_of_war_count, magma_cube_absorber, spider_kills, chimera_found, logs_cut, absorb_logs_chopped, 
-            wood_singularity_count, artOfPeaceApplied, zombie_kills, drill_part_engine, pandora_rarity, blaze_consumer, handles_found
-            )
-                                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);"""  # auctions table query
-
-            column_names = []
-            match = re.search(r'\((.*?)\)', auctions_table_query, re.DOTALL)
-            if match:
-                columns_str = match.group(1)
-                column_names = [col.strip() for col in columns_str.split(',')]
 
             main_data_queue = []
 
-            for column_name in column_names:
+            for column_name in AUCTION_COLUMNS:
                 main_data_queue.append(auction_data.get(column_name))
 
             main_data_tuple = tuple(main_data_queue)
 
             try:
-                cur.execute(auctions_table_query, main_data_tuple)
+                cur.execute(AUCTIONS_TABLE_QUERY, main_data_tuple)
                 self.rows_added_counter['auctions'] += 1
                 return True
             except sqlite3.IntegrityError:
@@ -177,9 +256,9 @@ class DataLoader:
                     self.logger.error(f"Failed to insert souls for auction {self.auction_id}: {e}")
 
 
-    def _insert_single_auction(self, auction, cur: sqlite3.Cursor):
+    def _insert_single_auction(self, auction, cur: sqlite3.Cursor) -> bool:
         if not self._one_to_one_insert(auction, cur):
-            return
+            return False
         self._insert_enchantments(auction.get('enchantments'), cur)
         self._insert_gems(auction.get('gems'), cur)
         self._insert_boosterlike(auction.get('boosters'), cur, 'boosters')
@@ -191,25 +270,294 @@ class DataLoader:
         return True
 
 
-    def load_from_dir(self):
-        with sqlite3.connect(self.db_path) as conn:
+    @staticmethod
+    def _existing_auction_ids(cur: sqlite3.Cursor, auction_ids: list) -> set:
+        existing = set()
+        for i in range(0, len(auction_ids), SQLITE_MAX_PARAMS):
+            chunk = auction_ids[i: i + SQLITE_MAX_PARAMS]
+            placeholders = ', '.join('?' * len(chunk))
+            cur.execute(f"SELECT auction_id FROM auctions WHERE auction_id IN ({placeholders})", chunk)
+            existing.update(row[0] for row in cur.fetchall())
+        return existing
+
+    @staticmethod
+    def _convert(value, converter):
+        if value is None or converter is None:
+            return value
+        try:
+            return converter(value)
+        except (TypeError, ValueError):
+            return value
+
+    def build_rows(self, auctions, skip_ids: set) -> dict[str, list[tuple]]:
+        """Row buffers for all 11 tables, same rules as the _insert_* methods. Auctions in skip_ids are left out."""
+        rows = {table: [] for table in BULK_QUERIES}
+        seen = set(skip_ids)
+
+        for auction in auctions:
+            auction_id = auction.get('auction_id')
+            if auction_id in seen:
+                continue
+            seen.add(auction_id)
+
+            rows['auctions'].append(tuple(self._convert(auction.get(column), converter)
+                                          for column, converter in zip(AUCTION_COLUMNS, self.auction_converters)))
+
+            for name, level in (auction.get('enchantments') or {}).items():
+                rows['enchantments'].append((auction_id, name, level))
+
+            for gem_slot, type_quality in (auction.get('gems') or {}).items():
+                rows['gems'].append((auction_id, gem_slot, type_quality.get('type'), type_quality.get('quality')))
+
+            for key, table_name in (('boosters', 'boosters'), ('ability_scroll', 'hyp_scrolls')):
+                data = auction.get(key)
+                if data:
+                    names = data if isinstance(data, list) else [data]
+                    rows[table_name].extend((auction_id, name) for name in names)
+
+            pet = auction.get('pet_info')
+            if pet and pet.get('level') is not None:
+                rows['pet_info'].append((auction_id, pet.get('level'), pet.get('tier'), pet.get('candy_used'),
+                                         pet.get('held_item'), pet.get('pet_skin')))
+
+            for name, level in (auction.get('runes') or {}).items():
+                rows['runes'].append((auction_id, name, level))
+
+            for part, part_name in (auction.get('fishing_parts') or {}).items():
+                if part_name:
+                    rows[f"{part}s"].append((auction_id, part_name))
+
+            for soul in auction.get('necromancer_souls') or []:
+                rows['souls'].append((auction_id, soul.get('mob_name'), soul.get('location'), soul.get('instance')))
+
+        return rows
+
+    def prepare(self, conn: sqlite3.Connection):
+        """Migrate the database and pick up its layout. Call once per connection before loading."""
+        migrate(conn)
+        self.string_dict = StringDict(conn) if db_layout(conn) == 'encoded' else None
+
+    def _encode_rows(self, rows: dict[str, list[tuple]]) -> dict[str, list]:
+        #strings -> string_dict ids, new strings are committed before the rows
+        for table, positions in ENCODED_POSITIONS.items():
+            self.string_dict.intern(row[i] for row in rows.get(table, ()) for i in positions)
+
+        ids = self.string_dict.ids
+        encoded = dict(rows)
+        for table, positions in ENCODED_POSITIONS.items():
+            table_rows = []
+            for row in rows.get(table, ()):
+                row = list(row)
+                for i in positions:
+                    if row[i] is not None:
+                        row[i] = ids[row[i]]
+                table_rows.append(row)
+            encoded[table] = table_rows
+        return encoded
+
+    @staticmethod
+    def _price_records(rows: dict[str, list[tuple]]):
+        #(item_id, pet tier, pet level, price, snapshot_ts) of every auction row, before encoding
+        auction_id, item_id, price, snapshot_ts = PRICE_POSITIONS
+        pets = {row[0]: row for row in rows.get('pet_info', ())}
+        for row in rows.get('auctions', ()):
+            pet = pets.get(row[auction_id])
+            yield (row[item_id], pet[2] if pet else None, pet[1] if pet else None, row[price], row[snapshot_ts])
+
+    def _flush_rows(self, rows: dict[str, list[tuple]], conn: sqlite3.Connection):
+        aggregates = self.price_history.aggregate(self._price_records(rows)) if self.price_history is not None else None
+        if self.string_dict is not None:
+            rows = self._encode_rows(rows)
+        with conn: #one transaction for the whole buffer, rolled back on error
             cur = conn.cursor()
-            for file in self.input_dir_path.glob('*.json'):
+            for table, table_rows in rows.items():
+                if table_rows:
+                    cur.executemany(BULK_QUERIES[table], table_rows)
+                    self.rows_added_counter[table] += len(table_rows)
+            if aggregates:
+                self.price_history.apply(conn, aggregates)
+
+    def load_auctions(self, auctions: list, conn: sqlite3.Connection) -> bool:
+        """Insert a batch of parsed auctions in one transaction. Falls back to per-auction inserts if the batch fails."""
+        cur = conn.cursor()
+        auction_ids = list({auction.get('auction_id') for auction in auctions})
+        existing = self._existing_auction_ids(cur, auction_ids)
+        if existing:
+            self.logger.info(f"Skipping {len(existing)} auctions already in database")
+
+        rows = self.build_rows(auctions, existing)
+        counter_before = dict(self.rows_added_counter)
+        try:
+            with COMMIT_SECONDS.time(mode='bulk'):
+                self._flush_rows(rows, conn)
+            return True
+        except sqlite3.Error as e:
+            self.logger.error(f"Bulk insert failed, retrying auction by auction: {e}")
+            self.rows_added_counter = dict(counter_before)
+            with COMMIT_SECONDS.time(mode='per_auction'):
+                if self.string_dict is not None:
+                    self._load_one_by_one(auctions, existing, conn)
+                    return False
+                inserted = [auction for auction in auctions
+                            if auction.get('auction_id') not in existing and self._insert_single_auction(auction, cur)]
+                if self.price_history is not None:
+                    self.price_history.update(self._price_records(self.build_rows(inserted, set())), conn)
+                conn.commit()
+            return False
+        finally:
+            for table, count in self.rows_added_counter.items():
+                if count > counter_before[table]:
+                    ROWS_INSERTED.inc(count - counter_before[table], table=table)
+
+    def _load_one_by_one(self, auctions: list, existing: set, conn: sqlite3.Connection):
+        #encoded layout fallback: the _insert_* methods write plain strings, so each auction goes through build_rows
+        for auction in auctions:
+            before = dict(self.rows_added_counter)
+            try:
+                self._flush_rows(self.build_rows([auction], existing), conn)
+            except sqlite3.Error as e:
+                self.rows_added_counter = before
+                self.logger.error(f"Could not insert auction {auction.get('auction_id')}: {e}")
+
+    def _log_counter(self):
+        for table, count in self.rows_added_counter.items():
+            if count > 0:
+                self.logger.info(f"Successfully inserted {table}: {count} rows")
+
+    def _commit_files(self, pending: list, conn: sqlite3.Connection) -> list:
+        """Write the rows of pending [(file, rows)] in one transaction. Returns the files that were committed."""
+        merged = {table: [] for table in BULK_QUERIES}
+        for _, rows in pending:
+            for table, table_rows in rows.items():
+                merged[table].extend(table_rows)
+
+        counter_before = dict(self.rows_added_counter)
+        committed = []
+        try:
+            with COMMIT_SECONDS.time(mode='bulk'):
+                self._flush_rows(merged, conn)
+            committed = [file for file, _ in pending]
+        except sqlite3.Error as e:
+            #one bad file must not hold back the others, retry them one transaction each
+            self.logger.error(f"Bulk insert of {len(pending)} files failed, retrying file by file: {e}")
+            self.rows_added_counter = dict(counter_before)
+            for file, rows in pending:
+                before = dict(self.rows_added_counter)
+                try:
+                    with COMMIT_SECONDS.time(mode='per_file'):
+                        self._flush_rows(rows, conn)
+                    committed.append(file)
+                except sqlite3.Error as file_error:
+                    self.rows_added_counter = before
+                    self.logger.error(f"Could not load {file}, leaving it in place: {file_error}")
+
+        for table, count in self.rows_added_counter.items():
+            if count > counter_before[table]:
+                ROWS_INSERTED.inc(count - counter_before[table], table=table)
+        return committed
+
+    def _write_files(self, jobs: Queue, stop: threading.Event):
+        #writer thread: the only owner of the connection
+        try:
+            with connect(self.db_path, 'ingest') as conn:
+                self.prepare(conn)
+                cur = conn.cursor()
+                seen = set() #auction ids in the buffered, not yet committed files
+                pending, pending_rows = [], 0
+
+                def commit():
+                    nonlocal pending, pending_rows
+                    self._reset_counter()
+                    for file in self._commit_files(pending, conn):
+                        archive(Path(file), self.parsed_archive_dir, logger=self.logger, compress=True)
+                    self._log_counter()
+                    pending, pending_rows = [], 0
+                    seen.clear() #committed ids are found by the database query from now on
+
+                while True:
+                    item = jobs.get()
+                    QUEUE_DEPTH.set(jobs.qsize(), queue='loader')
+                    if item is None:
+                        break
+                    file, rows, error = item
+                    if error is not None:
+                        self.logger.error(f"Could not read {file}, leaving it in place: {error}")
+                        continue
+
+                    ids = {row[0] for row in rows['auctions']}
+                    skip = (ids & seen) | self._existing_auction_ids(cur, list(ids - seen))
+                    if skip:
+                        self.logger.info(f"Skipping {len(skip)} auctions already in database")
+                        rows = {table: [row for row in table_rows if row[0] not in skip] for table, table_rows in rows.items()}
+                    seen |= ids
+
+                    pending.append((file, rows))
+                    pending_rows += sum(len(table_rows) for table_rows in rows.values())
+                    if pending_rows >= self.rows_per_commit:
+                        commit()
+                if pending:
+                    commit()
+        except BaseException as e:
+            self._writer_error = e
+            stop.set()
+
+    @staticmethod
+    def _put(jobs: Queue, item, stop: threading.Event) -> bool:
+        while not stop.is_set():
+            try:
+                jobs.put(item, timeout=0.5)
+                return True
+            except Full:
+                continue
+        return False
+
+    def _load_concurrent(self, files: list):
+        jobs = Queue(maxsize=self.processes * 2) #bounds the row batches waiting for the writer
+        stop = threading.Event()
+        self._writer_error = None
+        writer = threading.Thread(target=self._write_files, args=(jobs, stop), name='loader-writer', daemon=True)
+        writer.start()
+
+        manager = Manager()
+        queue = manager.Queue()
+        listener = logging.handlers.QueueListener(queue, *self.logger.handlers)
+        listener.start()
+        try:
+            with Pool(self.processes, initializer=init_load_worker,
+                      initargs=(queue, self.logger_conf, self.auction_converters)) as pool:
+                #file order kept (first copy wins), at most `processes` files built ahead of the jobs queue
+                for result in bounded_imap(pool, build_file_rows, [str(file) for file in files], self.processes):
+                    if not self._put(jobs, result, stop):
+                        break
+        finally:
+            self._put(jobs, None, stop)
+            writer.join()
+            listener.stop()
+            manager.shutdown()
+
+        if self._writer_error is not None:
+            raise self._writer_error
+
+    @metrics.STAGE_SECONDS.timed(stage='load')
+    @profiling.profiled('load')
+    def load_from_dir(self):
+        files = iter_data_files(self.input_dir_path)
+        if self.processes > 1:
+            self._load_concurrent(files)
+            return
+        with connect(self.db_path, 'ingest') as conn:
+            self.prepare(conn)
+            for i in range(0, len(files), self.files_per_commit):
+                batch = files[i: i + self.files_per_commit]
                 self._reset_counter()
 
-                with file.open('r', encoding='utf-8') as json_file:
-                    auctions = json.load(json_file)
-
-                for auction in auctions:
-                    self._insert_single_auction(auction, cur)
-
-                for table, count in self.rows_added_counter.items():
-                    if count > 0:
-                        self.logger.info(f"Successfully inserted {table}: {count} rows")
-
-                archive(file, self.parsed_archive_dir, logger=self.logger)
-
-
-
+                auctions = []
+                for file in batch:
+                    _, file_auctions = read_records(file)
+                    auctions.extend(file_auctions)
 
+                self.load_auctions(auctions, conn)
+                self._log_counter()
 
+                for file in batch:
+                    archive(file, self.parsed_archive_dir, logger=self.logger, compress=True)
@@ -1,3 +1,5 @@
+import argparse
+import re
 import sqlite3
 from pathlib import Path
 from logger_config import setup_logger
@@ -165,15 +167,242 @@ CREATE TABLE IF NOT EXISTS souls (
 """   #souls on item
 ]
 
-def db_setup():
+#(version, description, statements) - applied in order, the version reached is kept in PRAGMA user_version
+MIGRATIONS = [
+    (1, "secondary indexes", [
+        """CREATE INDEX IF NOT EXISTS idx_auctions_item_price ON auctions (item_id, price);""",  #covers price lookups per item
+        """CREATE INDEX IF NOT EXISTS idx_auctions_price ON auctions (price);""",
+        """CREATE INDEX IF NOT EXISTS idx_enchantments_auction ON enchantments (auction_id);""",
+        """CREATE INDEX IF NOT EXISTS idx_gems_auction ON gems (auction_id);""",
+        """CREATE INDEX IF NOT EXISTS idx_runes_auction ON runes (auction_id);""",
+        """CREATE INDEX IF NOT EXISTS idx_boosters_auction ON boosters (auction_id);""",
+        """CREATE INDEX IF NOT EXISTS idx_hyp_scrolls_auction ON hyp_scrolls (auction_id);""",
+        """CREATE INDEX IF NOT EXISTS idx_souls_auction ON souls (auction_id);""",
+    ]),
+    (2, "snapshot timestamp", [
+        """ALTER TABLE auctions ADD COLUMN snapshot_ts INTEGER;""",  #lastUpdated (ms) of the snapshot the auction came from
+        """CREATE INDEX IF NOT EXISTS idx_auctions_item_snapshot ON auctions (item_id, snapshot_ts, price);""",
+    ]),
+    (3, "string dictionary and layout flag", [
+        """CREATE TABLE IF NOT EXISTS string_dict (id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE);""",
+        """CREATE TABLE IF NOT EXISTS db_meta (key TEXT PRIMARY KEY, value TEXT);""",
+        """INSERT OR IGNORE INTO db_meta (key, value) VALUES ('layout', 'plain');""",
+    ]),
+    (4, "price history aggregates", [
+        """
+        CREATE TABLE IF NOT EXISTS price_history (
+            item_id TEXT NOT NULL,
+            tier TEXT NOT NULL DEFAULT '',
+            pet_level INTEGER NOT NULL DEFAULT 0,
+            resolution INTEGER NOT NULL,
+            bucket_start INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            min_price REAL,
+            max_price REAL,
+            sum_price REAL,
+            sum_net REAL,
+            sketch TEXT,
+            PRIMARY KEY (item_id, tier, pet_level, resolution, bucket_start)
+        ) WITHOUT ROWID;
+        """,  #maintained by price_history.PriceHistory, item_id is plain text in both layouts
+    ]),
+]
+
+"""
+Layouts. 'plain': strings are stored as TEXT in every row, as before.
+'encoded': the ENCODED_COLUMNS hold INTEGER ids into string_dict (a few thousand distinct values shared by
+hundreds of millions of rows), which keeps rows, indexes and the page cache small and makes GROUP BY / joins
+on item_id compare integers. The v_<table> views return the TEXT values in both layouts, so readers that
+query the views do not care which layout a database uses.
+New databases are plain unless db_setup(layout='encoded'); convert_to_encoded() rewrites an existing one.
+"""
+
+ENCODED_COLUMNS = {
+    'auctions': ('item_id', 'modifier', 'name'),
+    'enchantments': ('name',),
+    'gems': ('gem_type', 'QUALITY'),
+    'runes': ('name',),
+    'boosters': ('name',),
+}
+TABLES = tuple(re.search(r'CREATE TABLE IF NOT EXISTS (\w+)', ddl).group(1) for ddl in DDL_STATEMENTS if 'CREATE TABLE' in ddl)
+
+
+#profile -> PRAGMAs run on every connection opened by connect(). journal_mode is stored in the database file,
+#the rest only lasts for the connection, so bare sqlite3.connect() runs with SQLite's defaults (foreign keys off).
+CONNECTION_PROFILES = {
+    'default': {
+        'foreign_keys': 'ON',
+        'synchronous': 'NORMAL',
+    },
+    'ingest': { #DataLoader, Pipeline, dataframe build - few large transactions
+        'journal_mode': 'WAL',
+        'foreign_keys': 'ON',
+        'synchronous': 'NORMAL', #with WAL only checkpoints fsync, not every commit
+        'cache_size': -262144, #KiB, 256 MiB page cache instead of 2 MiB
+        'mmap_size': 1 << 30,
+        'temp_store': 'MEMORY',
+        'wal_autocheckpoint': 16384, #pages, checkpoint every ~64 MiB of WAL instead of every ~4 MiB
+    },
+    'read': { #analytics / reporting, opened read-only
+        'query_only': 'ON',
+        'cache_size': -131072,
+        'mmap_size': 1 << 30,
+        'temp_store': 'MEMORY',
+    },
+}
+
+
+def connect(db_file: Path = DB_FILE, profile: str = 'default') -> sqlite3.Connection:
+    """sqlite3 connection with the PRAGMAs of CONNECTION_PROFILES[profile]. 'read' fails if the database does not exist."""
+    pragmas = CONNECTION_PROFILES.get(profile)
+    if pragmas is None:
+        raise ValueError(f"Unknown connection profile: {profile}")
+    if profile == 'read':
+        conn = sqlite3.connect(f"{Path(db_file).resolve().as_uri()}?mode=ro", uri=True)
+    else:
+        conn = sqlite3.connect(db_file)
+    for pragma, value in pragmas.items():
+        conn.execute(f"PRAGMA {pragma} = {value};")
+    return conn
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version;").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection):
+    current = schema_version(conn)
+    applied = False
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        applied = True
+        try:
+            conn.execute("BEGIN;")
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version};")
+            conn.commit()
+            logger.info(f"Applied migration {version}: {description}")
+        except Exception:
+            conn.rollback()
+            logger.error(f"Migration {version} ({description}) failed.")
+            raise
+    if applied: #columns may have changed, the views list them
+        with conn:
+            create_views(conn)
+
+
+def db_layout(conn: sqlite3.Connection) -> str:
+    try:
+        row = conn.execute("SELECT value FROM db_meta WHERE key = 'layout';").fetchone()
+    except sqlite3.OperationalError: #before migration 3
+        return 'plain'
+    return row[0] if row else 'plain'
+
+
+def _encoded_ddl(ddl: str) -> str:
+    #TEXT -> INTEGER for the dictionary encoded columns of a CREATE TABLE statement
+    match = re.search(r'CREATE TABLE\s+(?:IF NOT EXISTS\s+)?"?(\w+)', ddl)
+    for column in ENCODED_COLUMNS.get(match.group(1), ()) if match else ():
+        ddl = re.sub(rf'^(\s*{column}\s+)TEXT\b', r'\1INTEGER', ddl, flags=re.MULTILINE)
+    return ddl
+
+
+def create_views(conn: sqlite3.Connection):
+    """(Re)create v_<table> for every table: the columns of the table with the encoded ones resolved to text."""
+    encoded = db_layout(conn) == 'encoded'
+    for table in TABLES:
+        conn.execute(f"DROP VIEW IF EXISTS v_{table};")
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table});")]
+        decoded = ENCODED_COLUMNS.get(table, ()) if encoded else ()
+        select = ', '.join(f"d_{column}.value AS {column}" if column in decoded else f"t.{column}" for column in columns)
+        joins = ''.join(f" LEFT JOIN string_dict d_{column} ON d_{column}.id = t.{column}" for column in decoded)
+        conn.execute(f"CREATE VIEW v_{table} AS SELECT {select} FROM {table} t{joins};")
+
+
+def set_layout(conn: sqlite3.Connection, name: str):
+    conn.execute("INSERT OR REPLACE INTO db_meta (key, value) VALUES ('layout', ?);", (name,))
+    create_views(conn)
+
+
+class StringDict:
+    """
+    In-process intern cache of string_dict (value -> id), loaded once per connection.
+    Missing values are inserted and committed on their own before the rows that use them, so a rolled back
+    batch never leaves ids in the cache that are not in the database (unused strings are harmless).
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.ids = dict(conn.execute("SELECT value, id FROM string_dict;"))
+
+    def intern(self, values):
+        missing = {value for value in values if value is not None and value not in self.ids}
+        if not missing:
+            return
+        with self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO string_dict (value) VALUES (?);", [(value,) for value in missing])
+        for value in missing:
+            self.ids[value] = self.conn.execute("SELECT id FROM string_dict WHERE value = ?;", (value,)).fetchone()[0]
+
+
+def convert_to_encoded(db_file: Path = DB_FILE):
+    """Rewrite a plain database to the encoded layout in one transaction, then VACUUM to give the space back."""
+    size_before = db_file.stat().st_size
+    conn = connect(db_file)
+    try:
+        migrate(conn)
+        if db_layout(conn) == 'encoded':
+            logger.info(f"{db_file} is already encoded")
+            return
+        conn.execute("PRAGMA foreign_keys = OFF;") #tables are dropped and recreated, the children keep their rows
+        conn.execute("BEGIN;")
+        for table in TABLES:
+            conn.execute(f"DROP VIEW IF EXISTS v_{table};")
+        for table, columns in ENCODED_COLUMNS.items():
+            for column in columns:
+                conn.execute(f"INSERT OR IGNORE INTO string_dict (value) SELECT DISTINCT {column} FROM {table} WHERE {column} IS NOT NULL;")
+            ddl = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?;", (table,)).fetchone()[0]
+            indexes = [row[0] for row in conn.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL;", (table,))]
+            all_columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table});")]
+            select = ', '.join(f"(SELECT id FROM string_dict WHERE value = t.{column})" if column in columns else f"t.{column}"
+                               for column in all_columns)
+            conn.execute(re.sub(rf'CREATE TABLE\s+(IF NOT EXISTS\s+)?"?{table}"?', f"CREATE TABLE {table}_encoded", _encoded_ddl(ddl), count=1))
+            conn.execute(f"INSERT INTO {table}_encoded ({', '.join(all_columns)}) SELECT {select} FROM {table} t;")
+            conn.execute(f"DROP TABLE {table};")
+            conn.execute(f"ALTER TABLE {table}_encoded RENAME TO {table};")
+            for index in indexes:
+                conn.execute(index)
+        set_layout(conn, 'encoded')
+        conn.commit()
+        conn.execute("PRAGMA foreign_keys = ON;")
+        conn.execute("VACUUM;")
+        logger.info(f"Converted {db_file} to the encoded layout: {size_before / 1024 / 1024:.1f} MB -> "
+                    f"{db_file.stat().st_size / 1024 / 1024:.1f} MB")
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        logger.error(f"Conversion of {db_file} failed, the database is unchanged.")
+        raise
+    finally:
+        conn.close()
+
+
+def db_setup(db_file: Path = DB_FILE, layout: str = 'plain'):
     try:
-        if DB_FILE.exists():
+        if db_file.exists():
             logger.info("Database already exists")
+            with connect(db_file) as conn:
+                migrate(conn)
         else:
-            with sqlite3.connect(DB_FILE) as conn:
+            with connect(db_file) as conn:
                 cur = conn.cursor()
                 for ddl in DDL_STATEMENTS:
-                    cur.execute(ddl)
+                    cur.execute(_encoded_ddl(ddl) if layout == 'encoded' else ddl)
+                migrate(conn)
+                if layout == 'encoded':
+                    set_layout(conn, 'encoded')
             logger.info('Database setup complete.')
     except Exception as e:
         logger.error(f"Database setup failed. {e}")
@@ -181,4 +410,12 @@ def db_setup():
 
 
 if __name__ == '__main__':
-    db_setup()
\ No newline at end of file
+    arg_parser = argparse.ArgumentParser(description="Create / migrate the auctions database.")
+    arg_parser.add_argument('--db', type=Path, default=DB_FILE)
+    arg_parser.add_argument('--layout', choices=('plain', 'encoded'), default='plain', help="layout of a new database")
+    arg_parser.add_argument('--convert', action='store_true', help="rewrite an existing plain database as encoded")
+    args = arg_parser.parse_args()
+    if args.convert:
+        convert_to_encoded(args.db)
+    else:
+        db_setup(args.db, args.layout)
\ No newline at end of file
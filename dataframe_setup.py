@@ -1,6 +1,5 @@
 import pandas as pd
 import sqlite3
-import json
 import logging
 import logging.handlers
 from logging.handlers import QueueHandler
@@ -8,7 +7,22 @@ from pathlib import Path
 from multiprocessing import Pool, Manager
 from auction_filter import auction_filter
 from logger_config import setup_logger
+from utils import bounded_imap, iter_data_files, read_records
+from schema_registry import SchemaRegistry, INT_WIDTHS
+from database_setup import connect
 import gc
+import os
+import json
+import uuid
+import metrics
+import profiling
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.dataset as ds
+except ImportError: #optional, only needed for the parquet output
+    pa = pq = ds = None
 
 """
 First problem starts with the implementation of class - auction_filter. 
@@ -22,6 +36,14 @@ LOGGER_CONF = ('dataframe_setup', 'dataframe_setup.log')
 json_dir = Path(r"archive/parsed_archive")
 output_db = "dataframe.db"
 batch_size = 100
+chunk_rows = 50_000 #rows per committed chunk in streaming mode, bounds peak memory independently of batch_size
+files_in_flight = 2 * (os.cpu_count() or 1) #files processed but not yet consumed in streaming mode, 2 per default pool worker
+progress_table = '_build_progress' #files already committed to output_db, lets a streaming build resume
+parquet_dir = Path("dataframe_parquet")
+registry_path = Path("schema_registry.json") #canonical column dtypes, kept stable across batches and runs
+partition_col = 'snapshot_day'
+
+SINK_WRITE_SECONDS = metrics.histogram('auction_sink_write_seconds', 'Time to write and commit one row chunk to a sink')
 
 
 worker_instance = None
@@ -42,15 +64,36 @@ def init_worker(queue, logger_conf):
 def worker_task(file_path):
     processed_auctions = []
 
-    with open(file_path, 'r') as f:
-        auctions = json.load(f)
+    _, auctions = read_records(Path(file_path))
 
     for auction in auctions:
         processed_auctions.append(worker_instance.flat_single_auction(auction))
 
     return processed_auctions
 
-def process_batch(file_batch, pool, is_first_batch):
+def worker_task_with_path(file_path):
+    #imap_unordered returns results out of order, so each result carries its file
+    return file_path, worker_task(file_path)
+
+def _add_missing_columns(cursor, df, table_name, registry, logger):
+    cursor.execute(f"PRAGMA table_info({table_name})")
+    db_cols = {row[1] for row in cursor.fetchall()}
+    new_cols = set(df.columns) - db_cols
+
+    for col in new_cols:
+        sql_type = registry.sql_type(col)
+
+        try:
+            cursor.execute(f'ALTER TABLE {table_name} ADD COLUMN "{col}" {sql_type}')
+            logger.info(f"Added column {col} {sql_type} to {table_name}")
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Could not add column {col}: {e}")
+
+def _registered_only(df, registry: SchemaRegistry):
+    #columns without a registered dtype only held nulls so far: not created as TEXT now, added with their real type later
+    return df[[col for col in df.columns if col in registry.dtypes]]
+
+def process_batch(file_batch, pool, is_first_batch, registry: SchemaRegistry, logger):
     results = pool.map(worker_task, file_batch)
 
     all_auctions_unfiltered = [auction for sublist in results for auction in sublist]
@@ -59,33 +102,15 @@ def process_batch(file_batch, pool, is_first_batch):
     if not all_auctions:
         return False
 
-    df = pd.DataFrame(all_auctions).fillna(0)
-    df = df.infer_objects(copy=False) #it changes type of data in a column to matching one
+    df = _registered_only(registry.cast(pd.DataFrame(all_auctions)), registry) #registered dtypes instead of per batch inference
 
-    con = sqlite3.connect(output_db)
+    con = connect(output_db, 'ingest')
     table_name = 'auctions_processed'
 
     if is_first_batch:
         df.to_sql(table_name, con, if_exists='replace', index=False)
     else:
-        cursor = con.cursor()
-        cursor.execute(f"PRAGMA table_info({table_name})")
-        db_cols = {row[1] for row in cursor.fetchall()}
-        new_cols = set(df.columns) - db_cols
-
-        for col in new_cols:
-            pd_type = df[col].dtype
-            sql_type = "TEXT"
-            if "int" in str(pd_type):
-                sql_type = "INTEGER"
-            elif "float" in str(pd_type):
-                sql_type = "REAL"
-
-            try:
-                cursor.execute(f'ALTER TABLE {table_name} ADD COLUMN "{col}" {sql_type}')
-                print(f"DEBUG: Dodano nową kolumnę do bazy: {col}")
-            except sqlite3.OperationalError as e:
-                print(f"Warning: Could not add column {col}: {e}")
+        _add_missing_columns(con.cursor(), df, table_name, registry, logger)
         df.to_sql(table_name, con, if_exists='append', index=False)
     con.close()
 
@@ -95,7 +120,179 @@ def process_batch(file_batch, pool, is_first_batch):
     gc.collect()
     return True
 
-def df_setup():
+class SqliteSink:
+    """auctions_processed table in output_db. Rows and their files are committed in one transaction."""
+    name = 'sqlite'
+
+    def __init__(self, db_path, logger, registry: SchemaRegistry):
+        self.con = connect(db_path, 'ingest')
+        self.logger = logger
+        self.registry = registry
+        self.table_name = 'auctions_processed'
+
+    def committed_files(self) -> set:
+        self.con.execute(f"CREATE TABLE IF NOT EXISTS {progress_table} (file TEXT PRIMARY KEY)")
+        return {row[0] for row in self.con.execute(f"SELECT file FROM {progress_table}")}
+
+    def write(self, df, files):
+        #rows and the files they came from are committed in the same transaction, so a crash never loses or doubles a file
+        cursor = self.con.cursor()
+        df = _registered_only(df, self.registry)
+
+        if not df.empty:
+            cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{self.table_name}'")
+            if cursor.fetchone() is None:
+                cursor.execute(pd.io.sql.get_schema(df, self.table_name))
+            else:
+                _add_missing_columns(cursor, df, self.table_name, self.registry, self.logger)
+
+            columns = ', '.join(f'"{col}"' for col in df.columns)
+            placeholders = ', '.join('?' * len(df.columns))
+            cursor.executemany(f'INSERT INTO {self.table_name} ({columns}) VALUES ({placeholders})', df.itertuples(index=False, name=None))
+
+        cursor.executemany(f"INSERT OR IGNORE INTO {progress_table} (file) VALUES (?)", [(file,) for file in files])
+        self.con.commit()
+
+    def close(self):
+        self.con.close()
+
+
+def arrow_type(dtype: str):
+    #one arrow type per registry kind, int widths all map to int64 so a widened column keeps the schema of older parts
+    if dtype in INT_WIDTHS:
+        return pa.int64()
+    return pa.float64() if dtype == 'float64' else pa.string()
+
+
+class ParquetSink:
+    """
+    Hive-partitioned parquet dataset (snapshot_day=YYYY-MM-DD/part-*.parquet).
+    Every chunk is a new part file, recorded in the manifest only after it is fully written.
+    Parts missing from the manifest are leftovers of a crashed run and are removed on start.
+    """
+    name = 'parquet'
+    manifest_name = '_manifest.jsonl'
+
+    def __init__(self, root: Path, logger, registry: SchemaRegistry | None = None):
+        if pq is None:
+            raise ImportError("pyarrow is required for the parquet output.")
+        self.root = root
+        self.logger = logger
+        self.registry = registry #parts are written with the registry types, not the types inferred per chunk
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.manifest = self.root / self.manifest_name
+
+    def _read_manifest(self) -> list[dict]:
+        if not self.manifest.exists():
+            return []
+        with self.manifest.open('r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def committed_files(self) -> set:
+        entries = self._read_manifest()
+        parts = {entry['part'] for entry in entries}
+        for part_file in self.root.rglob('part-*.parquet'):
+            if part_file.name.split('_')[0] not in parts:
+                self.logger.warning(f"Removing uncommitted parquet part {part_file}")
+                part_file.unlink()
+        return {file for entry in entries for file in entry['files']}
+
+    def write(self, df, files):
+        part = f"part-{uuid.uuid4().hex}"
+        if not df.empty:
+            df = df.copy()
+            if 'snapshot_ts' in df.columns:
+                day = pd.to_datetime(df['snapshot_ts'].where(df['snapshot_ts'] > 0), unit='ms').dt.strftime('%Y-%m-%d')
+                df[partition_col] = day.fillna('unknown')
+            else:
+                df[partition_col] = 'unknown'
+            schema = None
+            if self.registry is not None:
+                #columns not registered yet only hold nulls so far, left out instead of guessing a type; read back as null
+                df = df[[col for col in df.columns if col == partition_col or col in self.registry.dtypes]]
+                schema = pa.schema([(col, pa.string() if col == partition_col else arrow_type(self.registry.dtypes[col]))
+                                    for col in df.columns])
+            for col in df.select_dtypes(include=['object', 'category']).columns:
+                df[col] = df[col].astype('string') #parquet dictionary-encodes strings itself, keeps part schemas uniform
+
+            table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+            pq.write_to_dataset(table, root_path=self.root, partition_cols=[partition_col],
+                                basename_template=f"{part}_{{i}}.parquet")
+
+        with self.manifest.open('a', encoding='utf-8') as f:
+            f.write(json.dumps({'part': part, 'files': list(files)}) + "\n")
+
+    def close(self):
+        pass
+
+
+def read_parquet_dataset(root: Path = parquet_dir, columns: list | None = None, days: list | None = None,
+                         registry: SchemaRegistry | None = None) -> pd.DataFrame:
+    """Read the parquet output back, optionally only some columns / snapshot days. Part schemas are merged."""
+    if pq is None:
+        raise ImportError("pyarrow is required to read the parquet output.")
+    part_files = list(root.rglob('part-*.parquet'))
+    if not part_files:
+        return pd.DataFrame(columns=columns)
+
+    #columns added in later chunks are null in older parts, int/float conflicts are promoted; a column whose
+    #registered kind changed between parts (e.g. int -> str) is read as the registry type
+    types = {}
+    for part_schema in (pq.read_schema(f) for f in part_files):
+        for field in part_schema:
+            types.setdefault(field.name, []).append(field.type)
+    fields = []
+    for name, column_types in types.items():
+        try:
+            fields.append(pa.unify_schemas([pa.schema([(name, t)]) for t in column_types], promote_options='permissive')[0])
+        except (pa.ArrowTypeError, pa.ArrowInvalid):
+            if registry is None:
+                registry = SchemaRegistry(registry_path)
+            fields.append(pa.field(name, arrow_type(registry.dtypes.get(name, 'str'))))
+    schema = pa.schema(fields)
+    if partition_col not in schema.names:
+        schema = schema.append(pa.field(partition_col, pa.string()))
+
+    dataset = ds.dataset(part_files, schema=schema, format='parquet', partitioning='hive', partition_base_dir=str(root))
+    flt = ds.field(partition_col).isin(days) if days else None
+    return dataset.to_table(columns=columns, filter=flt).to_pandas()
+
+
+def stream_build(file_paths, pool, sinks, registry: SchemaRegistry, logger):
+    """Consume worker results as they arrive and write fixed-size row chunks. Files already committed are skipped per sink."""
+    done = {sink.name: sink.committed_files() for sink in sinks}
+    todo = [file for file in file_paths if any(Path(file).name not in done[sink.name] for sink in sinks)]
+    if len(todo) < len(file_paths):
+        logger.info(f"Resuming build: {len(file_paths) - len(todo)} files already committed, {len(todo)} left.")
+
+    buffered, buffered_rows = [], 0 #[(file name, rows)]
+    def flush():
+        for sink in sinks:
+            pending = [(name, rows) for name, rows in buffered if name not in done[sink.name]]
+            if not pending:
+                continue
+            df = registry.cast(pd.DataFrame([row for _, rows in pending for row in rows]))
+            with SINK_WRITE_SECONDS.time(sink=sink.name):
+                sink.write(df, [name for name, _ in pending])
+        registry.save()
+        logger.info(f"Committed {buffered_rows} rows from {len(buffered)} files.")
+
+    #results are not buffered ahead of the sinks, a new file is submitted only when one is consumed
+    for file_path, processed in bounded_imap(pool, worker_task_with_path, todo, files_in_flight, ordered=False):
+        rows = [auction for auction in processed if auction is not None]
+        buffered.append((Path(file_path).name, rows))
+        buffered_rows += len(rows)
+        if buffered_rows >= chunk_rows:
+            flush()
+            buffered, buffered_rows = [], 0
+
+    if buffered:
+        flush()
+
+@metrics.STAGE_SECONDS.timed(stage='dataframe')
+@profiling.profiled('dataframe')
+def df_setup(streaming: bool = True, outputs: tuple = ('sqlite',)):
+    """outputs: 'sqlite' and/or 'parquet' (streaming mode only)."""
     main_logger = setup_logger(*LOGGER_CONF)
 
     m = Manager()
@@ -104,16 +301,31 @@ def df_setup():
     listener = logging.handlers.QueueListener(queue, *main_logger.handlers)
     listener.start()
 
+    registry = SchemaRegistry(registry_path)
+
     try:
-        file_paths = list(json_dir.glob('*.json'))
+        file_paths = iter_data_files(json_dir)
         total_files = len(file_paths)
         with Pool(initializer=init_worker, initargs=(queue, LOGGER_CONF)) as pool: #It needs initargs separatly, otheriwse it will execute in place here in line 62
+            if streaming:
+                sinks = []
+                try:
+                    if 'sqlite' in outputs:
+                        sinks.append(SqliteSink(output_db, main_logger, registry))
+                    if 'parquet' in outputs:
+                        sinks.append(ParquetSink(parquet_dir, main_logger, registry))
+                    stream_build(file_paths, pool, sinks, registry, main_logger)
+                finally:
+                    for sink in sinks:
+                        sink.close()
+                return
             for i in range(0, total_files, batch_size):
                 batch = file_paths[i: i + batch_size]
                 is_first = (i==0)
-                process_batch(batch, pool, is_first)
+                process_batch(batch, pool, is_first, registry, main_logger)
+                registry.save()
     finally:
         listener.stop()
 
 if __name__ == '__main__':
-    df_setup()
\ No newline at end of file
+    df_setup()
@@ -0,0 +1,200 @@
+import base64
+import gzip
+import struct
+import sys
+from pathlib import Path
+
+"""
+Purpose-built NBT reader for auction `item_bytes`.
+nbtlib builds a tag object for every node and `utils.nbt_to_python` then walks the whole tree again to unpack it.
+Here the binary stream is read straight into plain dicts/lists/ints/floats/strs in a single pass.
+A `spec` (nested dict of wanted keys, None = whole subtree) lets the reader skip everything else without building it,
+e.g. the large SkullOwner texture strings that the parser never looks at.
+Output matches `utils.nbt_base64_to_dict` except for array tags, which are returned as lists instead of numpy arrays.
+"""
+
+TAG_END, TAG_BYTE, TAG_SHORT, TAG_INT, TAG_LONG, TAG_FLOAT, TAG_DOUBLE = 0, 1, 2, 3, 4, 5, 6
+TAG_BYTE_ARRAY, TAG_STRING, TAG_LIST, TAG_COMPOUND, TAG_INT_ARRAY, TAG_LONG_ARRAY = 7, 8, 9, 10, 11, 12
+
+_NUMERIC = {
+    TAG_BYTE: struct.Struct('>b'),
+    TAG_SHORT: struct.Struct('>h'),
+    TAG_INT: struct.Struct('>i'),
+    TAG_LONG: struct.Struct('>q'),
+    TAG_FLOAT: struct.Struct('>f'),
+    TAG_DOUBLE: struct.Struct('>d'),
+}
+_NUMERIC_CHAR = {TAG_BYTE: 'b', TAG_SHORT: 'h', TAG_INT: 'i', TAG_LONG: 'q', TAG_FLOAT: 'f', TAG_DOUBLE: 'd'}
+_ARRAY_ITEM = {TAG_BYTE_ARRAY: TAG_BYTE, TAG_INT_ARRAY: TAG_INT, TAG_LONG_ARRAY: TAG_LONG}
+_USHORT = struct.Struct('>H')
+_INT = _NUMERIC[TAG_INT]
+
+#ExtraAttributes and display of every item in the `i` list - all that Parser.filter_single_auction reads
+ITEM_SPEC = {'i': {'tag': {'ExtraAttributes': None, 'display': None}}}
+
+
+def _read_string(data, pos):
+    length = _USHORT.unpack_from(data, pos)[0]
+    pos += 2
+    return data[pos:pos + length].decode('utf-8', 'replace'), pos + length
+
+
+def _read_payload(tag_id, data, pos):
+    numeric = _NUMERIC.get(tag_id)
+    if numeric is not None:
+        return numeric.unpack_from(data, pos)[0], pos + numeric.size
+
+    if tag_id == TAG_STRING:
+        return _read_string(data, pos)
+
+    if tag_id == TAG_COMPOUND:
+        result = {}
+        while True:
+            child_id = data[pos]
+            pos += 1
+            if child_id == TAG_END:
+                return result, pos
+            name, pos = _read_string(data, pos)
+            result[name], pos = _read_payload(child_id, data, pos)
+
+    if tag_id == TAG_LIST:
+        item_id = data[pos]
+        length = _INT.unpack_from(data, pos + 1)[0]
+        pos += 5
+        if item_id in _NUMERIC_CHAR:
+            #homogeneous numeric list - one struct call instead of one per item
+            fmt = f'>{length}{_NUMERIC_CHAR[item_id]}'
+            return list(struct.unpack_from(fmt, data, pos)), pos + struct.calcsize(fmt)
+        items = []
+        for _ in range(length):
+            item, pos = _read_payload(item_id, data, pos)
+            items.append(item)
+        return items, pos
+
+    if tag_id in _ARRAY_ITEM:
+        length = _INT.unpack_from(data, pos)[0]
+        fmt = f'>{length}{_NUMERIC_CHAR[_ARRAY_ITEM[tag_id]]}'
+        return list(struct.unpack_from(fmt, data, pos + 4)), pos + 4 + struct.calcsize(fmt)
+
+    raise ValueError(f"Unknown NBT tag id {tag_id} at offset {pos}")
+
+
+def _skip_payload(tag_id, data, pos):
+    numeric = _NUMERIC.get(tag_id)
+    if numeric is not None:
+        return pos + numeric.size
+
+    if tag_id == TAG_STRING:
+        return pos + 2 + _USHORT.unpack_from(data, pos)[0]
+
+    if tag_id == TAG_COMPOUND:
+        while True:
+            child_id = data[pos]
+            pos += 1
+            if child_id == TAG_END:
+                return pos
+            pos += 2 + _USHORT.unpack_from(data, pos)[0]
+            pos = _skip_payload(child_id, data, pos)
+
+    if tag_id == TAG_LIST:
+        item_id = data[pos]
+        length = _INT.unpack_from(data, pos + 1)[0]
+        pos += 5
+        if item_id in _NUMERIC:
+            return pos + length * _NUMERIC[item_id].size
+        for _ in range(length):
+            pos = _skip_payload(item_id, data, pos)
+        return pos
+
+    if tag_id in _ARRAY_ITEM:
+        length = _INT.unpack_from(data, pos)[0]
+        return pos + 4 + length * _NUMERIC[_ARRAY_ITEM[tag_id]].size
+
+    raise ValueError(f"Unknown NBT tag id {tag_id} at offset {pos}")
+
+
+def _read_selected(tag_id, data, pos, spec):
+    if spec is None:
+        return _read_payload(tag_id, data, pos)
+
+    if tag_id == TAG_COMPOUND:
+        result = {}
+        while True:
+            child_id = data[pos]
+            pos += 1
+            if child_id == TAG_END:
+                return result, pos
+            name, pos = _read_string(data, pos)
+            if name in spec:
+                result[name], pos = _read_selected(child_id, data, pos, spec[name])
+            else:
+                pos = _skip_payload(child_id, data, pos)
+
+    if tag_id == TAG_LIST:
+        #spec applies to every element of a list
+        item_id = data[pos]
+        length = _INT.unpack_from(data, pos + 1)[0]
+        pos += 5
+        items = []
+        for _ in range(length):
+            item, pos = _read_selected(item_id, data, pos, spec)
+            items.append(item)
+        return items, pos
+
+    return _read_payload(tag_id, data, pos)
+
+
+def parse_nbt(nbt_bytes: bytes, spec: dict | None = None) -> dict:
+    """Uncompressed NBT bytes -> plain python dict of the root compound (root name dropped, as nbtlib.File does)."""
+    if nbt_bytes[0] != TAG_COMPOUND:
+        raise TypeError(f"Non-Compound root tags is not supported: {nbt_bytes[0]}")
+    _, pos = _read_string(nbt_bytes, 1)
+    result, _ = _read_selected(TAG_COMPOUND, nbt_bytes, pos, spec)
+    return result
+
+
+def b64_to_dict(b64: str, spec: dict | None = None) -> dict:
+    raw = base64.b64decode(b64)
+    nbt_bytes = gzip.decompress(raw) if raw[:2] == b'\x1f\x8b' else raw
+    return parse_nbt(nbt_bytes, spec)
+
+
+def _normalize(value):
+    #numpy arrays from nbtlib compare as lists
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    return value
+
+
+def check_parity(snapshot_path: Path) -> int:
+    """Decode every auction of a raw snapshot with both decoders and print mismatches. Returns mismatch count."""
+    import utils
+
+    _, auctions = utils.read_records(snapshot_path)
+    checked = mismatches = 0
+    for auction in auctions:
+        b64 = auction['item_bytes']
+        expected = _normalize(utils.nbt_base64_to_dict(b64))
+        checked += 1
+        if b64_to_dict(b64) != expected:
+            mismatches += 1
+            print(f"Full decode mismatch: {auction.get('uuid')}")
+        selected = b64_to_dict(b64, ITEM_SPEC)
+        for item, expected_item in zip(selected['i'], expected['i']):
+            for key, value in item.get('tag', {}).items():
+                if value != expected_item['tag'][key]:
+                    mismatches += 1
+                    print(f"Selected decode mismatch ({key}): {auction.get('uuid')}")
+
+    print(f"Checked {checked} auctions, {mismatches} mismatches.")
+    return mismatches
+
+
+if __name__ == '__main__':
+    #python fast_nbt.py <raw snapshot .json/.jsonl.gz> ...
+    total = sum(check_parity(Path(arg)) for arg in sys.argv[1:])
+    sys.exit(1 if total else 0)
@@ -1,8 +1,129 @@
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import os
+import queue
+import threading
+import time
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from pathlib import Path
 
-def setup_logger(logger_name: str, log_file_name: str) -> logging.Logger:
+"""
+async_mode: the logger only puts records on an in-memory queue, one background QueueListener (shared by all async
+loggers) writes them to the rotating files - same idea as the QueueHandler / QueueListener pair in dataframe_setup.
+Records are formatted in the listener thread and the queue is unbounded, so a burst of errors never blocks the
+caller; pending records are flushed at exit. Forked pool workers write synchronously, as before.
+rate_limit: RateLimitFilter on the logger, repeated WARNING+ records from the same call site are dropped before
+they are formatted and counted, the count is appended to the next record let through.
+AUCTION_ASYNC_LOGGING=1 turns async mode on for every logger that does not choose itself.
+"""
+
+DEFAULT_ASYNC = os.environ.get('AUCTION_ASYNC_LOGGING', '0') == '1'
+
+
+class RateLimitFilter(logging.Filter):
+    """At most `burst` records per call site (file, line) every `window` seconds, for records at `level` and above."""
+
+    def __init__(self, burst: int = 20, window: float = 60.0, level: int = logging.WARNING):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.level = level
+        self._sites = {} #(pathname, lineno) -> [window start, records let through, records suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.level:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or now - site[0] >= self.window:
+                suppressed = site[2] if site is not None else 0
+                self._sites[key] = [now, 1, 0]
+            elif site[1] < self.burst:
+                site[1] += 1
+                return True
+            else:
+                site[2] += 1
+                return False
+
+        if suppressed:
+            record.msg = f"{record.getMessage()} (+{suppressed} similar messages suppressed in the last {self.window:.0f}s)"
+            record.args = None
+        return True
+
+    def drain_suppressed(self) -> dict:
+        """Call sites with suppressed records not reported yet -> count, and reset the counts."""
+        with self._lock:
+            pending = {key: site[2] for key, site in self._sites.items() if site[2]}
+            for key in pending:
+                self._sites[key][2] = 0
+            return pending
+
+
+_queue = None
+_listener = None
+_listener_pid = None #forked children (pool workers) never run the parent's listener thread
+_routes = {} #logger name -> file handler, used by the shared listener
+_async_lock = threading.Lock()
+
+
+class _RouteHandler(logging.Handler):
+    #the listener thread hands each record to the file handler of the logger that produced it
+    def handle(self, record):
+        handler = _routes.get(record.name)
+        if handler is not None and record.levelno >= handler.level:
+            handler.handle(record)
+        return True
+
+
+def _async_queue():
+    global _queue, _listener, _listener_pid
+    with _async_lock:
+        if _listener is None:
+            _queue = queue.SimpleQueue()
+            _listener = QueueListener(_queue, _RouteHandler())
+            _listener.start()
+            _listener_pid = os.getpid()
+            atexit.register(stop_async_logging)
+        return _queue
+
+
+def stop_async_logging():
+    """Flush pending records and stop the listener thread. Async loggers start it again on next use."""
+    global _queue, _listener
+    if _listener is None or _listener_pid != os.getpid():
+        return
+    for name in list(_routes):
+        logger = logging.getLogger(name)
+        for flt in logger.filters:
+            if isinstance(flt, RateLimitFilter):
+                for (path, line), count in flt.drain_suppressed().items():
+                    logger.warning(f"{count} messages from {Path(path).name}:{line} were suppressed by rate limiting")
+    with _async_lock:
+        if _listener is not None:
+            _listener.stop()
+            _queue = _listener = None
+
+
+class _AsyncQueueHandler(QueueHandler):
+    def handle(self, record):
+        if _listener_pid is not None and _listener_pid != os.getpid():
+            #forked worker: no listener here and atexit does not run in pool workers, write synchronously as before
+            return _RouteHandler().handle(record) if self.filter(record) else False
+        return super().handle(record)
+
+    def prepare(self, record):
+        #same process, so the record is handed over as it is and formatted in the listener thread
+        return record
+
+    def enqueue(self, record):
+        _async_queue().put_nowait(record) #restarts the listener if stop_async_logging() already ran
+
+
+def setup_logger(logger_name: str, log_file_name: str, *, async_mode: bool | None = None,
+                 rate_limit: RateLimitFilter | None = None) -> logging.Logger:
     log_dir = Path(".") / "logs"
     log_dir.mkdir(parents=True, exist_ok=True)
     log_file = log_dir / log_file_name
@@ -17,6 +138,14 @@ def setup_logger(logger_name: str, log_file_name: str) -> logging.Logger:
     log_format = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
     handler.setFormatter(log_format)
 
-    logger.addHandler(handler)
+    if async_mode if async_mode is not None else DEFAULT_ASYNC:
+        _routes[logger_name] = handler
+        _async_queue()
+        logger.addHandler(_AsyncQueueHandler(None))
+    else:
+        logger.addHandler(handler)
+
+    if rate_limit is not None:
+        logger.addFilter(rate_limit)
 
-    return logger
\ No newline at end of file
+    return logger
@@ -0,0 +1,329 @@
+import functools
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+"""
+In-process metrics: counters, gauges and histograms (with a timer context manager) kept in one registry.
+Modules declare their metrics at import time (`FETCH_SECONDS = metrics.histogram(...)`) and record on the hot path.
+Recording is off until `enable()` is called: every record method starts with a single flag check, and `time()`
+returns a shared no-op context manager, so instrumented code pays a function call per event when disabled.
+Export: Prometheus text format (`to_prometheus`, `write_prometheus`, `serve_prometheus`) or JSON snapshots
+(`snapshot`, `JsonExporter` appends one per interval).
+Worker processes have their own registry; `drain()` in the worker + `merge()` in the parent fold them together.
+"""
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+STAGE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+class _NoopTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.histogram._observe(time.perf_counter() - self.start, self.labels)
+        return False
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(key: tuple, extra: tuple = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, registry, name: str, description: str):
+        self.registry = registry
+        self.name = name
+        self.description = description
+        self.values = {} #label key -> value (counter / gauge) or [bucket counts, sum, count] (histogram)
+        self._lock = threading.Lock()
+
+    def state(self) -> dict:
+        with self._lock:
+            return {key: (list(value[0]), value[1], value[2]) if isinstance(value, list) else value
+                    for key, value in self.values.items()}
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        if not self.registry.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def _merge(self, key, value):
+        self.values[key] = self.values.get(key, 0) + value
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            self.values[_label_key(labels)] = value
+
+    def _merge(self, key, value):
+        self.values[key] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name: str, description: str, buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(registry, name, description)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        if not self.registry.enabled:
+            return
+        self._observe(value, _label_key(labels))
+
+    def _observe(self, value: float, key: tuple):
+        index = bisect_left(self.buckets, value) #first bucket with upper bound >= value, len(buckets) = +Inf
+        with self._lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, **labels):
+        """with histogram.time(): ... observes the elapsed seconds of the block."""
+        if not self.registry.enabled:
+            return _NOOP_TIMER
+        return _Timer(self, _label_key(labels))
+
+    def timed(self, **labels):
+        """Decorator version of time(), checked on every call so enable() after import still takes effect."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.time(**labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _merge(self, key, value):
+        counts, total, count = value
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0] = [a + b for a, b in zip(entry[0], counts)]
+        entry[1] += total
+        entry[2] += count
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.enabled = False
+        self.metrics = {} #name -> metric, in declaration order
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, description: str, **kwargs):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(self, name, description, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} already registered as {metric.kind}")
+            return metric
+
+    def counter(self, name: str, description: str) -> Counter:
+        return self._get(Counter, name, description)
+
+    def gauge(self, name: str, description: str) -> Gauge:
+        return self._get(Gauge, name, description)
+
+    def histogram(self, name: str, description: str, buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, description, buckets=buckets)
+
+    def reset(self):
+        for metric in self.metrics.values():
+            with metric._lock:
+                metric.values.clear()
+
+    def drain(self) -> dict:
+        """Recorded values since the last drain, as a picklable dict, and reset. Used to ship worker metrics to the parent."""
+        drained = {}
+        for name, metric in self.metrics.items():
+            with metric._lock:
+                if metric.values:
+                    drained[name] = metric.values
+                    metric.values = {}
+        return drained
+
+    def merge(self, drained: dict):
+        if not self.enabled:
+            return
+        for name, values in drained.items():
+            metric = self.metrics.get(name)
+            if metric is None:
+                continue
+            with metric._lock:
+                for key, value in values.items():
+                    metric._merge(key, value)
+
+    def snapshot(self) -> dict:
+        """JSON friendly view: counters / gauges as {labels: value}, histograms with count, sum and bucket counts."""
+        result = {}
+        for name, metric in self.metrics.items():
+            series = []
+            for key, value in metric.state().items():
+                entry = {'labels': dict(key)}
+                if metric.kind == 'histogram':
+                    counts, total, count = value
+                    entry.update({'count': count, 'sum': total,
+                                  'buckets': dict(zip([*map(str, metric.buckets), '+Inf'], counts))})
+                else:
+                    entry['value'] = value
+                series.append(entry)
+            result[name] = {'type': metric.kind, 'help': metric.description, 'series': series}
+        return result
+
+    def to_prometheus(self) -> str:
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.description}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for key, value in metric.state().items():
+                if metric.kind != 'histogram':
+                    lines.append(f"{name}{_label_text(key)} {value}")
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip([*map(str, metric.buckets), '+Inf'], counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_label_text(key, (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{_label_text(key)} {total}")
+                lines.append(f"{name}_count{_label_text(key)} {count}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+#shared by every module: one run of collect / parse / load / dataframe
+STAGE_SECONDS = histogram('auction_stage_seconds', 'Wall time of one pipeline stage run', buckets=STAGE_BUCKETS)
+
+
+def enable():
+    REGISTRY.enabled = True
+
+
+def disable():
+    REGISTRY.enabled = False
+
+
+def enabled() -> bool:
+    return REGISTRY.enabled
+
+
+def write_prometheus(path: Path, registry: MetricsRegistry = REGISTRY):
+    #atomic replace, the file can be picked up by node_exporter's textfile collector at any moment
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_text(registry.to_prometheus(), encoding='utf-8')
+    os.replace(tmp, path)
+
+
+def serve_prometheus(port: int, host: str = '127.0.0.1', registry: MetricsRegistry = REGISTRY) -> ThreadingHTTPServer:
+    """Serve /metrics from a daemon thread. Call .shutdown() on the returned server to stop it."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.to_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass #scrapes would flood stderr
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+
+class JsonExporter:
+    """Appends a {"ts": ..., "metrics": snapshot} line to path every interval seconds (and once more on stop)."""
+
+    def __init__(self, path: Path, interval: float = 60, registry: MetricsRegistry = REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self._stop = threading.Event()
+        self._thread = None
+
+    def write(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open('a', encoding='utf-8') as f:
+            f.write(json.dumps({'ts': time.time(), 'metrics': self.registry.snapshot()}, separators=(',', ':')))
+            f.write('\n')
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def start(self) -> 'JsonExporter':
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='metrics-json', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.write()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -1,15 +1,103 @@
-from logger_config import setup_logger
+from logger_config import setup_logger, RateLimitFilter
 import utils
+import fast_nbt
 from pathlib import Path
 import json
 import re
+import logging
+import logging.handlers
+from logging.handlers import QueueHandler
+from itertools import islice
+from multiprocessing import Pool, Manager
+from auction_cache import SeenAuctionCache
+from quarantine import QuarantineStore, error_text
+from auction_record import AuctionRecord, NESTED_KEYS
 from constants import key_extra, gem_types
+import metrics
+import profiling
+
+"""
+Parallel mode (processes > 1) follows dataframe_setup: every worker process owns its own Parser,
+created in the pool initializer, and forwards its logs through a QueueHandler to a listener in the parent.
+Auctions are sent to workers in chunks and collected with imap, so the output order is the input order.
+"""
+
+worker_parser = None
+
+DECODE_SECONDS = metrics.histogram('auction_nbt_decode_seconds', 'item_bytes decode time per auction')
+AUCTIONS_PARSED = metrics.counter('auction_parsed_total', 'Auctions parsed')
+PARSE_FAILURES = metrics.counter('auction_parse_failures_total', 'Auctions that could not be parsed')
+
+COLOR_CODE_RE = re.compile(r'§.')
+PET_LEVEL_RE = re.compile(r'\[Lvl (\d+)\]')
+
+def init_parse_worker(queue, logger_conf, use_fast_nbt, collect_metrics=False):
+    logger_name, _ = logger_conf
+    logger = logging.getLogger(logger_name)
+    logger.setLevel(logging.INFO)
+
+    if not logger.hasHandlers():
+        handler = QueueHandler(queue)
+        logger.addHandler(handler)
+
+    if collect_metrics:
+        metrics.enable()
+
+    global worker_parser
+    worker_parser = Parser(logger_conf, None, None, use_fast_nbt=use_fast_nbt)
+
+def parse_chunk(auctions):
+    results = []
+    for auction in auctions:
+        try:
+            results.append((worker_parser.filter_single_auction(auction, key_extra), None, None))
+        except Exception as e:
+            results.append((None, error_text(e), auction)) #failed auction goes back to the parent for the quarantine
+    return results, metrics.REGISTRY.drain() #worker timings are merged into the parent registry
 
 class Parser:
-    def __init__(self, logger_conf:tuple, output_parsed_path: Path, archive_path: Path):
-        self.logger = setup_logger(*logger_conf)
+    def __init__(self, logger_conf:tuple, output_parsed_path: Path, archive_path: Path, use_fast_nbt: bool = True,
+                 processes: int = 1, chunk_size: int = 2000, seen_cache: SeenAuctionCache | None = None,
+                 quarantine: QuarantineStore | None = None):
+        self.logger_conf = logger_conf
+        self.logger = setup_logger(*logger_conf, async_mode=True, rate_limit=RateLimitFilter()) #warnings per failing auction
         self.output_parsed_path = output_parsed_path
         self.archive_path = archive_path
+        self.use_fast_nbt = use_fast_nbt #False -> legacy nbtlib decoding
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self.seen_cache = seen_cache #skips auctions already decoded in the previous snapshot
+        self.quarantine = quarantine if quarantine is not None else QuarantineStore() #failed auctions, see quarantine.py
+
+        self._pool = None
+        self._manager = None
+        self._listener = None
+        self._finished = {} #source name -> (cache digests, failed keys, parsed count) until finish_source()
+        self._plan_keys = None
+        self._passthrough_keys = ()
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._manager = Manager()
+            queue = self._manager.Queue()
+            self._listener = logging.handlers.QueueListener(queue, *self.logger.handlers)
+            self._listener.start()
+            self._pool = Pool(self.processes, initializer=init_parse_worker, initargs=(queue, self.logger_conf, self.use_fast_nbt, metrics.enabled()))
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._listener.stop()
+            self._manager.shutdown()
+            self._pool = self._manager = self._listener = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
     @staticmethod
     def decode_petinfo(petinfo: str | None) -> tuple:
@@ -32,8 +120,8 @@ class Parser:
         if not txt:
             return None, None
 
-        colorless = re.sub(r'§.', '', txt)
-        match = re.search(r'\[Lvl (\d+)\]', colorless)
+        colorless = COLOR_CODE_RE.sub('', txt)
+        match = PET_LEVEL_RE.search(colorless)
         level = None
         clean = colorless.strip()
 
@@ -59,6 +147,41 @@ class Parser:
                     stack.append(item)
         return None
 
+    @staticmethod
+    def item_tag(decoded) -> dict:
+        #ExtraAttributes and display of an auctioned item sit at i[0].tag
+        try:
+            tag = decoded['i'][0]['tag']
+        except (KeyError, IndexError, TypeError):
+            return {}
+        return tag if isinstance(tag, dict) else {}
+
+    def passthrough_keys(self, key_extra_list) -> tuple:
+        #key_extra minus the attributes parsed into their own fields, computed once per key list
+        if key_extra_list is not self._plan_keys:
+            self._passthrough_keys = tuple(key for key in key_extra_list if key not in NESTED_KEYS)
+            self._plan_keys = key_extra_list
+        return self._passthrough_keys
+
+    def decode_item(self, nbt_data: str) -> tuple[dict, dict]:
+        """item_bytes -> (ExtraAttributes, display). Fixed path first, tree search for unusual layouts."""
+        if self.use_fast_nbt:
+            decoded = fast_nbt.b64_to_dict(nbt_data, fast_nbt.ITEM_SPEC)
+            tag = self.item_tag(decoded)
+            if 'ExtraAttributes' not in tag:
+                decoded = fast_nbt.b64_to_dict(nbt_data) #unusual layout, fall back to the full tree
+                tag = self.item_tag(decoded)
+        else:
+            decoded = utils.nbt_base64_to_dict(nbt_data)
+            tag = self.item_tag(decoded)
+
+        extra = tag.get('ExtraAttributes')
+        if extra is None:
+            extra = self.dfs_collect_value(decoded, 'ExtraAttributes')
+        display = tag.get('display')
+        if display is None:
+            display = self.dfs_collect_value(decoded, 'display')
+        return extra or {}, display or {}
 
     def _parse_gems(self, data):
         gems = {}
@@ -128,85 +251,122 @@ class Parser:
 
         return souls if souls else None
 
-    def filter_single_auction(self, auction, key_extra_list: set):
+    def filter_single_auction(self, auction, key_extra_list: set) -> AuctionRecord:
 
-        result = {}
         #or statement for future dataframe where auction_id is changed to uuid etc.
         auction_id = auction.get('auction_id') or auction.get('uuid')
         price = auction.get('price') or auction.get('starting_bid')
 
-        result['auction_id'] = auction_id
-        result['price'] = price
-
-        nbt_data = auction['item_bytes']
-        decoded = utils.nbt_base64_to_dict(nbt_data)
-        extra = self.dfs_collect_value(decoded, 'ExtraAttributes') or {}
-        display = self.dfs_collect_value(decoded, 'display') or {}
+        with DECODE_SECONDS.time():
+            extra, display = self.decode_item(auction['item_bytes'])
 
         level, cleaned_name = self.decode_name(display.get('Name'))
-        result['name'] = cleaned_name
 
         base_id = extra.get('id')
         if base_id == "PET":
             pet_type, tier, candy, held_item, skin = self.decode_petinfo(extra.get('petInfo'))
-            result['item_id'] = pet_type
+            item_id = pet_type
         else:
-            result['item_id'] = base_id
+            item_id = base_id
             tier, candy, held_item, skin = None, None, None, None
 
-        result['pet_info'] = {'level': level, 'tier': tier, 'candy_used': candy, 'held_item': held_item, 'pet_skin':skin}
-        result['gems'] = self._parse_gems(extra.get('gems'))
+        pet_info = {'level': level, 'tier': tier, 'candy_used': candy, 'held_item': held_item, 'pet_skin':skin}
 
         hook_data = extra.get('hook', {})
         line_data = extra.get('line', {})
         sinker_data = extra.get('sinker', {})
 
-        result['fishing_parts'] = self._parse_fishing_parts(hook_data, line_data, sinker_data)
-        result['necromancer_souls'] = self._parse_souls(extra.get('necromancer_souls'))
+        fishing_parts = self._parse_fishing_parts(hook_data, line_data, sinker_data)
 
-        to_drop = ['necromancer_souls', 'hook', 'line', 'sinker', 'gems']
-        temp = key_extra_list.copy()
-        for key in to_drop:
-            temp.remove(key)
+        #only attributes that are set are stored, missing ones read back as None
+        present = {key: extra[key] for key in self.passthrough_keys(key_extra_list) if extra.get(key) is not None}
 
-        for key in temp:
-            result[key] = extra.get(key, None)
+        return AuctionRecord(auction_id, price, cleaned_name, item_id, pet_info, self._parse_gems(extra.get('gems')),
+                             fishing_parts, self._parse_souls(extra.get('necromancer_souls')), present)
 
-        return result
+    def _filter_auctions(self, auctions):
+        #yields (parsed, error, failed_auction) for every BIN auction, in input order
+        bin_auctions = (auction for auction in auctions if auction.get('bin'))
 
+        if self.processes <= 1:
+            for auction in bin_auctions:
+                try:
+                    yield self.filter_single_auction(auction, key_extra), None, None
+                except Exception as e:
+                    yield None, e, auction
+            return
+
+        chunks = iter(lambda: list(islice(bin_auctions, self.chunk_size)), [])
+        for results, worker_metrics in self._get_pool().imap(parse_chunk, chunks):
+            metrics.REGISTRY.merge(worker_metrics)
+            yield from results
+
+    def iter_parsed(self, source: Path):
+        """Yield parsed auctions of one raw snapshot. Call finish_source() once they are persisted."""
+        meta, auctions = utils.read_records(source)
+        snapshot_ts = meta.get('lastUpdated')
+        failed = set()
+        current = None
+        count = 0
+
+        if self.seen_cache is not None:
+            auctions, current = self.seen_cache.diff(auctions)
+            self.logger.info(f"{len(auctions)} new or changed auctions of {len(current)} in {source.name}.")
+
+        try:
+            for parsed, e, auction in self._filter_auctions(auctions):
+                if e is None:
+                    count += 1
+                    parsed['snapshot_ts'] = snapshot_ts
+                    yield parsed
+                else:
+                    PARSE_FAILURES.inc()
+                    failed.add(SeenAuctionCache.auction_key(auction))
+                    self.logger.warning(f"Could not parse NBT for auction {auction.get('auction_id')}. Error: {error_text(e)}")
+                    self.quarantine.add(auction, e, source.name, snapshot_ts)
+        finally:
+            #one write per file instead of one per failure, also when the consumer stops early or a worker raises
+            self.quarantine.flush()
+        AUCTIONS_PARSED.inc(count)
+        if self.seen_cache is not None:
+            self.seen_cache.stage(current, failed)
+        self._finished[source.name] = (current, failed, count)
+
+    def finish_source(self, source: Path):
+        current, failed, count = self._finished.pop(source.name)
+        if self.seen_cache is not None:
+            self.seen_cache.commit(current, failed)
+
+        self.logger.info(f"Successfully parsed {source.name} -> {count} items.")
+        utils.archive(source, self.archive_path, logger=self.logger, compress=True)
+
+    def abandon_source(self, source: Path):
+        """Forget a source whose parsed auctions were not persisted, the next diff must not treat them as seen."""
+        finished = self._finished.pop(source.name, None)
+        if finished is not None and self.seen_cache is not None:
+            self.seen_cache.discard_pending(finished[0])
+
+    @metrics.STAGE_SECONDS.timed(stage='parse')
+    @profiling.profiled('parse')
     def parse(self, source_path):
         output_path = self.output_parsed_path
         source = Path(source_path)
+        finished = False
         try:
             output_path.mkdir(parents=True, exist_ok=True)
             output = output_path / source.name
 
-            with source.open("r", encoding="utf-8") as f:
-                data = json.load(f)
-
-            auctions = data.get("auctions", [])
-            cleaned = []
+            cleaned = list(self.iter_parsed(source))
 
-            for auction in auctions:
-                if not auction.get('bin'):
-                    continue
-
-                try:
-                    cleaned.append(self.filter_single_auction(auction, key_extra))
-
-                except Exception as e:
-                    self.logger.warning(f"Could not parse NBT for auction {auction.get('auction_id')}. Error: {e}")
-                    auction_id = auction.get('auction_id')
-                    error_filename = f"{auction_id}_from_{source.name}"
-                    utils.export_to_json(data, Path('bugged_auctions'), file_name=error_filename, create_folder=True)
-
-            with output.open("w", encoding="utf-8") as f:
-                json.dump(cleaned, f, ensure_ascii=False, indent=4)
+            if utils.is_jsonl_gz(source):
+                utils.write_jsonl_gz(output, cleaned)
+            else:
+                with output.open("w", encoding="utf-8") as f:
+                    json.dump(cleaned, f, ensure_ascii=False, indent=4, default=utils.json_default)
 
-            self.logger.info(f"Successfully parsed {source.name} -> {len(cleaned)} items.")
-            utils.archive(source, self.archive_path, logger=self.logger)
+            self.finish_source(source)
+            finished = True
             return True
-
         except FileNotFoundError:
             self.logger.error(f"File {source_path} not found.")
             return False
@@ -219,4 +379,7 @@ class Parser:
         except Exception as e:
             self.logger.error(f"An unexpected error occurred while parsing {source_path}: {e}")
             return False
+        finally:
+            if not finished:
+                self.abandon_source(source) #a retry parses every auction again
 
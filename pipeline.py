@@ -0,0 +1,119 @@
+import threading
+from itertools import islice
+from pathlib import Path
+from queue import Queue, Full
+from logger_config import setup_logger
+from parser import Parser
+from data_loader import DataLoader
+from database_setup import connect
+import utils
+import metrics
+
+QUEUE_DEPTH = metrics.gauge('auction_queue_depth', 'Items waiting in a bounded queue')
+
+"""
+Parse -> database without the intermediate parsed JSON hop.
+A producer thread runs the parser over the raw snapshots and puts chunks of parsed auctions on a bounded queue.
+The calling thread owns the SQLite connection and commits every chunk, so the parser works on the next chunk while
+the loader commits the previous one. When the queue is full the producer blocks (backpressure).
+A raw snapshot is archived only after all of its chunks are committed.
+"""
+
+_CHUNK, _SOURCE_END, _STOP = 'chunk', 'source_end', 'stop'
+
+
+class Pipeline:
+    def __init__(self, logger_conf: tuple, parser: Parser, loader: DataLoader, queue_size: int = 4, chunk_size: int = 5000,
+                 write_parsed: bool = False):
+        self.logger = setup_logger(*logger_conf)
+        self.parser = parser
+        self.loader = loader
+        self.queue_size = queue_size
+        self.chunk_size = chunk_size
+        self.write_parsed = write_parsed #also keep a parsed .jsonl.gz copy in parser.output_parsed_path
+
+        self._queue = None
+        self._stop = threading.Event()
+        self._producer_error = None
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except Full:
+                continue
+        return False
+
+    def _parsed_output(self, source: Path) -> Path:
+        stem = source.name.removesuffix(utils.JSONL_GZ_SUFFIX).removesuffix(utils.JSON_SUFFIX)
+        self.parser.output_parsed_path.mkdir(parents=True, exist_ok=True)
+        return self.parser.output_parsed_path / f"{stem}{utils.JSONL_GZ_SUFFIX}"
+
+    def _produce(self, sources: list[Path]):
+        try:
+            for source in sources:
+                if self._stop.is_set():
+                    break
+                try:
+                    records = self.parser.iter_parsed(source)
+                    writer = utils.open_jsonl_gz(self._parsed_output(source)) if self.write_parsed else None
+                    try:
+                        while chunk := list(islice(records, self.chunk_size)):
+                            if writer is not None:
+                                utils.write_jsonl_lines(writer, chunk)
+                            if not self._put((_CHUNK, source, chunk)):
+                                return
+                    finally:
+                        if writer is not None:
+                            writer.close()
+                    self._put((_SOURCE_END, source, None))
+                except Exception as e:
+                    #source stays in place, already committed chunks are skipped as duplicates on the next run
+                    self.parser.abandon_source(source)
+                    self.logger.error(f"An unexpected error occurred while parsing {source}: {e}")
+        except BaseException as e:
+            self._producer_error = e
+        finally:
+            self._put((_STOP, None, None))
+
+    def run(self, sources) -> int:
+        """Parse and load every raw snapshot in sources. Returns the number of snapshots fully committed."""
+        sources = [Path(source) for source in sources]
+        self._queue = Queue(maxsize=self.queue_size)
+        self._stop.clear()
+        self._producer_error = None
+
+        producer = threading.Thread(target=self._produce, args=(sources,), name="pipeline-parser", daemon=True)
+        producer.start()
+
+        committed = 0
+        try:
+            with connect(self.loader.db_path, 'ingest') as conn:
+                self.loader.prepare(conn)
+                self.loader._reset_counter()
+                while True:
+                    kind, source, chunk = self._queue.get()
+                    QUEUE_DEPTH.set(self._queue.qsize(), queue='pipeline')
+                    if kind == _STOP:
+                        break
+                    if kind == _CHUNK:
+                        self.loader.load_auctions(chunk, conn)
+                    else:
+                        self.loader._log_counter()
+                        self.loader._reset_counter()
+                        self.parser.finish_source(source)
+                        committed += 1
+        finally:
+            self._stop.set()
+            producer.join()
+            if self.parser.seen_cache is not None:
+                self.parser.seen_cache.discard_pending() #nothing staged outlives the run
+
+        if self._producer_error is not None:
+            raise self._producer_error
+        self.logger.info(f"Pipeline finished: {committed}/{len(sources)} snapshots committed.")
+        return committed
+
+    def run_dir(self, input_dir: Path) -> int:
+        return self.run(utils.iter_data_files(input_dir))
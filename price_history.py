@@ -0,0 +1,238 @@
+import argparse
+import json
+import math
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from logger_config import setup_logger
+from utils import tax
+from database_setup import DB_FILE, connect, migrate
+
+"""
+Per item price aggregates, kept up to date by DataLoader in the same transaction as the auction rows.
+Key: item_id, pet tier and pet level ('' / 0 for items that are not pets), resolution and bucket.
+Values: count, min, max, sum of prices, sum of prices after auction tax (utils.tax) and a log-bucket sketch
+of the prices, so percentiles of any range of buckets are a merge of a few rows instead of a scan of auctions.
+Each auction is counted once, in the bucket of the snapshot it was first loaded from (snapshot_ts, ms).
+
+New data goes into FINE_RESOLUTION (hourly) buckets; compact() rolls hourly buckets older than COMPACT_AFTER
+into daily ones. Databases loaded before this table existed are filled with rebuild().
+
+python price_history.py rebuild
+python price_history.py compact [--older-than-days 7]
+python price_history.py show HYPERION [--days 7] [--tier LEGENDARY --pet-level 100]
+"""
+
+FINE_RESOLUTION = 3600 #seconds
+COARSE_RESOLUTION = 86400
+COMPACT_AFTER = 7 * 86400
+SKETCH_GAMMA = 1.02 #neighbouring sketch bins differ by 2%, percentiles are within ~1% of the true value
+_LOG_GAMMA = math.log(SKETCH_GAMMA)
+
+KEY_COLUMNS = ('item_id', 'tier', 'pet_level', 'resolution', 'bucket_start')
+SELECT_QUERY = f"""SELECT count, min_price, max_price, sum_price, sum_net, sketch FROM price_history
+                   WHERE {' AND '.join(f'{column} = ?' for column in KEY_COLUMNS)};"""
+UPSERT_QUERY = f"""INSERT OR REPLACE INTO price_history ({', '.join(KEY_COLUMNS)}, count, min_price, max_price, sum_price, sum_net, sketch)
+                   VALUES ({', '.join('?' * (len(KEY_COLUMNS) + 6))});"""
+
+
+def sketch_index(price: float) -> int:
+    return math.floor(math.log(max(price, 1.0)) / _LOG_GAMMA)
+
+
+def sketch_value(index: int) -> float:
+    #middle of [gamma^i, gamma^(i+1)) in relative terms
+    return 2 * SKETCH_GAMMA ** (index + 1) / (SKETCH_GAMMA + 1)
+
+
+class PriceAggregate:
+    __slots__ = ('count', 'min_price', 'max_price', 'sum_price', 'sum_net', 'sketch')
+
+    def __init__(self):
+        self.count = 0
+        self.min_price = math.inf
+        self.max_price = -math.inf
+        self.sum_price = 0.0
+        self.sum_net = 0.0
+        self.sketch = {} #sketch_index -> count
+
+    def add(self, price: float):
+        self.count += 1
+        self.min_price = min(self.min_price, price)
+        self.max_price = max(self.max_price, price)
+        self.sum_price += price
+        self.sum_net += price - tax(price)
+        index = sketch_index(price)
+        self.sketch[index] = self.sketch.get(index, 0) + 1
+
+    def merge(self, other: 'PriceAggregate'):
+        self.count += other.count
+        self.min_price = min(self.min_price, other.min_price)
+        self.max_price = max(self.max_price, other.max_price)
+        self.sum_price += other.sum_price
+        self.sum_net += other.sum_net
+        for index, count in other.sketch.items():
+            self.sketch[index] = self.sketch.get(index, 0) + count
+
+    def quantile(self, q: float) -> float | None:
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.sketch):
+            seen += self.sketch[index]
+            if seen > rank:
+                #the sketch value is clamped to what was actually seen, exact for q = 0 / 1
+                return min(max(sketch_value(index), self.min_price), self.max_price)
+        return self.max_price
+
+    def net_quantile(self, q: float) -> float | None:
+        price = self.quantile(q)
+        return None if price is None else price - tax(price)
+
+    @property
+    def mean(self) -> float | None:
+        return self.sum_price / self.count if self.count else None
+
+    @property
+    def mean_net(self) -> float | None:
+        return self.sum_net / self.count if self.count else None
+
+    def row(self) -> tuple:
+        return (self.count, self.min_price, self.max_price, self.sum_price, self.sum_net,
+                json.dumps(self.sketch, separators=(',', ':')))
+
+    @classmethod
+    def from_row(cls, row) -> 'PriceAggregate':
+        aggregate = cls()
+        aggregate.count, aggregate.min_price, aggregate.max_price, aggregate.sum_price, aggregate.sum_net, sketch = row
+        aggregate.sketch = {int(index): count for index, count in json.loads(sketch).items()}
+        return aggregate
+
+    def summary(self) -> dict:
+        return {'count': self.count, 'min': self.min_price, 'max': self.max_price, 'mean': self.mean,
+                'p10': self.quantile(0.1), 'median': self.quantile(0.5), 'p90': self.quantile(0.9),
+                'mean_net': self.mean_net, 'median_net': self.net_quantile(0.5)}
+
+
+class PriceHistory:
+    def __init__(self, logger_conf: tuple = ('price_history', 'price_history.log'), resolution: int = FINE_RESOLUTION):
+        self.logger = setup_logger(*logger_conf)
+        self.resolution = resolution
+
+    def aggregate(self, records) -> dict[tuple, PriceAggregate]:
+        """records: (item_id, pet tier, pet level, price, snapshot_ts ms). Rows missing an item, price or time are left out."""
+        bucket_ms = self.resolution * 1000
+        aggregates = {}
+        for item_id, tier, pet_level, price, snapshot_ts in records:
+            if item_id is None or price is None or snapshot_ts is None:
+                continue
+            key = (item_id, tier or '', pet_level or 0, self.resolution, snapshot_ts - snapshot_ts % bucket_ms)
+            aggregate = aggregates.get(key)
+            if aggregate is None:
+                aggregate = aggregates[key] = PriceAggregate()
+            aggregate.add(price)
+        return aggregates
+
+    @staticmethod
+    def apply(conn: sqlite3.Connection, aggregates: dict[tuple, PriceAggregate]):
+        #read-merge-write of the touched keys, runs inside the caller's transaction
+        for key, aggregate in aggregates.items():
+            row = conn.execute(SELECT_QUERY, key).fetchone()
+            if row is not None:
+                aggregate.merge(PriceAggregate.from_row(row))
+        conn.executemany(UPSERT_QUERY, [key + aggregate.row() for key, aggregate in aggregates.items()])
+
+    def update(self, records, conn: sqlite3.Connection):
+        self.apply(conn, self.aggregate(records))
+
+    def rebuild(self, conn: sqlite3.Connection):
+        """Recompute the whole table from the auctions already in the database."""
+        records = conn.execute("""SELECT a.item_id, p.tier, p.level, a.price, a.snapshot_ts
+                                  FROM v_auctions a LEFT JOIN v_pet_info p ON p.auction_id = a.auction_id;""")
+        aggregates = self.aggregate(records)
+        with conn:
+            conn.execute("DELETE FROM price_history;")
+            self.apply(conn, aggregates)
+        self.logger.info(f"Rebuilt price history: {len(aggregates)} buckets.")
+
+    def compact(self, conn: sqlite3.Connection, older_than: int = COMPACT_AFTER, now: float | None = None) -> int:
+        """Roll fine buckets older than `older_than` seconds into COARSE_RESOLUTION buckets. Returns fine rows removed."""
+        coarse_ms = COARSE_RESOLUTION * 1000
+        cutoff = int(((now if now is not None else time.time()) - older_than) * 1000)
+        cutoff -= cutoff % coarse_ms #only whole days, a day is never split between the two resolutions
+
+        with conn:
+            rows = conn.execute(f"""SELECT {', '.join(KEY_COLUMNS)}, count, min_price, max_price, sum_price, sum_net, sketch
+                                    FROM price_history WHERE resolution < ? AND bucket_start < ?;""",
+                                (COARSE_RESOLUTION, cutoff)).fetchall()
+            if not rows:
+                return 0
+            aggregates = {}
+            for row in rows:
+                item_id, tier, pet_level, _, bucket_start = row[:5]
+                key = (item_id, tier, pet_level, COARSE_RESOLUTION, bucket_start - bucket_start % coarse_ms)
+                aggregate = aggregates.get(key)
+                if aggregate is None:
+                    aggregate = aggregates[key] = PriceAggregate()
+                aggregate.merge(PriceAggregate.from_row(row[5:]))
+            conn.execute("DELETE FROM price_history WHERE resolution < ? AND bucket_start < ?;", (COARSE_RESOLUTION, cutoff))
+            self.apply(conn, aggregates)
+        self.logger.info(f"Compacted {len(rows)} buckets into {len(aggregates)} daily buckets.")
+        return len(rows)
+
+    @staticmethod
+    def lookup(conn: sqlite3.Connection, item_id: str, tier: str | None = None, pet_level: int | None = None,
+               since_ms: int | None = None, until_ms: int | None = None) -> PriceAggregate:
+        """All buckets of an item (optionally one pet tier / level) starting in [since_ms, until_ms), merged."""
+        conditions, params = ['item_id = ?'], [item_id]
+        for column, value in (('tier', tier), ('pet_level', pet_level)):
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        if since_ms is not None:
+            conditions.append('bucket_start >= ?')
+            params.append(since_ms)
+        if until_ms is not None:
+            conditions.append('bucket_start < ?')
+            params.append(until_ms)
+
+        result = PriceAggregate()
+        for row in conn.execute(f"""SELECT count, min_price, max_price, sum_price, sum_net, sketch FROM price_history
+                                    WHERE {' AND '.join(conditions)};""", params):
+            result.merge(PriceAggregate.from_row(row))
+        return result
+
+
+def main(argv=None) -> int:
+    arg_parser = argparse.ArgumentParser(description="Maintain or query the price_history aggregates.")
+    arg_parser.add_argument('command', choices=('rebuild', 'compact', 'show'))
+    arg_parser.add_argument('item_id', nargs='?')
+    arg_parser.add_argument('--db', type=Path, default=DB_FILE)
+    arg_parser.add_argument('--older-than-days', type=float, default=COMPACT_AFTER / 86400)
+    arg_parser.add_argument('--days', type=float, help="show: only the last N days")
+    arg_parser.add_argument('--tier')
+    arg_parser.add_argument('--pet-level', type=int)
+    args = arg_parser.parse_args(argv)
+
+    history = PriceHistory()
+    if args.command == 'show':
+        if args.item_id is None:
+            arg_parser.error("show needs an item_id")
+        since = int((time.time() - args.days * 86400) * 1000) if args.days else None
+        with connect(args.db, 'read') as conn:
+            print(json.dumps(history.lookup(conn, args.item_id, args.tier, args.pet_level, since).summary(), indent=4))
+        return 0
+
+    with connect(args.db, 'ingest') as conn:
+        migrate(conn)
+        if args.command == 'rebuild':
+            history.rebuild(conn)
+        else:
+            history.compact(conn, int(args.older_than_days * 86400))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
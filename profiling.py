@@ -0,0 +1,264 @@
+import cProfile
+import datetime
+import functools
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+
+"""
+Opt-in profiling of a Parser.parse / DataLoader.load_from_dir / df_setup run.
+Off unless configure() is called or AUCTION_PROFILE is set ('sampling' or 'cprofile'); the wrapped functions then
+only pay one attribute check per call.
+
+sampling - a daemon thread reads the stack of the profiled thread every `interval` seconds and counts functions
+           (self = on top of the stack, cumulative = anywhere on it). Cost scales with 1 / interval, the default
+           5 ms keeps it to a few percent, so it can run on production snapshots.
+cprofile - deterministic cProfile of every call, exact counts but several times slower. For local runs.
+allocations=True adds tracemalloc (either mode), with live memory per source line snapshotted every
+`alloc_period` seconds. tracemalloc makes allocation heavy code (zlib, NBT decoding) several times slower,
+so it is off by default and meant for local runs.
+
+Each run writes logs/profile_<name>_<timestamp>.txt. Only the calling thread / process is profiled, so with
+Parser(processes > 1) or df_setup the time spent in pool workers shows up as waiting on the pool.
+"""
+
+LOG_DIR = Path(".") / "logs"
+TOP_N = 30
+
+
+class _Settings:
+    def __init__(self):
+        self.mode = None #None = off, 'sampling' or 'cprofile'
+        self.interval = 0.005
+        self.allocations = False #tracemalloc for the whole run, snapshots every alloc_period seconds
+        self.alloc_period = 1.0
+        self.output_dir = LOG_DIR
+        self.active = False #one profile at a time, nested wrapped calls run unprofiled
+
+
+settings = _Settings()
+
+
+def configure(mode: str | None = 'sampling', interval: float = 0.005, allocations: bool = False,
+              alloc_period: float = 1.0, output_dir: Path = LOG_DIR):
+    """mode None turns profiling off. interval is the stack sampling period in seconds."""
+    if mode not in (None, 'sampling', 'cprofile'):
+        raise ValueError(f"Unknown profiling mode: {mode}")
+    settings.mode = mode
+    settings.interval = interval
+    settings.allocations = allocations
+    settings.alloc_period = alloc_period
+    settings.output_dir = output_dir
+
+
+def configure_from_env():
+    mode = os.environ.get('AUCTION_PROFILE')
+    if mode:
+        configure(mode, interval=float(os.environ.get('AUCTION_PROFILE_INTERVAL', 0.005)),
+                  allocations=os.environ.get('AUCTION_PROFILE_ALLOCATIONS', '0') == '1')
+
+
+def _function_key(code) -> str:
+    return f"{Path(code.co_filename).name}:{code.co_firstlineno}({code.co_name})"
+
+
+class SamplingProfiler:
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self.self_counts = Counter()
+        self.cumulative_counts = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+        self.samples += 1
+        self.self_counts[_function_key(frame.f_code)] += 1
+        seen = set()
+        while frame is not None:
+            key = _function_key(frame.f_code)
+            if key not in seen: #recursion counts once per sample
+                seen.add(key)
+                self.cumulative_counts[key] += 1
+            frame = frame.f_back
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def report(self, wall: float) -> str:
+        out = io.StringIO()
+        out.write(f"mode: sampling, interval {self.interval * 1000:.1f} ms, {self.samples} samples\n\n")
+        if self.samples:
+            for title, counts in (("Cumulative (function anywhere on the stack)", self.cumulative_counts),
+                                  ("Self (function on top of the stack)", self.self_counts)):
+                out.write(f"{title}\n{'samples':>9} {'%':>6} {'est. s':>9}  function\n")
+                for key, count in counts.most_common(TOP_N):
+                    share = count / self.samples
+                    out.write(f"{count:>9} {share:>6.1%} {share * wall:>9.3f}  {key}\n")
+                out.write("\n")
+        return out.getvalue()
+
+
+class AllocationSampler:
+    """
+    tracemalloc with one frame per trace, snapshotted every `period` seconds from a daemon thread.
+    Reports the largest live size seen per source line, so short-lived buffers show up as well as retained data.
+    start() / stop() must run on the profiled thread: switching tracemalloc from another thread races with
+    allocations made while the GIL is released (zlib, sqlite) and can crash the interpreter.
+    """
+
+    def __init__(self, period: float):
+        self.period = period
+        self.size = Counter() #source line -> largest live bytes in any snapshot
+        self.count = Counter()
+        self.snapshots = 0
+        self.peak = 0
+        self.skipped = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _snapshot(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+                                                              tracemalloc.Filter(False, __file__)))
+        for stat in snapshot.statistics('lineno'):
+            frame = stat.traceback[0]
+            key = f"{Path(frame.filename).name}:{frame.lineno}"
+            if stat.size > self.size[key]:
+                self.size[key] = stat.size
+                self.count[key] = stat.count
+        self.snapshots += 1
+
+    def _run(self):
+        while not self._stop.wait(self.period):
+            self._snapshot()
+
+    def start(self):
+        if tracemalloc.is_tracing(): #someone else's session, leave it alone
+            self.skipped = True
+            return
+        tracemalloc.start(1)
+        self._thread = threading.Thread(target=self._run, name='allocation-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self.skipped:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._snapshot()
+        self.peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    def report(self) -> str:
+        if self.skipped:
+            return "Allocation tracking skipped: tracemalloc was already tracing.\n"
+        out = io.StringIO()
+        out.write(f"Allocation hotspots: largest live size per line over {self.snapshots} snapshots "
+                  f"(every {self.period}s), peak traced {self.peak / 1024 / 1024:.1f} MB\n")
+        out.write(f"{'KiB':>10} {'blocks':>9}  line\n")
+        for key, size in self.size.most_common(TOP_N):
+            out.write(f"{size / 1024:>10.1f} {self.count[key]:>9}  {key}\n")
+        return out.getvalue()
+
+
+class CProfileProfiler:
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def report(self, wall: float) -> str:
+        out = io.StringIO()
+        out.write("mode: cprofile (deterministic)\n\n")
+        stats = pstats.Stats(self.profile, stream=out)
+        stats.sort_stats('cumulative').print_stats(TOP_N)
+        stats.sort_stats('tottime').print_stats(TOP_N)
+        return out.getvalue()
+
+
+class profile:
+    """with profile('parse'): ... - profiles the block if profiling is configured, writes the report on exit."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.profiler = None
+        self.allocations = None
+        self.report_path = None
+
+    def __enter__(self):
+        if settings.mode is None or settings.active:
+            return self
+        settings.active = True
+        if settings.mode == 'cprofile':
+            self.profiler = CProfileProfiler()
+        else:
+            self.profiler = SamplingProfiler(threading.get_ident(), settings.interval)
+        if settings.allocations:
+            self.allocations = AllocationSampler(settings.alloc_period)
+            self.allocations.start()
+        self._start = time.perf_counter()
+        self.profiler.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.profiler is None:
+            return False
+        try:
+            self.profiler.stop()
+            wall = time.perf_counter() - self._start
+            body = self.profiler.report(wall)
+            if self.allocations is not None:
+                self.allocations.stop()
+                body += "\n" + self.allocations.report()
+            self.report_path = self._write(body, wall)
+        finally:
+            settings.active = False
+        return False
+
+    def _write(self, body: str, wall: float) -> Path:
+        settings.output_dir.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        path = settings.output_dir / f"profile_{self.name}_{stamp}.txt"
+        with path.open('w', encoding='utf-8') as f:
+            f.write(f"profile: {self.name}\nwall time: {wall:.3f}s\n")
+            f.write(body)
+        return path
+
+
+def profiled(name: str):
+    """Decorator: profile every call of the function under `name` when profiling is configured."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if settings.mode is None:
+                return func(*args, **kwargs)
+            with profile(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+configure_from_env()
@@ -0,0 +1,165 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from logger_config import setup_logger
+import utils
+
+"""
+Auctions the parser could not decode, kept for a later look / replay instead of a full snapshot dump per failure.
+Only what is needed to parse the auction again is stored (id, price, bin, raw item_bytes) plus the error.
+Entries are deduplicated by a hash of item_bytes - the same broken item shows up in every snapshot until it sells -
+and buffered while a file is parsed, then appended as one gzip member by flush().
+
+python quarantine.py stats
+python quarantine.py replay [--output parsed/] [--dry-run]
+"""
+
+QUARANTINE_DIR = Path('bugged_auctions')
+STORE_NAME = 'quarantine.jsonl.gz'
+KEPT_FIELDS = ('uuid', 'auction_id', 'starting_bid', 'price', 'bin', 'item_bytes')
+
+
+def content_hash(item_bytes: str) -> str:
+    return hashlib.blake2b((item_bytes or '').encode(), digest_size=16).hexdigest()
+
+
+def error_text(e) -> str:
+    return e if isinstance(e, str) else f"{type(e).__name__}: {e}"
+
+
+class QuarantineStore:
+    def __init__(self, root: Path = QUARANTINE_DIR, logger_conf: tuple = ('quarantine', 'quarantine.log')):
+        self.root = root
+        self.path = root / STORE_NAME
+        self.logger_conf = logger_conf
+        self._logger = None
+        self._known = None #content hashes already stored, loaded on first add()
+        self._pending = []
+        self.duplicates = 0
+
+    @property
+    def logger(self):
+        if self._logger is None:
+            self._logger = setup_logger(*self.logger_conf)
+        return self._logger
+
+    def records(self):
+        if not self.path.exists():
+            return
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f: #one gzip member per flush, read as a single stream
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def _load_known(self):
+        if self._known is None:
+            self._known = {record['hash'] for record in self.records()}
+
+    def add(self, auction, error, source: str | None = None, snapshot_ts: int | None = None) -> bool:
+        """Buffer a failed auction. Returns False if the same item_bytes is already quarantined."""
+        self._load_known()
+        digest = content_hash(auction.get('item_bytes'))
+        if digest in self._known:
+            self.duplicates += 1
+            return False
+        self._known.add(digest)
+        self._pending.append({
+            'hash': digest,
+            'auction': {key: auction[key] for key in KEPT_FIELDS if key in auction},
+            'error': error_text(error),
+            'source': source,
+            'snapshot_ts': snapshot_ts,
+            'quarantined_at': int(time.time()),
+        })
+        return True
+
+    def flush(self) -> int:
+        """Append the buffered entries in one write. Returns how many were written."""
+        if not self._pending and not self.duplicates:
+            return 0
+        pending, duplicates = self._pending, self.duplicates
+        self._pending, self.duplicates = [], 0
+        if pending:
+            try:
+                self.root.mkdir(parents=True, exist_ok=True)
+                with gzip.open(self.path, 'at', encoding='utf-8', compresslevel=utils.JSONL_GZ_LEVEL) as f:
+                    utils.write_jsonl_lines(f, pending)
+            except Exception:
+                #not stored, the same auctions are quarantined again the next time they fail
+                self._known.difference_update(record['hash'] for record in pending)
+                raise
+        self.logger.info(f"Quarantined {len(pending)} auctions ({duplicates} already quarantined).")
+        return len(pending)
+
+    def rewrite(self, records: list):
+        #atomic replace, a crash mid-write keeps the old store
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        with gzip.open(tmp, 'wt', encoding='utf-8', compresslevel=utils.JSONL_GZ_LEVEL) as f:
+            utils.write_jsonl_lines(f, records)
+        os.replace(tmp, self.path)
+        self._known = {record['hash'] for record in records}
+
+    def replay(self, parser, output_dir: Path | None = None, dry_run: bool = False) -> tuple[int, int]:
+        """
+        Run filter_single_auction over every quarantined auction again, e.g. after a parser fix.
+        Fixed auctions are written as a parsed .jsonl.gz to output_dir (ready for DataLoader) and dropped from
+        the store; the rest stay with their new error. Returns (fixed, still failing).
+        """
+        from constants import key_extra
+
+        fixed, remaining = [], []
+        for record in self.records():
+            try:
+                parsed = parser.filter_single_auction(record['auction'], key_extra)
+                parsed['snapshot_ts'] = record.get('snapshot_ts')
+                fixed.append(parsed)
+            except Exception as e:
+                record['error'] = error_text(e)
+                remaining.append(record)
+
+        if fixed and not dry_run:
+            output_dir = output_dir or parser.output_parsed_path
+            written = utils.export_to_jsonl_gz(fixed, output_dir, 'replayed', create_folder=True, time_stamp=True)
+            if written is None:
+                raise OSError(f"Could not write replayed auctions to {output_dir}")
+            self.rewrite(remaining)
+        self.logger.info(f"Replay: {len(fixed)} fixed, {len(remaining)} still failing{' (dry run)' if dry_run else ''}.")
+        return len(fixed), len(remaining)
+
+    def stats(self) -> dict:
+        errors = {}
+        total = 0
+        for record in self.records():
+            total += 1
+            errors[record['error']] = errors.get(record['error'], 0) + 1
+        return {'total': total, 'errors': dict(sorted(errors.items(), key=lambda item: -item[1]))}
+
+
+def main(argv=None) -> int:
+    arg_parser = argparse.ArgumentParser(description="Inspect or replay quarantined auctions.")
+    arg_parser.add_argument('command', choices=('stats', 'replay'))
+    arg_parser.add_argument('--store', type=Path, default=QUARANTINE_DIR)
+    arg_parser.add_argument('--output', type=Path, default=Path('parsed'), help="where replayed auctions are written")
+    arg_parser.add_argument('--dry-run', action='store_true', help="only report what would be fixed")
+    args = arg_parser.parse_args(argv)
+
+    store = QuarantineStore(args.store)
+    if args.command == 'stats':
+        print(json.dumps(store.stats(), indent=4))
+        return 0
+
+    from parser import Parser
+    parser = Parser(('quarantine_replay', 'quarantine.log'), args.output, None, quarantine=store)
+    fixed, remaining = store.replay(parser, args.output, dry_run=args.dry_run)
+    print(f"{fixed} fixed, {remaining} still failing.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
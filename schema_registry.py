@@ -0,0 +1,154 @@
+import json
+import re
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from logger_config import setup_logger
+from database_setup import DDL_STATEMENTS, MIGRATIONS
+from constants import key_extra
+
+"""
+Canonical dtypes of the auction columns, recorded once and reused for every batch.
+Seeded from the `auctions` DDL (INTEGER / REAL / TEXT); columns that are not in the DDL (flattened key_extra
+attributes, features) get their kind inferred once, the first time they show up.
+Integer columns use the smallest width that fits the values seen so far and are only ever widened.
+"""
+
+CATEGORICAL_COLUMNS = {'item_id', 'modifier', 'tier'}
+INT_WIDTHS = ('int8', 'int16', 'int32', 'int64')
+_SQL_KIND = {'INTEGER': 'int', 'REAL': 'float', 'TEXT': 'str'}
+_KIND_SQL = {'int': 'INTEGER', 'float': 'REAL', 'str': 'TEXT', 'category': 'TEXT'}
+
+
+def to_int(value):
+    #only integral values, 3.7 is kept as it is (stored as REAL, as before the registry) instead of truncated to 3
+    if isinstance(value, float) and not value.is_integer():
+        return value
+    return int(value)
+
+
+def ddl_columns(table: str) -> dict[str, str]:
+    """column -> SQL type of a table from database_setup.DDL_STATEMENTS and the columns added by MIGRATIONS."""
+    columns = {}
+    for ddl in DDL_STATEMENTS:
+        match = re.search(rf'CREATE TABLE IF NOT EXISTS {table} \((.*)\);', ddl, re.DOTALL)
+        if match:
+            for line in match.group(1).split(','):
+                parts = line.split()
+                if len(parts) >= 2 and parts[1] in _SQL_KIND:
+                    columns[parts[0]] = parts[1]
+
+    for _, _, statements in MIGRATIONS:
+        for statement in statements:
+            match = re.search(rf'ALTER TABLE {table} ADD COLUMN (\w+) (\w+)', statement)
+            if match and match.group(2) in _SQL_KIND:
+                columns[match.group(1)] = match.group(2)
+    return columns
+
+
+class SchemaRegistry:
+    def __init__(self, path: Path | None = None, logger_conf: tuple = ('schema_registry', 'schema_registry.log')):
+        self.logger = setup_logger(*logger_conf)
+        self.path = path
+        self.dtypes = {} #column -> 'int8'..'int64' | 'float64' | 'str' | 'category'
+
+        for column, sql_type in ddl_columns('auctions').items():
+            kind = _SQL_KIND[sql_type]
+            if column in CATEGORICAL_COLUMNS:
+                self.dtypes[column] = 'category'
+            else:
+                self.dtypes[column] = {'int': 'int8', 'float': 'float64', 'str': 'str'}[kind]
+        for column in CATEGORICAL_COLUMNS:
+            self.dtypes.setdefault(column, 'category')
+        self.expected = set(self.dtypes) | set(key_extra)
+
+        if path is not None and path.exists():
+            with path.open('r', encoding='utf-8') as f:
+                self.dtypes.update(json.load(f))
+
+    def save(self):
+        if self.path is not None:
+            with self.path.open('w', encoding='utf-8') as f:
+                json.dump(self.dtypes, f, indent=4)
+
+    def _register(self, column: str, series: pd.Series) -> str:
+        inferred = pd.api.types.infer_dtype(series, skipna=True)
+        if inferred in ('integer', 'boolean'):
+            dtype = 'int8'
+        elif inferred in ('floating', 'mixed-integer-float', 'decimal'):
+            #integer columns with gaps arrive as float from the DataFrame constructor
+            dtype = 'int8' if (pd.to_numeric(series.dropna(), errors='coerce') % 1 == 0).all() else 'float64'
+        else:
+            dtype = 'str'
+        self.dtypes[column] = dtype
+        if column not in self.expected:
+            self.logger.info(f"Registered new column {column} as {dtype}")
+        return dtype
+
+    @staticmethod
+    def _to_numeric(series: pd.Series) -> pd.Series | None:
+        numeric = pd.to_numeric(series, errors='coerce')
+        if numeric.isna().sum() > series.isna().sum():
+            return None #non-numeric values
+        return numeric.fillna(0)
+
+    def _cast_numeric(self, column: str, series: pd.Series) -> pd.Series | None:
+        numeric = self._to_numeric(series)
+        if numeric is None or self.dtypes[column] == 'float64':
+            return None if numeric is None else numeric.astype('float64')
+        if (numeric % 1 != 0).any():
+            self.logger.info(f"Widening {column}: {self.dtypes[column]} -> float64")
+            self.dtypes[column] = 'float64'
+            return numeric.astype('float64')
+
+        width = INT_WIDTHS.index(self.dtypes[column])
+        low, high = numeric.min(), numeric.max()
+        while width < len(INT_WIDTHS) - 1 and (low < np.iinfo(INT_WIDTHS[width]).min or high > np.iinfo(INT_WIDTHS[width]).max):
+            width += 1
+        if INT_WIDTHS[width] != self.dtypes[column]:
+            self.logger.info(f"Widening {column}: {self.dtypes[column]} -> {INT_WIDTHS[width]}")
+            self.dtypes[column] = INT_WIDTHS[width]
+        return numeric.astype(self.dtypes[column])
+
+    def cast(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Cast every column to its registered dtype. Numeric gaps become 0 (as the old fillna(0)), text gaps stay null."""
+        for column in df.columns:
+            series = df[column]
+            dtype = self.dtypes.get(column)
+            if dtype is None:
+                if series.isna().all():
+                    continue #nothing to infer from yet, registered once real values show up
+                dtype = self._register(column, series)
+
+            if dtype in INT_WIDTHS or dtype == 'float64':
+                numeric = self._cast_numeric(column, series)
+                if numeric is not None:
+                    df[column] = numeric
+                    continue
+                self.logger.warning(f"Column {column} has non-numeric values, storing as str")
+                dtype = self.dtypes[column] = 'str'
+
+            if dtype == 'category':
+                df[column] = series.astype('category')
+            else:
+                text = series.where(series.isna(), series.astype(str))
+                df[column] = text.astype(pd.StringDtype(na_value=np.nan)) #nan binds as NULL in sqlite3
+        return df
+
+    @staticmethod
+    def _kind(dtype: str) -> str:
+        if dtype in INT_WIDTHS:
+            return 'int'
+        return 'float' if dtype == 'float64' else dtype
+
+    def sql_type(self, column: str) -> str:
+        return _KIND_SQL[self._kind(self.dtypes.get(column, 'str'))]
+
+    def row_converters(self, columns) -> tuple:
+        """Per-column python converters for the loader (to_int / float, None = keep value as it is)."""
+        converters = []
+        for column in columns:
+            dtype = self.dtypes.get(column)
+            kind = self._kind(dtype) if dtype else None
+            converters.append(to_int if kind == 'int' else float if kind == 'float' else None)
+        return tuple(converters)
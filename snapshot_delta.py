@@ -0,0 +1,238 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+from pathlib import Path
+from logger_config import setup_logger
+from auction_cache import SeenAuctionCache
+import utils
+
+"""
+Snapshots stored as changes against the previous one instead of in full.
+DeltaStore.add(snapshot) compares every auction with the previous snapshot by auction id and an 8 byte digest of
+its content and writes one of
+  <lastUpdated>_keyframe.jsonl.gz - the full snapshot, every `keyframe_every` snapshots (and whenever the chain
+                                    cannot continue: first run, state lost, a delta as large as the snapshot)
+  <lastUpdated>_delta.jsonl.gz    - only the new and changed auctions; the header holds the base snapshot and the
+                                    ids of the removed (sold / cancelled / expired) and changed auctions.
+The timestamp comes first so utils.iter_data_files (sorted names) returns the files in snapshot order.
+Both are regular snapshot files (utils.read_records), so Parser / DataLoader take a delta file as a snapshot
+that contains just the auctions worth parsing; there is no need for Parser's seen_cache on top of it.
+Only the digests and end times of the previous snapshot are kept (delta.state, not matched by the snapshot
+globs), the auctions themselves are not. A snapshot with skipped pages only removes auctions whose end has
+passed - a missing page is not a sale - so DataCollector requires all_pages for a DeltaStore.
+
+rebuild() replays the newest keyframe at or before a timestamp and the deltas after it, iter_removals() reads
+the removal events from the file headers only (keyframes after the first one carry the delta header too).
+
+python snapshot_delta.py list --dir snapshots/ [--dir archive/]
+python snapshot_delta.py rebuild 1700000000000 --dir snapshots/ --output rebuilt/
+python snapshot_delta.py removals --dir snapshots/
+"""
+
+KEYFRAME_SUFFIX = '_keyframe'
+DELTA_SUFFIX = '_delta'
+DELTA_HEADER_KEY = 'delta'
+STATE_NAME = 'delta.state' #JSON, but not *.json: the state must never be picked up (and archived) as a snapshot
+_FILE_NAME = re.compile(rf'(\d+)({KEYFRAME_SUFFIX}|{DELTA_SUFFIX}){re.escape(utils.JSONL_GZ_SUFFIX)}')
+
+
+def content_digest(auction: dict) -> int:
+    #every field, bids included; key order is stable in API responses, a reordering only shows up as a change
+    return int.from_bytes(hashlib.blake2b(repr(tuple(auction.values())).encode(), digest_size=8).digest(), 'big')
+
+
+def snapshot_files(*dirs: Path) -> list[tuple[int, str, Path]]:
+    """(lastUpdated, 'keyframe' | 'delta', path) of every stored snapshot in dirs, oldest first."""
+    files = []
+    for directory in dirs:
+        for path in Path(directory).glob(f'*{utils.JSONL_GZ_SUFFIX}'):
+            match = _FILE_NAME.fullmatch(path.name)
+            if match:
+                files.append((int(match.group(1)), 'keyframe' if match.group(2) == KEYFRAME_SUFFIX else 'delta', path))
+    return sorted(files, key=lambda file: (file[0], file[1] == 'delta')) #a keyframe wins over a delta of the same time
+
+
+def read_header(path: Path) -> dict:
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        first = json.loads(f.readline() or '{}')
+    return first.get(utils.SNAPSHOT_HEADER_KEY, {}) if isinstance(first, dict) else {}
+
+
+def rebuild(timestamp: int | None, *dirs: Path) -> tuple[dict, list[dict]]:
+    """Snapshot of `timestamp` (None = newest) as (metadata, auctions), from its keyframe and the deltas after it."""
+    files = [file for file in snapshot_files(*dirs) if timestamp is None or file[0] <= timestamp]
+    keyframes = [i for i, file in enumerate(files) if file[1] == 'keyframe']
+    if not keyframes:
+        raise FileNotFoundError(f"No keyframe at or before {timestamp} in {[str(d) for d in dirs]}")
+    start = keyframes[-1]
+    if timestamp is not None and files[-1][0] != timestamp:
+        raise FileNotFoundError(f"No snapshot with lastUpdated {timestamp}")
+
+    meta, records = utils.read_records(files[start][2])
+    auctions = {SeenAuctionCache.auction_key(auction): auction for auction in records}
+    current_ts = files[start][0]
+    for stamp, kind, path in files[start + 1:]:
+        if kind == 'keyframe':
+            continue #same time as a delta already applied
+        meta, records = utils.read_records(path)
+        delta = meta.get(DELTA_HEADER_KEY, {})
+        if delta.get('base') != current_ts:
+            raise ValueError(f"{path.name} is based on {delta.get('base')}, expected {current_ts} - a delta is missing")
+        for auction_id in delta.get('removed', ()):
+            auctions.pop(auction_id, None)
+        for auction in records:
+            auctions[SeenAuctionCache.auction_key(auction)] = auction
+        current_ts = stamp
+
+    meta = {key: value for key, value in meta.items() if key != DELTA_HEADER_KEY}
+    meta['totalAuctions'] = len(auctions)
+    return meta, list(auctions.values())
+
+
+def iter_removals(*dirs: Path, since: int | None = None):
+    """(lastUpdated of the first snapshot without the auction, auction_id) for every removal, oldest first."""
+    for stamp, _, path in snapshot_files(*dirs):
+        if since is not None and stamp < since:
+            continue
+        for auction_id in read_header(path).get(DELTA_HEADER_KEY, {}).get('removed', ()):
+            yield stamp, auction_id
+
+
+class DeltaStore:
+    def __init__(self, root: Path, keyframe_every: int = 60, max_delta_share: float = 0.5, state_path: Path | None = None,
+                 logger_conf: tuple = ('snapshot_delta', 'snapshot_delta.log')):
+        self.root = root
+        self.keyframe_every = keyframe_every #snapshots per keyframe, 60 = one an hour at one snapshot a minute
+        self.max_delta_share = max_delta_share #larger deltas are written as a keyframe instead
+        self.logger = setup_logger(*logger_conf)
+        self.state_path = state_path or root / STATE_NAME
+        self.last_ts = None
+        self.since_keyframe = 0
+        self.digests = {} #auction_id -> content_digest of the previous snapshot
+        self.ends = {} #auction_id -> end (ms) of the previous snapshot, carried over auctions are dropped after it
+        self._load_state()
+
+    def _load_state(self):
+        if not self.state_path.exists():
+            return
+        try:
+            with self.state_path.open('r', encoding='utf-8') as f:
+                state = json.load(f)
+            self.last_ts, self.since_keyframe = state['last_ts'], state['since_keyframe']
+            self.digests = {auction_id: digest for auction_id, digest, _ in state['digests']}
+            self.ends = {auction_id: end for auction_id, _, end in state['digests'] if end is not None}
+        except (ValueError, KeyError) as e:
+            self.logger.warning(f"Ignoring unreadable delta state {self.state_path}, next snapshot is a keyframe: {e}")
+
+    def _save_state(self):
+        tmp = self.state_path.with_name(self.state_path.name + '.tmp')
+        with tmp.open('w', encoding='utf-8') as f:
+            json.dump({'last_ts': self.last_ts, 'since_keyframe': self.since_keyframe,
+                       'digests': [(auction_id, digest, self.ends.get(auction_id)) for auction_id, digest in self.digests.items()]},
+                      f, separators=(',', ':'))
+        os.replace(tmp, self.state_path)
+
+    def diff(self, auctions, complete: bool = True, now: int | None = None) -> tuple[list, list, list, dict, dict]:
+        """
+        (new auctions, changed auctions, removed ids, digests and end times of this snapshot) against the previous one.
+        An incomplete snapshot (pages skipped) only removes auctions whose end is before `now`, the other auctions it
+        misses are carried over as they were.
+        """
+        previous = self.digests
+        new, changed, current, ends = [], [], {}, {}
+        for auction in auctions:
+            key = SeenAuctionCache.auction_key(auction)
+            digest = current[key] = content_digest(auction)
+            if auction.get('end') is not None:
+                ends[key] = auction['end']
+            old = previous.get(key)
+            if old is None:
+                new.append(auction)
+            elif old != digest:
+                changed.append(auction)
+        missing = previous.keys() - current.keys()
+        if not complete:
+            ended = {key for key in missing if now is not None and self.ends.get(key, now + 1) <= now}
+            for key in missing - ended:
+                current[key] = previous[key]
+                if key in self.ends:
+                    ends[key] = self.ends[key]
+            missing = ended
+        return new, changed, list(missing), current, ends
+
+    def _write(self, path: Path, records, header: dict):
+        #tmp + replace, a reader never sees a half written file in the chain
+        tmp = path.with_name(path.name + '.tmp')
+        utils.write_jsonl_gz(tmp, records, header)
+        os.replace(tmp, path)
+
+    def add(self, snapshot: dict, complete: bool = True) -> Path | None:
+        """Store one API snapshot as a delta or a keyframe. Returns the written file, None if it was already stored."""
+        timestamp = snapshot.get('lastUpdated')
+        if timestamp is None:
+            raise ValueError("Snapshot without lastUpdated")
+        if self.last_ts is not None and timestamp <= self.last_ts:
+            self.logger.info(f"Snapshot {timestamp} is not newer than {self.last_ts}, skipping.")
+            return None
+
+        auctions = snapshot.get('auctions', [])
+        new, changed, removed, current, ends = self.diff(auctions, complete, timestamp)
+        header = {key: value for key, value in snapshot.items() if key != 'auctions'}
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        #a keyframe of an incomplete snapshot would lose the carried over auctions, it waits for a complete one
+        keyframe = self.last_ts is None or complete and (
+            self.since_keyframe + 1 >= self.keyframe_every
+            or len(new) + len(changed) > self.max_delta_share * max(len(auctions), 1))
+        if self.last_ts is not None:
+            #keyframes carry it as well, removals of that snapshot are not lost
+            header[DELTA_HEADER_KEY] = {'base': self.last_ts, 'complete': complete, 'new': len(new),
+                                        'changed': [SeenAuctionCache.auction_key(auction) for auction in changed],
+                                        'removed': removed}
+        if keyframe:
+            path = self.root / f"{timestamp}{KEYFRAME_SUFFIX}{utils.JSONL_GZ_SUFFIX}"
+            self._write(path, auctions, header)
+            self.since_keyframe = 0
+        else:
+            path = self.root / f"{timestamp}{DELTA_SUFFIX}{utils.JSONL_GZ_SUFFIX}"
+            self._write(path, new + changed, header)
+            self.since_keyframe += 1
+
+        self.last_ts = timestamp
+        self.digests = current
+        self.ends = ends
+        self._save_state()
+        self.logger.info(f"Stored {'keyframe' if keyframe else 'delta'} {path.name}: {len(new)} new, "
+                         f"{len(changed)} changed, {len(removed)} removed of {len(auctions)} auctions.")
+        return path
+
+
+def main(argv=None) -> int:
+    arg_parser = argparse.ArgumentParser(description="Inspect snapshots stored as keyframes + deltas.")
+    arg_parser.add_argument('command', choices=('list', 'rebuild', 'removals'))
+    arg_parser.add_argument('timestamp', nargs='?', type=int, help="rebuild: lastUpdated of the snapshot, default newest")
+    arg_parser.add_argument('--dir', type=Path, action='append', help="directory with _keyframe / _delta files, repeatable")
+    arg_parser.add_argument('--output', type=Path, default=Path('.'))
+    args = arg_parser.parse_args(argv)
+    dirs = args.dir or [Path('.')]
+
+    if args.command == 'list':
+        for stamp, kind, path in snapshot_files(*dirs):
+            print(f"{stamp} {kind:8} {path.stat().st_size / 1024:10.1f} KiB  {path}")
+    elif args.command == 'rebuild':
+        meta, auctions = rebuild(args.timestamp, *dirs)
+        path = utils.export_to_jsonl_gz(dict(meta, auctions=auctions), args.output, f"rebuilt_{meta.get('lastUpdated')}",
+                                        create_folder=True)
+        print(f"{len(auctions)} auctions written to {path}")
+    else:
+        for stamp, auction_id in iter_removals(*dirs):
+            print(stamp, auction_id)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
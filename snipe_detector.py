@@ -0,0 +1,190 @@
+import heapq
+import time
+from logger_config import setup_logger, RateLimitFilter
+from parser import Parser
+from utils import tax
+import fast_nbt
+import metrics
+
+"""
+Streaming snipe detection on the snapshots DataCollector downloads, before anything is written to disk.
+Registered as a DataCollector listener, it keeps an order book of the active BIN listings per item:
+a min-heap of (price, auction uuid) per book key plus uuid -> book key for every active listing.
+
+- Auctions already in the book are skipped with one dict lookup; only new listings are decoded, and only
+  ExtraAttributes.id / petInfo / display.Name are read from item_bytes (fast_nbt partial decode).
+- On a complete snapshot (all pages) listings that are gone (sold, cancelled, expired) are dropped from the
+  uuid map; their heap entries are skipped lazily when they reach the top, and a heap is rebuilt once more
+  than half of it is stale, so memory stays proportional to the active listings (~300 B per listing with the end-time heap, uuid string included).
+- Listings whose `end` has passed are dropped on every snapshot, complete or not (end-time heap), so with a
+  page 0 only collector (no removals) the books are still bounded by the listings that can be active.
+- A new listing is flagged when the cheapest other listing of its book, sold after auction tax, beats its
+  price by `margin` of the price and by at least `min_profit` coins: ref - tax(ref) - price >= margin * price.
+  Books with fewer than `min_depth` other listings are never flagged.
+- The first snapshot only fills the books, every listing in it would be "new". Use an all_pages collector:
+  with page 0 only, sold and cancelled listings stay in the books until they expire and can hide a snipe.
+
+Book key: item id, or pet type, rarity and level band (1-9, 10-19, ..., 100) for pets.
+"""
+
+SNIPE_SPEC = {'i': {'tag': {'ExtraAttributes': {'id': None, 'petInfo': None}, 'display': {'Name': None}}}}
+
+SNIPES_FLAGGED = metrics.counter('auction_snipes_flagged_total', 'New listings flagged as snipes')
+DETECT_SECONDS = metrics.histogram('auction_snipe_detect_seconds', 'Time from snapshot received to all new listings checked')
+ACTIVE_LISTINGS = metrics.gauge('auction_snipe_active_listings', 'Listings held in the snipe order books')
+
+
+def book_key(item_bytes: str) -> tuple | None:
+    decoded = fast_nbt.b64_to_dict(item_bytes, SNIPE_SPEC)
+    tag = Parser.item_tag(decoded)
+    extra = tag.get('ExtraAttributes') or {}
+    item_id = extra.get('id')
+    if item_id != 'PET':
+        return (item_id,) if item_id else None
+
+    pet_type, tier = Parser.decode_petinfo(extra.get('petInfo'))[:2]
+    level, _ = Parser.decode_name((tag.get('display') or {}).get('Name'))
+    return pet_type, tier, (level or 0) // 10 * 10
+
+
+class SnipeDetector:
+    def __init__(self, logger_conf: tuple = ('snipe_detector', 'snipe_detector.log'), margin: float = 0.1,
+                 min_profit: float = 0, min_depth: int = 2, on_snipe=None):
+        self.logger = setup_logger(*logger_conf, async_mode=True, rate_limit=RateLimitFilter())
+        self.margin = margin
+        self.min_profit = min_profit
+        self.min_depth = min_depth
+        self.on_snipe = on_snipe #callback(snipe dict) for every flagged listing
+
+        self.books = {} #book key -> heap of (price, uuid), may hold stale entries
+        self.live = {} #book key -> number of active listings
+        self.listings = {} #uuid -> book key of every active listing
+        self._keys = {} #interned book keys, one tuple per item instead of one per listing
+        self._expiry = [] #heap of (end ms, uuid), may hold entries of listings already removed
+        self.warm = False
+        self._warned_incomplete = False
+
+    def __call__(self, data: dict, complete: bool = True) -> list[dict]:
+        return self.on_snapshot(data, complete)
+
+    def _add(self, uuid: str, key: tuple, price, end=None):
+        key = self._keys.setdefault(key, key)
+        self.listings[uuid] = key
+        self.live[key] = self.live.get(key, 0) + 1
+        heapq.heappush(self.books.setdefault(key, []), (price, uuid))
+        if end is not None:
+            heapq.heappush(self._expiry, (end, uuid))
+
+    def _remove(self, uuid: str):
+        key = self.listings.pop(uuid)
+        self.live[key] -= 1
+        heap = self.books[key]
+        if not self.live[key]:
+            del self.books[key], self.live[key], self._keys[key]
+        elif len(heap) > 2 * self.live[key] + 8: #mostly stale, rebuild from the active entries
+            heap[:] = [entry for entry in heap if self.listings.get(entry[1]) is key]
+            heapq.heapify(heap)
+
+    def _expire(self, now) -> int:
+        #listings past their end are gone whether or not the snapshot showed it
+        expired = 0
+        while self._expiry and self._expiry[0][0] <= now:
+            _, uuid = heapq.heappop(self._expiry)
+            if uuid in self.listings:
+                self._remove(uuid)
+                expired += 1
+        if len(self._expiry) > 2 * len(self.listings) + 64: #mostly removed listings, rebuild
+            self._expiry = [entry for entry in self._expiry if entry[1] in self.listings]
+            heapq.heapify(self._expiry)
+        return expired
+
+    def _top(self, heap: list):
+        #drop stale entries until the cheapest active one is on top
+        while heap and self.listings.get(heap[0][1]) is None:
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def lowest(self, key: tuple, exclude: str | None = None):
+        """Cheapest active (price, uuid) of a book, skipping the listing `exclude`."""
+        heap = self.books.get(key)
+        if not heap:
+            return None
+        top = self._top(heap)
+        if top is None or top[1] != exclude:
+            return top
+        heapq.heappop(heap)
+        second = self._top(heap)
+        heapq.heappush(heap, top)
+        return second
+
+    def _check(self, uuid: str, key: tuple, price, auction: dict) -> dict | None:
+        if self.live.get(key, 0) - 1 < self.min_depth:
+            return None
+        reference = self.lowest(key, exclude=uuid)
+        if reference is None:
+            return None
+        ref_price = reference[0]
+        profit = ref_price - tax(ref_price) - price
+        if profit < self.margin * price or profit < self.min_profit:
+            return None
+        return {'auction_id': uuid, 'book': key, 'price': price, 'reference': ref_price, 'profit': profit,
+                'seller': auction.get('auctioneer'), 'start': auction.get('start')}
+
+    def on_snapshot(self, data: dict, complete: bool = True) -> list[dict]:
+        """Update the books with one snapshot and return the new listings flagged as snipes."""
+        received = time.perf_counter()
+        listings = self.listings
+        now = data.get('lastUpdated') or int(time.time() * 1000)
+        expired = self._expire(now)
+        current = {auction.get('uuid'): auction for auction in data.get('auctions', ()) if auction.get('bin')}
+        #set differences run in C, the only python loop over every listing is the dict above
+        if complete:
+            for uuid in listings.keys() - current.keys():
+                self._remove(uuid)
+        elif not self._warned_incomplete:
+            self._warned_incomplete = True
+            self.logger.warning("Incomplete snapshot (collector without all_pages?): sold listings are only dropped once they expire.")
+        new = [current[uuid] for uuid in current.keys() - listings.keys()]
+
+        added = []
+        for auction in new:
+            uuid = auction.get('uuid')
+            try:
+                key = book_key(auction['item_bytes'])
+            except Exception as e:
+                self.logger.warning(f"Could not decode auction {uuid}: {type(e).__name__}: {e}")
+                continue
+            price, end = auction.get('starting_bid'), auction.get('end')
+            if key is None or price is None or (end is not None and end <= now):
+                continue
+            self._add(uuid, key, price, end)
+            added.append((uuid, key, price, auction))
+
+        #checked once every new listing is in the books, two new listings of one item are compared with each other
+        snipes = []
+        if self.warm:
+            for uuid, key, price, auction in added:
+                snipe = self._check(uuid, key, price, auction)
+                if snipe is not None:
+                    snipes.append(snipe)
+                    self._report(snipe)
+        else:
+            self.warm = True
+
+        elapsed = time.perf_counter() - received
+        DETECT_SECONDS.observe(elapsed)
+        ACTIVE_LISTINGS.set(len(listings))
+        self.logger.info(f"{len(added)} new listings, {expired} expired, {len(listings)} active, {len(snipes)} snipes "
+                         f"in {elapsed * 1000:.1f} ms")
+        return snipes
+
+    def _report(self, snipe: dict):
+        SNIPES_FLAGGED.inc()
+        self.logger.info(f"Snipe: {snipe['auction_id']} {snipe['book']} for {snipe['price']:,.0f}, "
+                         f"lowest other {snipe['reference']:,.0f}, profit after tax {snipe['profit']:,.0f}")
+        if self.on_snipe is not None:
+            self.on_snipe(snipe)
+
+    def stats(self) -> dict:
+        return {'active': len(self.listings), 'books': len(self.books),
+                'heap_entries': sum(len(heap) for heap in self.books.values()), 'expiry_entries': len(self._expiry)}
@@ -0,0 +1,12 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture(autouse=True)
+def _work_dir(tmp_path, monkeypatch):
+    #setup_logger writes to ./logs, keep it out of the repo
+    monkeypatch.chdir(tmp_path)
@@ -0,0 +1,48 @@
+from auction_cache import SeenAuctionCache
+
+
+def auction(uuid: str, price: int = 100) -> dict:
+    return {'uuid': uuid, 'item_bytes': f'bytes {uuid}', 'starting_bid': price}
+
+
+def test_stage_commit_discard_cycle(tmp_path):
+    cache = SeenAuctionCache(tmp_path / 'seen.json')
+    first = [auction('a'), auction('b'), auction('c')]
+    fresh, current = cache.diff(first)
+    assert fresh == first
+
+    #staged: the next diff starts from it, nothing is on disk yet
+    cache.stage(current, failed={'c'})
+    assert cache.pending is current and 'c' not in current
+    fresh, _ = cache.diff(first)
+    assert fresh == [auction('c')] #failed auctions are decoded again
+    assert cache.entries == {} and not cache.path.exists()
+
+    cache.commit(current)
+    assert cache.pending is None
+    assert SeenAuctionCache(tmp_path / 'seen.json').entries == current
+
+    #second snapshot: b changed its price, a is gone, d is new
+    second = [auction('b', 200), auction('c'), auction('d')]
+    fresh, staged = cache.diff(second)
+    assert [a['uuid'] for a in fresh] == ['b', 'c', 'd']
+    cache.stage(staged)
+    cache.discard_pending({}) #another snapshot's digests leave it staged
+    assert cache.pending is staged
+    cache.discard_pending(staged)
+    assert cache.pending is None
+    assert cache.diff(second)[0] == fresh #discarded, diffed against the committed snapshot again
+
+    cache.stage(staged)
+    cache.discard_pending()
+    assert cache.pending is None and cache.entries == current
+
+
+def test_commit_evicts_missing_auctions_and_keeps_newest(tmp_path):
+    cache = SeenAuctionCache(tmp_path / 'seen.json', max_size=2)
+    _, current = cache.diff([auction('a'), auction('b'), auction('c')])
+    cache.commit(current)
+    assert list(cache.entries) == ['b', 'c']
+    _, current = cache.diff([auction('c')])
+    cache.commit(current)
+    assert list(cache.entries) == ['c']
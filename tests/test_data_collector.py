@@ -0,0 +1,138 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from data_collector import DataCollector
+
+
+def snapshot_pages(last_updated: int, total_pages: int = 3, per_page: int = 2) -> list[dict]:
+    return [{'success': True, 'page': page, 'totalPages': total_pages, 'totalAuctions': total_pages * per_page,
+             'lastUpdated': last_updated,
+             'auctions': [{'uuid': f'{last_updated}-{page}-{i}', 'starting_bid': 100} for i in range(per_page)]}
+            for page in range(total_pages)]
+
+
+class StubApi:
+    """Local http.server with a scripted auctions endpoint: ETag / 304 on page 0, hooks to change pages mid-fetch."""
+
+    def __init__(self, pages: list[dict]):
+        self.pages = pages
+        self.requests = []
+        self.on_request = None #callable(page) run before each answer, may swap self.pages
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                page = int(parse_qs(urlparse(self.path).query).get('page', ['0'])[0])
+                api.requests.append(page)
+                if api.on_request is not None:
+                    api.on_request(page)
+                body = api.pages[page]
+                etag = f'"{body["lastUpdated"]}"'
+                if page == 0 and self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                payload = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                if page == 0:
+                    self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/skyblock/auctions'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def make_collector(tmp_path, url, **kwargs) -> DataCollector:
+    kwargs.setdefault('all_pages', True)
+    kwargs.setdefault('storage_format', 'jsonl.gz')
+    return DataCollector(url, tmp_path / 'out', 'snapshot', tmp_path / 'last_update.txt', ('test_collector', 'test.log'),
+                         max_workers=2, retries=2, backoff=0, timeout=5, **kwargs)
+
+
+def test_fetch_all_pages_merges_every_page(tmp_path):
+    with StubApi(snapshot_pages(1000)) as api:
+        data = make_collector(tmp_path, api.url).fetch_all_pages()
+    assert data['lastUpdated'] == 1000
+    assert [a['uuid'] for a in data['auctions']] == [f'1000-{p}-{i}' for p in range(3) for i in range(2)]
+    assert data['totalAuctions'] == 6
+
+
+def test_stale_page_is_fetched_again(tmp_path):
+    with StubApi(snapshot_pages(1000)) as api:
+        stale = snapshot_pages(900)[2]
+        fresh = api.pages[2]
+        api.pages[2] = stale
+
+        def heal(page):
+            if page == 2 and api.requests.count(2) == 2:
+                api.pages[2] = fresh
+        api.on_request = heal
+        collector = make_collector(tmp_path, api.url)
+        data = collector.fetch_all_pages()
+    assert api.requests.count(2) == 2
+    assert {a['uuid'].split('-')[0] for a in data['auctions']} == {'1000'}
+    assert collector.last_fetch_complete
+
+
+def test_refresh_mid_fetch_restarts_against_new_snapshot(tmp_path):
+    with StubApi(snapshot_pages(1000)) as api:
+        newer = snapshot_pages(2000, total_pages=2)
+
+        def refresh(page):
+            if page == 2: #page 1 may already be from the old snapshot
+                api.pages = newer + [newer[0]]
+        api.on_request = refresh
+        data = make_collector(tmp_path, api.url).fetch_all_pages()
+    assert data['lastUpdated'] == 2000
+    assert {a['uuid'].split('-')[0] for a in data['auctions']} == {'2000'}
+    assert len(data['auctions']) == 4
+
+
+def test_never_consistent_returns_nothing(tmp_path):
+    with StubApi(snapshot_pages(1000)) as api:
+        api.pages[1] = snapshot_pages(900)[1]
+        collector = make_collector(tmp_path, api.url)
+        assert collector.fetch_all_pages() is None
+    assert not collector.last_fetch_complete
+
+
+def test_fetch_new_writes_once_and_answers_304(tmp_path):
+    with StubApi(snapshot_pages(1000)) as api:
+        collector = make_collector(tmp_path, api.url)
+        assert collector.fetch_new() is not None
+        requests_after_first = len(api.requests)
+        assert collector.fetch_new() is None
+        assert api.requests[requests_after_first:] == [0] #only the conditional probe
+    assert len(list((tmp_path / 'out').iterdir())) == 1
+
+
+def test_failed_export_is_retried_on_next_poll(tmp_path):
+    with StubApi(snapshot_pages(1000)) as api:
+        collector = make_collector(tmp_path, api.url)
+        (tmp_path / 'out').write_text('not a directory') #export cannot create its folder
+        assert collector.fetch_new() is None
+        assert not (tmp_path / 'last_update.txt').exists()
+
+        (tmp_path / 'out').unlink()
+        assert collector.fetch_new() is not None #no 304, the snapshot is downloaded again
+    assert (tmp_path / 'last_update.txt').read_text() == '1000'
+    assert len(list((tmp_path / 'out').iterdir())) == 1
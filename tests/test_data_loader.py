@@ -0,0 +1,42 @@
+import shutil
+import sqlite3
+
+import pytest
+
+pytest.importorskip('constants') #parser / loader need the (not published) constants module
+import benchmark
+import utils
+from data_loader import DataLoader, BULK_QUERIES
+from database_setup import db_setup
+from parser import Parser
+
+
+@pytest.fixture
+def parsed_dir(tmp_path):
+    snapshot = benchmark.synthetic_snapshot(600, seed=5)
+    auctions = snapshot['auctions']
+    for i in range(6): #overlapping windows, the same auctions show up in several files
+        part = dict(snapshot, auctions=auctions[i * 80:i * 80 + 240], lastUpdated=1_000 + i)
+        utils.export_to_jsonl_gz(part, tmp_path / 'raw', f'snap_{i:02d}', create_folder=True)
+    with Parser(('test_parser', 'test.log'), tmp_path / 'parsed', tmp_path / 'raw_archive') as parser:
+        for source in utils.iter_data_files(tmp_path / 'raw'):
+            assert parser.parse(source)
+    return tmp_path / 'parsed'
+
+
+def load(tmp_path, parsed_dir, name: str, **kwargs) -> dict:
+    input_dir = tmp_path / f'input_{name}'
+    shutil.copytree(parsed_dir, input_dir) #load_from_dir archives its input
+    db_path = tmp_path / f'{name}.db'
+    db_setup(db_path)
+    DataLoader(('test_loader', 'test.log'), input_dir, db_path, tmp_path / f'archive_{name}', **kwargs).load_from_dir()
+    assert not utils.iter_data_files(input_dir)
+    with sqlite3.connect(db_path) as conn:
+        return {table: sorted(conn.execute(f'SELECT * FROM {table}').fetchall(), key=repr) for table in BULK_QUERIES}
+
+
+def test_concurrent_load_writes_the_same_rows_as_executemany(tmp_path, parsed_dir):
+    serial = load(tmp_path, parsed_dir, 'serial', processes=1, files_per_commit=2)
+    concurrent = load(tmp_path, parsed_dir, 'concurrent', processes=2, rows_per_commit=100)
+    assert serial['auctions']
+    assert concurrent == serial
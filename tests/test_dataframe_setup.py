@@ -0,0 +1,26 @@
+import logging
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('constants') #schema_registry / dataframe_setup need the (not published) constants
+pytest.importorskip('auction_filter') #and auction_filter
+import dataframe_setup
+from schema_registry import SchemaRegistry
+
+
+def test_column_null_first_and_int_later_is_stored_as_integer(tmp_path):
+    registry = SchemaRegistry(None)
+    sink = dataframe_setup.SqliteSink(tmp_path / 'dataframe.db', logging.getLogger('test_dataframe'), registry)
+    chunks = [pd.DataFrame({'auction_id': ['a', 'b'], 'price': [1.0, 2.0], 'new_attr': [None, None]}),
+              pd.DataFrame({'auction_id': ['c'], 'price': [3.0], 'new_attr': [5]})]
+    try:
+        assert sink.committed_files() == set() #creates the progress table, as stream_build does
+        for i, chunk in enumerate(chunks):
+            sink.write(registry.cast(chunk), [f'file{i}'])
+        rows = sink.con.execute("SELECT auction_id, new_attr, typeof(new_attr) FROM auctions_processed ORDER BY auction_id").fetchall()
+        declared = {row[1]: row[2] for row in sink.con.execute("PRAGMA table_info(auctions_processed)")}
+    finally:
+        sink.close()
+    assert rows == [('a', None, 'null'), ('b', None, 'null'), ('c', 5, 'integer')]
+    assert declared['new_attr'] == 'INTEGER'
@@ -0,0 +1,152 @@
+import base64
+import gzip
+import random
+import struct
+
+import pytest
+
+import fast_nbt
+import utils
+from fast_nbt import (TAG_BYTE, TAG_SHORT, TAG_INT, TAG_LONG, TAG_FLOAT, TAG_DOUBLE, TAG_BYTE_ARRAY, TAG_STRING,
+                      TAG_LIST, TAG_COMPOUND, TAG_INT_ARRAY, TAG_LONG_ARRAY, TAG_END)
+
+#typed NBT values for the encoder below: (tag id, value); list value = (item tag id, [values]), compound = {name: typed}
+_SCALAR = {TAG_BYTE: '>b', TAG_SHORT: '>h', TAG_INT: '>i', TAG_LONG: '>q', TAG_FLOAT: '>f', TAG_DOUBLE: '>d'}
+_ARRAY = {TAG_BYTE_ARRAY: 'b', TAG_INT_ARRAY: 'i', TAG_LONG_ARRAY: 'q'}
+
+
+def _name(text: str) -> bytes:
+    raw = text.encode('utf-8')
+    return struct.pack('>H', len(raw)) + raw
+
+
+def payload(tag_id: int, value) -> bytes:
+    if tag_id in _SCALAR:
+        return struct.pack(_SCALAR[tag_id], value)
+    if tag_id in _ARRAY:
+        return struct.pack(f'>i{len(value)}{_ARRAY[tag_id]}', len(value), *value)
+    if tag_id == TAG_STRING:
+        return _name(value)
+    if tag_id == TAG_LIST:
+        item_id, items = value
+        return bytes([item_id]) + struct.pack('>i', len(items)) + b''.join(payload(item_id, item) for item in items)
+    if tag_id == TAG_COMPOUND:
+        return b''.join(bytes([child_id]) + _name(key) + payload(child_id, child)
+                        for key, (child_id, child) in value.items()) + bytes([TAG_END])
+    raise TypeError(tag_id)
+
+
+def item_bytes(root: dict, compress: bool = True) -> str:
+    raw = bytes([TAG_COMPOUND]) + _name('') + payload(TAG_COMPOUND, root)
+    return base64.b64encode(gzip.compress(raw) if compress else raw).decode('ascii')
+
+
+def expected(b64: str):
+    return fast_nbt._normalize(utils.nbt_base64_to_dict(b64))
+
+
+EVERY_TAG = {
+    'byte': (TAG_BYTE, -128), 'byte_max': (TAG_BYTE, 127),
+    'short': (TAG_SHORT, -32768), 'int': (TAG_INT, 2**31 - 1), 'long': (TAG_LONG, -2**63),
+    'float': (TAG_FLOAT, 0.15625), 'double': (TAG_DOUBLE, -1.0e300),
+    'string': (TAG_STRING, '§6Hyperion ✪✪✪'), 'empty_string': (TAG_STRING, ''),
+    'byte_array': (TAG_BYTE_ARRAY, [1, -2, 127]), 'int_array': (TAG_INT_ARRAY, [0, -1, 2**31 - 1]),
+    'long_array': (TAG_LONG_ARRAY, [2**40, -2**63]),
+    'empty_int_array': (TAG_INT_ARRAY, []), 'empty_long_array': (TAG_LONG_ARRAY, []),
+    'compound': (TAG_COMPOUND, {'inner': (TAG_COMPOUND, {'deep': (TAG_STRING, 'x')}), 'empty': (TAG_COMPOUND, {})}),
+}
+
+LISTS = {
+    'empty_list': (TAG_LIST, (TAG_END, [])),
+    'empty_int_list': (TAG_LIST, (TAG_INT, [])),
+    'shorts': (TAG_LIST, (TAG_SHORT, [1, -1, 300])),
+    'longs': (TAG_LIST, (TAG_LONG, [2**50, -3])),
+    'floats': (TAG_LIST, (TAG_FLOAT, [0.5, -2.25])),
+    'strings': (TAG_LIST, (TAG_STRING, ['§7Lore', '', 'line'])),
+    'nested': (TAG_LIST, (TAG_LIST, [(TAG_INT, [1, 2]), (TAG_END, []), (TAG_STRING, ['a'])])),
+    'compounds': (TAG_LIST, (TAG_COMPOUND, [{'a': (TAG_INT, 1)}, {}, {'b': (TAG_LIST, (TAG_BYTE, [1]))}])),
+    'arrays': (TAG_LIST, (TAG_INT_ARRAY, [[1, 2], []])),
+}
+
+
+def item_root(extra: dict) -> dict:
+    #API shape: {'i': [{'id', 'Count', 'tag': {...}}]}
+    tag = {'display': (TAG_COMPOUND, {'Name': (TAG_STRING, '§dWithered Hyperion'),
+                                      'Lore': (TAG_LIST, (TAG_STRING, ['§7Damage: §c+260', '']))}),
+           'SkullOwner': (TAG_COMPOUND, {'Id': (TAG_STRING, 'abc'), 'Properties': (TAG_COMPOUND, {'textures': (
+               TAG_LIST, (TAG_COMPOUND, [{'Value': (TAG_STRING, 'e' * 500)}]))})}),
+           'ExtraAttributes': (TAG_COMPOUND, extra)}
+    item = {'id': (TAG_SHORT, 267), 'Count': (TAG_BYTE, 1), 'Damage': (TAG_SHORT, 0), 'tag': (TAG_COMPOUND, tag)}
+    return {'i': (TAG_LIST, (TAG_COMPOUND, [item]))}
+
+
+@pytest.mark.parametrize('name', sorted({**EVERY_TAG, **LISTS}))
+def test_single_tag_matches_nbtlib(name):
+    b64 = item_bytes({name: {**EVERY_TAG, **LISTS}[name]})
+    assert fast_nbt.b64_to_dict(b64) == expected(b64)
+
+
+def test_every_tag_in_one_compound_matches_nbtlib():
+    b64 = item_bytes({**EVERY_TAG, **LISTS})
+    decoded = fast_nbt.b64_to_dict(b64)
+    assert decoded == expected(b64)
+    assert decoded['float'] == 0.15625 and decoded['long_array'] == [2**40, -2**63]
+    assert decoded['nested'] == [[1, 2], [], ['a']]
+
+
+def test_uncompressed_item_bytes():
+    root = {**EVERY_TAG, **LISTS}
+    assert fast_nbt.b64_to_dict(item_bytes(root, compress=False)) == fast_nbt.b64_to_dict(item_bytes(root))
+
+
+def test_spec_keeps_only_selected_keys_and_skips_every_tag_type():
+    extra = {**EVERY_TAG, **LISTS, 'id': (TAG_STRING, 'HYPERION')}
+    b64 = item_bytes(item_root(extra))
+    full = expected(b64)
+
+    selected = fast_nbt.b64_to_dict(b64, {'i': {'tag': {'ExtraAttributes': {'id': None, 'compounds': None}}}})
+    assert selected == {'i': [{'tag': {'ExtraAttributes': {'id': 'HYPERION',
+                                                           'compounds': full['i'][0]['tag']['ExtraAttributes']['compounds']}}}]}
+
+
+def test_spec_after_skipped_siblings_reads_the_right_offsets():
+    #every tag type sits before the wanted key, any skip length error shifts the read
+    root = {**EVERY_TAG, **LISTS, 'wanted': (TAG_STRING, 'found'), 'after': (TAG_INT, 7)}
+    b64 = item_bytes(root)
+    assert fast_nbt.b64_to_dict(b64, {'wanted': None, 'after': None}) == {'wanted': 'found', 'after': 7}
+
+
+def test_spec_missing_keys_and_none_spec():
+    b64 = item_bytes(item_root({'id': (TAG_STRING, 'HYPERION')}))
+    assert fast_nbt.b64_to_dict(b64, {'missing': None}) == {}
+    assert fast_nbt.b64_to_dict(b64, {'i': {'tag': {'nope': None}}}) == {'i': [{'tag': {}}]}
+    assert fast_nbt.b64_to_dict(b64, None) == expected(b64)
+
+
+def test_item_spec_matches_full_decode():
+    b64 = item_bytes(item_root({**EVERY_TAG, 'id': (TAG_STRING, 'HYPERION'), 'enchantments': (
+        TAG_COMPOUND, {'sharpness': (TAG_INT, 7), 'ultimate_wise': (TAG_INT, 5)})}))
+    full = expected(b64)['i'][0]['tag']
+    selected = fast_nbt.b64_to_dict(b64, fast_nbt.ITEM_SPEC)['i'][0]['tag']
+    assert selected == {'ExtraAttributes': full['ExtraAttributes'], 'display': full['display']}
+
+
+def test_non_compound_root_is_rejected():
+    raw = bytes([TAG_LIST]) + _name('') + payload(TAG_LIST, (TAG_INT, [1]))
+    with pytest.raises(TypeError):
+        fast_nbt.b64_to_dict(base64.b64encode(raw).decode('ascii'))
+
+
+def test_synthetic_snapshot_items_match_nbtlib():
+    pytest.importorskip('constants') #benchmark imports the parser
+    import benchmark
+
+    rng = random.Random(7)
+    for _ in range(200):
+        root, _, _ = benchmark.synthetic_item(rng)
+        b64 = benchmark.encode_item_bytes(root)
+        full = expected(b64)
+        assert fast_nbt.b64_to_dict(b64) == full
+        selected = fast_nbt.b64_to_dict(b64, fast_nbt.ITEM_SPEC)
+        for item, full_item in zip(selected['i'], full['i']):
+            assert item['tag'] == {key: full_item['tag'][key] for key in item['tag']}
@@ -0,0 +1,69 @@
+import base64
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('constants') #parser needs the (not published) constants module
+import benchmark
+import utils
+from auction_cache import SeenAuctionCache
+from parser import Parser
+from quarantine import QuarantineStore
+
+
+def write_snapshot(directory: Path, name: str, auctions: int = 40, seed: int = 1, broken: int = 0) -> Path:
+    snapshot = benchmark.synthetic_snapshot(auctions, seed)
+    for auction in snapshot['auctions']:
+        auction['bin'] = True
+    for i, auction in enumerate(snapshot['auctions'][:broken]):
+        auction['item_bytes'] = base64.b64encode(f'not nbt {i}'.encode()).decode() #valid base64, not NBT
+    return utils.export_to_jsonl_gz(snapshot, directory, name, create_folder=True)
+
+
+def parsed_ids(path: Path) -> set:
+    return {record['auction_id'] for record in utils.read_records(path)[1]}
+
+
+def test_retry_after_failed_output_write_parses_every_auction(tmp_path, monkeypatch):
+    source = write_snapshot(tmp_path / 'raw', 'snap')
+    cache = SeenAuctionCache(tmp_path / 'seen.json')
+    write = utils.write_jsonl_gz
+    calls = []
+
+    def failing_write(path, records, header=None):
+        calls.append(path)
+        if len(calls) == 1:
+            raise OSError('disk full')
+        return write(path, records, header)
+
+    monkeypatch.setattr(utils, 'write_jsonl_gz', failing_write)
+    with Parser(('test_parser', 'test.log'), tmp_path / 'parsed', tmp_path / 'archive', seen_cache=cache) as parser:
+        assert parser.parse(source) is False
+        assert source.exists() and cache.pending is None and not parser._finished
+
+        assert parser.parse(source) is True
+    assert len(parsed_ids(tmp_path / 'parsed' / source.name)) == 40
+    assert not source.exists() #archived only after the output was written
+    assert len(cache.entries) == 40
+
+
+def test_second_snapshot_is_diffed_against_committed_one(tmp_path):
+    first = write_snapshot(tmp_path / 'raw', 'a', seed=1)
+    with Parser(('test_parser', 'test.log'), tmp_path / 'parsed', tmp_path / 'archive',
+                seen_cache=SeenAuctionCache(tmp_path / 'seen.json')) as parser:
+        assert parser.parse(first)
+        second = write_snapshot(tmp_path / 'raw', 'b', seed=1) #same auctions
+        assert parser.parse(second)
+    assert len(parsed_ids(tmp_path / 'parsed' / first.name)) == 40
+    assert parsed_ids(tmp_path / 'parsed' / second.name) == set()
+
+
+def test_quarantine_is_flushed_when_consumer_stops_early(tmp_path):
+    source = write_snapshot(tmp_path / 'raw', 'snap', broken=5)
+    store = QuarantineStore(tmp_path / 'quarantine')
+    with Parser(('test_parser', 'test.log'), tmp_path / 'parsed', tmp_path / 'archive', quarantine=store) as parser:
+        records = parser.iter_parsed(source)
+        next(records) #the 5 broken auctions come first
+        records.close()
+    assert store.stats()['total'] == 5
+
@@ -0,0 +1,14 @@
+import pytest
+
+from quarantine import QuarantineStore
+
+
+def test_failed_quarantine_write_forgets_the_hashes(tmp_path):
+    (tmp_path / 'quarantine').write_text('not a directory')
+    store = QuarantineStore(tmp_path / 'quarantine')
+    assert store.add({'uuid': 'a', 'item_bytes': 'x'}, 'boom')
+    with pytest.raises(OSError):
+        store.flush()
+    (tmp_path / 'quarantine').unlink()
+    assert store.add({'uuid': 'a', 'item_bytes': 'x'}, 'boom') #not treated as already quarantined
+    assert store.flush() == 1
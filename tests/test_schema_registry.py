@@ -0,0 +1,54 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip('constants') #schema_registry reads key_extra from it
+from schema_registry import SchemaRegistry, to_int
+
+
+def test_integer_columns_are_only_widened(tmp_path):
+    registry = SchemaRegistry(tmp_path / 'schema.json')
+    df = registry.cast(pd.DataFrame({'stars': [1, 5, None]}))
+    assert registry.dtypes['stars'] == 'int8' and str(df['stars'].dtype) == 'int8'
+    assert df['stars'].tolist() == [1, 5, 0]
+
+    df = registry.cast(pd.DataFrame({'stars': [300]}))
+    assert registry.dtypes['stars'] == 'int16' and df['stars'].tolist() == [300]
+    registry.cast(pd.DataFrame({'stars': [2**40]}))
+    assert registry.dtypes['stars'] == 'int64'
+
+    df = registry.cast(pd.DataFrame({'stars': [1, 2]})) #small values keep the wider type
+    assert registry.dtypes['stars'] == 'int64' and str(df['stars'].dtype) == 'int64'
+
+    registry.save()
+    assert SchemaRegistry(tmp_path / 'schema.json').dtypes['stars'] == 'int64'
+
+
+def test_fraction_widens_to_float_and_text_to_str():
+    registry = SchemaRegistry()
+    registry.cast(pd.DataFrame({'level': [1, 2]}))
+    df = registry.cast(pd.DataFrame({'level': [1.5, 2.0]}))
+    assert registry.dtypes['level'] == 'float64' and df['level'].tolist() == [1.5, 2.0]
+    df = registry.cast(pd.DataFrame({'level': [3]}))
+    assert registry.dtypes['level'] == 'float64' and str(df['level'].dtype) == 'float64'
+
+    df = registry.cast(pd.DataFrame({'level': ['high', None]}))
+    assert registry.dtypes['level'] == 'str'
+    assert df['level'].iloc[0] == 'high' and pd.isna(df['level'].iloc[1])
+    assert registry.sql_type('level') == 'TEXT'
+
+
+def test_all_null_column_is_registered_with_its_first_values():
+    registry = SchemaRegistry()
+    registry.cast(pd.DataFrame({'gems': [None, None]}))
+    assert 'gems' not in registry.dtypes
+    registry.cast(pd.DataFrame({'gems': [None, 4]}))
+    assert registry.dtypes['gems'] == 'int8' and registry.sql_type('gems') == 'INTEGER'
+
+
+def test_to_int_and_row_converters():
+    assert to_int(3.0) == 3 and isinstance(to_int(3.0), int)
+    assert to_int(3.7) == 3.7
+    assert to_int(True) == 1
+    registry = SchemaRegistry()
+    registry.cast(pd.DataFrame({'a': [1], 'b': [0.5], 'c': ['x']}))
+    assert registry.row_converters(['a', 'b', 'c', 'unknown']) == (to_int, float, None, None)
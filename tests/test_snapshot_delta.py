@@ -0,0 +1,73 @@
+import random
+
+import pytest
+
+import snapshot_delta
+from snapshot_delta import DeltaStore
+
+
+def auction(i: int, end: int, price: int = 100) -> dict:
+    return {'uuid': f'u{i}', 'end': end, 'starting_bid': price, 'bids': []}
+
+
+def snapshots(count: int, seed: int = 3):
+    """Consecutive snapshots: some auctions end, some get bids, new ones are listed."""
+    rng = random.Random(seed)
+    live = {i: auction(i, 1_000 + 50 * i) for i in range(30)}
+    next_id = 30
+    for step in range(count):
+        timestamp = 1_000 + 10 * step
+        for i in rng.sample(sorted(live), 3):
+            del live[i]
+        for i in rng.sample(sorted(live), 3):
+            live[i] = dict(live[i], bids=live[i]['bids'] + [{'amount': step}])
+        for _ in range(4):
+            live[next_id] = auction(next_id, timestamp + 500)
+            next_id += 1
+        yield {'success': True, 'lastUpdated': timestamp, 'totalAuctions': len(live), 'auctions': list(live.values())}
+
+
+def by_id(auctions) -> dict:
+    return {auction['uuid']: auction for auction in auctions}
+
+
+def test_rebuild_matches_every_full_snapshot(tmp_path):
+    store = DeltaStore(tmp_path, keyframe_every=4)
+    full = list(snapshots(10))
+    for snapshot in full:
+        store.add(snapshot)
+    kinds = [kind for _, kind, _ in snapshot_delta.snapshot_files(tmp_path)]
+    assert kinds.count('keyframe') == 3 and kinds.count('delta') == 7
+
+    for snapshot in full:
+        meta, auctions = snapshot_delta.rebuild(snapshot['lastUpdated'], tmp_path)
+        assert by_id(auctions) == by_id(snapshot['auctions'])
+        assert meta['lastUpdated'] == snapshot['lastUpdated'] and meta['totalAuctions'] == len(snapshot['auctions'])
+    assert snapshot_delta.rebuild(None, tmp_path)[0]['lastUpdated'] == full[-1]['lastUpdated']
+
+
+def test_removals_are_the_auctions_missing_from_the_next_snapshot(tmp_path):
+    store = DeltaStore(tmp_path, keyframe_every=3)
+    full = list(snapshots(6))
+    for snapshot in full:
+        store.add(snapshot)
+    expected = {(after['lastUpdated'], auction_id) for before, after in zip(full, full[1:])
+                for auction_id in by_id(before['auctions']).keys() - by_id(after['auctions']).keys()}
+    assert set(snapshot_delta.iter_removals(tmp_path)) == expected
+
+
+def test_state_survives_restart_and_missing_delta_is_detected(tmp_path):
+    full = list(snapshots(4))
+    store = DeltaStore(tmp_path, keyframe_every=10)
+    store.add(full[0])
+    store.add(full[1])
+    store = DeltaStore(tmp_path, keyframe_every=10) #state read back from delta.state
+    assert store.add(full[1]) is None
+    path = store.add(full[2])
+    assert path.name.endswith('_delta.jsonl.gz')
+    store.add(full[3])
+    assert by_id(snapshot_delta.rebuild(full[3]['lastUpdated'], tmp_path)[1]) == by_id(full[3]['auctions'])
+
+    path.unlink()
+    with pytest.raises(ValueError):
+        snapshot_delta.rebuild(full[3]['lastUpdated'], tmp_path)
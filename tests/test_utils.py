@@ -0,0 +1,23 @@
+import json
+import logging
+
+import utils
+
+
+def test_archive_compresses_legacy_json(tmp_path):
+    source = tmp_path / 'auctions_1.json'
+    source.write_text(json.dumps({'lastUpdated': 1, 'auctions': [{'uuid': 'a'}, {'uuid': 'b'}]}, indent=4))
+    utils.archive(source, tmp_path / 'archive', logger=logging.getLogger('test'), compress=True)
+
+    archived = tmp_path / 'archive' / 'auctions_1.jsonl.gz'
+    assert not source.exists()
+    assert not list((tmp_path / 'archive').glob('*.tmp'))
+    meta, records = utils.read_records(archived)
+    assert meta == {'lastUpdated': 1} and list(records) == [{'uuid': 'a'}, {'uuid': 'b'}]
+
+
+def test_archive_moves_jsonl_gz_as_is(tmp_path):
+    source = utils.export_to_jsonl_gz({'lastUpdated': 2, 'auctions': [{'uuid': 'a'}]}, tmp_path, 'auctions_2')
+    data = source.read_bytes()
+    utils.archive(source, tmp_path / 'archive', logger=logging.getLogger('test'), compress=True)
+    assert (tmp_path / 'archive' / source.name).read_bytes() == data
@@ -7,11 +7,20 @@ from logger_config import setup_logger
 import json
 import datetime
 from pathlib import Path
+import os
 import shutil
+import queue
+from collections import deque
 from logging import Logger
+from typing import Iterator
 
 logger = setup_logger("utils", "utils.log")
 
+JSON_SUFFIX = '.json'
+JSONL_GZ_SUFFIX = '.jsonl.gz'
+JSONL_GZ_LEVEL = 6 #gzip level 6 - close to max ratio at a fraction of level 9 cost
+SNAPSHOT_HEADER_KEY = '__snapshot__' #first line of a raw .jsonl.gz snapshot holds everything except auctions
+
 def decode_nbt(b64: str) -> nbtlib.File:
     raw = base64.b64decode(b64)
     nbt_bytes = gzip.decompress(raw) if raw[:2] == b'\x1f\x8b' else raw
@@ -35,17 +44,18 @@ def nbt_base64_to_dict(b64: str) -> dict:
 
     return py_obj
 
+def _output_path(file_dir_path: Path, file_name: str, suffix: str, time_stamp: bool) -> Path:
+    if time_stamp:
+        t = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        return file_dir_path / f'{file_name}_{t}{suffix}'
+    return file_dir_path / f'{file_name}{suffix}'
+
 def export_to_json(data, file_dir_path: Path, file_name: str, *, create_folder: bool = False, time_stamp=False):
     if not data:
         logger.info("No data provided to export_to_json.")
         return None
 
-    final_path = file_dir_path / f'{file_name}.json'
-
-    if time_stamp:
-        t = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        file_name_new = f'{file_name}_{t}.json'
-        final_path = file_dir_path / file_name_new
+    final_path = _output_path(file_dir_path, file_name, JSON_SUFFIX, time_stamp)
 
     if create_folder:
         final_path.parent.mkdir(parents=True, exist_ok=True)
@@ -53,7 +63,7 @@ def export_to_json(data, file_dir_path: Path, file_name: str, *, create_folder:
     logger.info(f"Exporting data to {final_path}")
     try:
         with final_path.open("w", encoding='utf8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+            json.dump(data, f, ensure_ascii=False, indent=4, default=json_default)
         logger.info("Data exported successfully.")
         return final_path
     except Exception as e:
@@ -61,7 +71,89 @@ def export_to_json(data, file_dir_path: Path, file_name: str, *, create_folder:
         return None
 
 
-def archive(source_path: Path, output_path: Path, logger: Logger, retries=5, delay=0.5):
+def is_jsonl_gz(path: Path) -> bool:
+    return path.name.endswith(JSONL_GZ_SUFFIX)
+
+def open_jsonl_gz(path: Path):
+    return gzip.open(path, "wt", encoding="utf-8", compresslevel=JSONL_GZ_LEVEL)
+
+def json_default(obj):
+    #compact records (auction_record.AuctionRecord) are written in their dict shape
+    if hasattr(obj, 'to_dict'):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def write_jsonl_lines(f, records):
+    for record in records:
+        f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=json_default))
+        f.write("\n")
+
+def write_jsonl_gz(path: Path, records, header: dict | None = None):
+    #one record per line, written as it is produced so the whole payload never has to be serialized at once
+    with open_jsonl_gz(path) as f:
+        if header is not None:
+            write_jsonl_lines(f, [{SNAPSHOT_HEADER_KEY: header}])
+        write_jsonl_lines(f, records)
+
+def export_to_jsonl_gz(data, file_dir_path: Path, file_name: str, *, create_folder: bool = False, time_stamp=False):
+    """Snapshot dict -> header line + one auction per line, list -> one record per line."""
+    if not data:
+        logger.info("No data provided to export_to_jsonl_gz.")
+        return None
+
+    final_path = _output_path(file_dir_path, file_name, JSONL_GZ_SUFFIX, time_stamp)
+
+    if create_folder:
+        final_path.parent.mkdir(parents=True, exist_ok=True)
+
+    if isinstance(data, dict):
+        header = {key: value for key, value in data.items() if key != 'auctions'}
+        records = data.get('auctions', [])
+    else:
+        header, records = None, data
+
+    logger.info(f"Exporting data to {final_path}")
+    try:
+        write_jsonl_gz(final_path, records, header)
+        logger.info("Data exported successfully.")
+        return final_path
+    except Exception as e:
+        logger.error(f"Failed to save data to {final_path}. Error: {e}")
+        return None
+
+def _iter_jsonl_lines(f, first_line: str | None):
+    with f:
+        if first_line:
+            yield json.loads(first_line)
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def read_records(path: Path) -> tuple[dict, Iterator[dict]]:
+    """Return (snapshot metadata, auction iterator) for both .json and .jsonl.gz files."""
+    if is_jsonl_gz(path):
+        f = gzip.open(path, "rt", encoding="utf-8")
+        first_line = f.readline()
+        meta = {}
+        if first_line.strip():
+            first = json.loads(first_line)
+            if isinstance(first, dict) and SNAPSHOT_HEADER_KEY in first:
+                meta, first_line = first[SNAPSHOT_HEADER_KEY], None
+        return meta, _iter_jsonl_lines(f, first_line)
+
+    with path.open("r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        meta = {key: value for key, value in data.items() if key != 'auctions'}
+        return meta, iter(data.get('auctions', []))
+    return {}, iter(data)
+
+def iter_data_files(dir_path: Path) -> list[Path]:
+    files = [file for suffix in (JSON_SUFFIX, JSONL_GZ_SUFFIX) for file in dir_path.glob(f'*{suffix}')]
+    return sorted(files)
+
+
+def archive(source_path: Path, output_path: Path, logger: Logger, retries=5, delay=0.5, compress: bool = False):
     if not source_path.exists():
         logger.warning(f"Plik źródłowy do archiwizacji nie istnieje: {source_path}")
         return
@@ -69,6 +161,21 @@ def archive(source_path: Path, output_path: Path, logger: Logger, retries=5, del
     destination_file = output_path / source_path.name
     output_path.mkdir(parents=True, exist_ok=True)
 
+    if compress and not is_jsonl_gz(source_path):
+        #legacy indented json is re-written as compressed json lines on its way to the archive
+        destination_file = output_path / (source_path.name.removesuffix(JSON_SUFFIX) + JSONL_GZ_SUFFIX)
+        tmp = destination_file.with_name(destination_file.name + '.tmp')
+        try:
+            meta, records = read_records(source_path)
+            write_jsonl_gz(tmp, records, meta or None)
+            os.replace(tmp, destination_file) #never a half written archive under the final name
+            source_path.unlink()
+            logger.info(f"Pomyślnie zarchiwizowano (gzip) {source_path} do {destination_file}")
+        except Exception as e:
+            logger.error(f"Nie udało się zarchiwizować {source_path}. Błąd krytyczny: {e}")
+            tmp.unlink(missing_ok=True)
+        return
+
     for attempt in range(retries):
         try:
             shutil.move(str(source_path), str(destination_file))
@@ -90,3 +197,37 @@ def tax(price: float):
     else:  # 2.5% for 100M+
         return price * 0.025
 
+def bounded_imap(pool, func, items, window: int, ordered: bool = True):
+    """
+    pool.imap / imap_unordered with at most `window` tasks submitted but not consumed yet.
+    Pool.imap submits every task up front and buffers every result until it is read, so a slow consumer
+    holds the results of the whole input in memory; here a new task is submitted only after one is consumed.
+    """
+    window = max(window, 1)
+    if ordered:
+        in_flight = deque()
+        for item in items:
+            if len(in_flight) >= window:
+                yield in_flight.popleft().get()
+            in_flight.append(pool.apply_async(func, (item,)))
+        while in_flight:
+            yield in_flight.popleft().get()
+        return
+
+    done = queue.SimpleQueue() #(ok, result or exception), filled by the pool's result thread
+    in_flight = 0
+    for item in items:
+        if in_flight >= window:
+            ok, result = done.get()
+            in_flight -= 1
+            if not ok:
+                raise result
+            yield result
+        pool.apply_async(func, (item,), callback=lambda result: done.put((True, result)),
+                         error_callback=lambda e: done.put((False, e)))
+        in_flight += 1
+    for _ in range(in_flight):
+        ok, result = done.get()
+        if not ok:
+            raise result
+        yield result